@@ -1,28 +1,60 @@
 __author__ = 'baohua'
 
 from subprocess import call, Popen, PIPE
-import re
 import sys
 import termios
+import time
 
 from easyovs.util import get_all_bridges
-from easyovs.flow import Flow
+from easyovs.flow import Flow, flow_line_fields, output_flows, \
+    parse_flow_counters, sort_flows_per_table, split_actions, top_flow_rates
+from easyovs.flow_index import FlowIndex
+from easyovs.inventory import get_inventory
 from easyovs.log import output, error, debug
-from easyovs.util import get_num_after, get_str_before, get_str_between
+from easyovs.snapshot import Snapshot, is_snapshot
+from easyovs.util import compress_hex_str, get_str_before, get_str_between
 
 
 def check_exist(func):
-    def wrapper(self, *arg):
+    def wrapper(self, *arg, **kwargs):
         if not self.exists():
             output(
                 'The bridge does not exist.\n \
                 Please check available bridges using list\n')
             return None
         else:
-            return func(self, *arg)
+            return func(self, *arg, **kwargs)
     return wrapper
 
 
+def confirm(msg):
+    """
+    Ask the user to confirm with a single key.
+    :param msg: the question, e.g., 'Del the flow?'
+    :return: True or False
+    """
+    output('%s [Y/n]: ' % msg)
+    fd = sys.stdin.fileno()
+    old = termios.tcgetattr(fd)
+    new = termios.tcgetattr(fd)
+    new[3] = new[3] & ~termios.ICANON
+    try:
+        termios.tcsetattr(fd, termios.TCSADRAIN, new)
+        while True:
+            in_ch = sys.stdin.read(1)
+            if in_ch == 'n' or in_ch == 'N':
+                output('\tCancel the deletion.\n')
+                return False
+            elif in_ch == 'y' or in_ch == 'Y' or in_ch != '\n':
+                output('\n')
+                return True
+            else:
+                output('\nWrong, please input [Y/n]: ')
+                continue
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, old)
+
+
 class Bridge(object):
     """
     An OpenvSwitch bridge, typically is a datapath, e.g., br-int
@@ -31,11 +63,18 @@ class Bridge(object):
     def __init__(self, name):
         self.bridge = name
         self.flows = []
+        self.flow_index = None  # index of self.flows, built when searched
         self.flows_db = '/tmp/tmp_%s.flows' % self.bridge
+        self.ports = {}
+        self.port_map = {}  # ofport number --> interface name
+        self.ports_loaded = False
 
     def exists(self):
         if not self.bridge:
             return False
+        inventory = get_inventory()
+        if inventory:
+            return inventory.has_bridge(self.bridge)
         cmd = "ovs-vsctl show|grep -q %s" % self.bridge
         return call(cmd, shell=True) == 0
 
@@ -67,8 +106,6 @@ class Bridge(object):
         if not self.flows:
             self.load_flows()
         del_flows = []
-        fd = sys.stdin.fileno()
-        old = termios.tcgetattr(fd)
         for flow_id in flow_ids:
             if isinstance(flow_id, str) and flow_id.isdigit():
                 flow_id = int(flow_id)
@@ -83,53 +120,82 @@ class Bridge(object):
                 else:
                     Flow.banner_output()
                     del_flow.fmt_output()
-                    output('Del the flow? [Y/n]: ')
-                    new = termios.tcgetattr(fd)
-                    new[3] = new[3] & ~termios.ICANON
-                    try:
-                        termios.tcsetattr(fd, termios.TCSADRAIN, new)
-                        while True:
-                            in_ch = sys.stdin.read(1)
-                            if in_ch == 'n' or in_ch == 'N':
-                                output('\tCancel the deletion.\n')
-                                break
-                            elif in_ch == 'y' or in_ch == 'Y' or in_ch != '\n':
-                                del_flows.append(del_flow)
-                                output('\n')
-                                break
-                            else:
-                                output('\nWrong, please input [Y/n]: ')
-                                continue
-                    finally:
-                        termios.tcsetattr(fd, termios.TCSADRAIN, old)
+                    if confirm('Del the flow?'):
+                        del_flows.append(del_flow)
         if not del_flows:
             return False
-        self.load_flows(True)
-        f = open(self.flows_db, 'r')
-        while True:
-            lines = f.readlines(1000)
-            if not lines:
-                break
-            for line in lines:
-                flow = self._parse_flow(line)
-                if flow in del_flows:
-                    del_matches = line.replace(',', ' ').split()
-                    del_matches = \
-                        filter(lambda m: not (m.startswith("cookie=")
-                               or m.startswith("actions=")), del_matches)
-                    del_cmd = "ovs-ofctl --strict del-flows %s %s" \
-                              % (self.bridge, ','.join(del_matches))
-                    err = Popen(del_cmd, stdout=PIPE, stderr=PIPE,
-                                shell=True).communicate()[1]
-                    if err:
-                        error("Error when delflow <%s> in bridge %s\n"
-                              % (','.join(del_matches), self.bridge))
-                        error(err)
-                        return False
-        f.close()
-        self.load_flows()
+        return self.del_flows(del_flows)
+
+    @check_exist
+    def add_flows(self, flows):
+        """
+        Add the given flows in one bundle transaction, none of them is added
+        if any one fails.
+        Return True or False.
+        """
+        if not flows:
+            return False
+        specs = ''.join(['%s\n' % f for f in flows])
+        err = self._bundle(['add-flows'], specs)
+        self.flows = []  # ids are changed, will be reloaded when needed
+        if err:
+            error("Error when adding %u flows to bridge %s\n"
+                  % (len(flows), self.bridge))
+            error(err)
+            return False
+        return True
+
+    def _bundle(self, args, specs):
+        """
+        Run an ovs-ofctl command of the bridge with flow specs from stdin,
+        as one bundle transaction. It is never run without the bundle, which
+        could leave part of the flows changed.
+        :param args: e.g., ['add-flows']
+        :param specs: the flow lines
+        :return: the error output
+        """
+        cmd = ['ovs-ofctl', '--bundle'] + args + [self.bridge, '-']
+        err = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                    universal_newlines=True).communicate(specs)[1]
+        if err and ('unrecognized option' in err or
+                    'version negotiation failed' in err):
+            err = 'Bundles are not supported by ovs-ofctl or the bridge ' \
+                  '(OpenFlow14 is required, e.g., ovs-vsctl set bridge %s ' \
+                  'protocols=OpenFlow10,OpenFlow14), no flow is changed\n' \
+                  '%s' % (self.bridge, err)
+        return err
+
+    @check_exist
+    def del_flows(self, flows):
+        """
+        Delete the given flows in one bundle transaction, the strict match
+        of each one is computed from the parsed flow.
+        Return True or False.
+        """
+        if not flows:
+            return False
+        specs = ''.join(['%s\n' % f.strict_match() for f in flows])
+        err = self._bundle(['--strict', 'del-flows'], specs)
+        self.flows = []  # ids are changed, will be reloaded when needed
+        if err:
+            error("Error when deleting %u flows in bridge %s\n"
+                  % (len(flows), self.bridge))
+            error(err)
+            return False
         return True
 
+    def find_flows(self, query):
+        """
+        Return the loaded flows matched by all the predicates of the query.
+        The index is built at the first search, and kept until the flows
+        are reloaded.
+        :param query: list of (key, op, value) from parse_query()
+        :return: list of Flow
+        """
+        if self.flow_index is None or self.flow_index.flows is not self.flows:
+            self.flow_index = FlowIndex(self.flows)
+        return self.flow_index.find(query)
+
     @check_exist
     def load_flows(self, db=False):
         """
@@ -137,30 +203,84 @@ class Bridge(object):
         self.flows will be a list of Flow objects
         """
         debug('load_flows():\n')
-        cmd = "ovs-ofctl dump-flows %s" % self.bridge
-        flows, f = [], None
         if db:
-            f = open(self.flows_db, 'w')
-        result, err = \
-            Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True).communicate()
-        if err:
+            with open(self.flows_db, 'w') as f:
+                self.flows = list(self.iter_sorted_flows(db_file=f))
+        else:
+            self.flows = list(self.iter_sorted_flows())
+        debug('load_flows:len flows=%u\n' % len(self.flows))
+
+    def load_saved_flows(self, path):
+        """
+        Load the flows from a snapshot, or from a saved output of ovs-ofctl
+        dump-flows into self.flows. The ports of a snapshot are named by its
+        own port map, the ones of a dump keep the numbers since it may come
+        from another node.
+        :param path: path of the saved file
+        """
+        if is_snapshot(path):
+            snapshot = Snapshot(path)
+            try:
+                self.flows = list(snapshot)
+                self.port_map, self.ports_loaded = snapshot.port_map, True
+            finally:
+                snapshot.close()
+            debug('load_saved_flows:len flows=%u\n' % len(self.flows))
             return
-        for l in result.decode().split('\n'):
+        self.ports, self.port_map, self.ports_loaded = {}, {}, True
+        with open(path) as f:
+            self.flows = list(self.iter_sorted_flows(lines=f))
+        debug('load_saved_flows:len flows=%u\n' % len(self.flows))
+
+    def iter_sorted_flows(self, lines=None, db_file=None):
+        """
+        Yield the flows in order of table:priority, with the id set.
+        Only the flows of one table are held in memory to sort them.
+        :param lines: iterable of flow lines, dump from the bridge by default
+        :param db_file: opened file to record the original flow lines
+        """
+        flow_id = 0
+        for flow in sort_flows_per_table(self.iter_flows(lines, db_file)):
+            flow.id = flow_id
+            flow_id += 1
+            yield flow
+
+    def iter_flows(self, lines=None, db_file=None):
+        """
+        Yield the flows in the order of the dump, parsed line by line.
+        :param lines: iterable of flow lines, dump from the bridge by default
+        :param db_file: opened file to record the original flow lines
+        """
+        if lines is None:
+            self.load_ports()  # one port map snapshot for the whole dump
+            lines = self._dump_lines()
+        for l in lines:
             l = l.strip()
             if l.startswith('cookie='):
-                debug('%s\n' % l)
                 flow = self._parse_flow(l)
                 if flow:
-                    flows.append(flow)
-                    if db:
-                        f.write('%s\n' % l)
-        if db:
-            f.close()
-        flows.sort(reverse=True)
-        for i in range(len(flows)):
-            flows[i].id = i
-        self.flows = flows
-        debug('load_flows:len flows=%u\n' % len(self.flows))
+                    if db_file:
+                        db_file.write('%s\n' % l)
+                    yield flow
+
+    def _dump_lines(self):
+        """
+        Yield the output lines of dump-flows while ovs-ofctl is running.
+        """
+        cmd = "ovs-ofctl dump-flows %s" % self.bridge
+        p = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True,
+                  universal_newlines=True)
+        try:
+            for l in p.stdout:
+                yield l
+        finally:
+            p.stdout.close()
+            err = p.stderr.read()
+            p.stderr.close()
+            p.wait()
+            if err:
+                debug('Error when dumping flows of %s: %s\n'
+                      % (self.bridge, err))
 
     @check_exist
     def get_flows(self):
@@ -178,76 +298,104 @@ class Bridge(object):
         """
         Return a Flow or None, converted from a given line of original flow.
         """
-        line = line.strip()
-        table, packet, priority, match, actions = 0, 0, 0, '', ''
-        if line.startswith('cookie='):
-            table = get_num_after(line, 'table=')
-            packet = get_num_after(line, 'n_packets=')
-            if table is None or packet is None:
-                return None
-            for field in line.split():
-                if field.startswith('priority='):  # match starts with pri
-                    priority = get_num_after(field, 'priority=')
-                    if priority is None:
-                        error('No priority field found in flow\n')
-                        return None
-                    match = \
-                        field.replace('priority=%u'
-                                      % priority, '').lstrip(',').strip()
-                    if not match:
-                        match = r'*'
-                    port_no = get_num_after(field, 'in_port=')
-                    if isinstance(port_no, int):
-                        intf = self._get_port_intf(port_no)
-                        if intf:
-                            match = \
-                                match.replace('in_port=%u'
-                                              % port_no, 'in_port=%s' % intf)
-                elif field.startswith('actions='):
-                    actions = self._process_actions(field)
-            if priority is None:  # There is no priority= field
-                match = line.split()[len(line.split()) - 2]
-            if len(match) >= 30:
-                match.replace('vlan_tci', 'vlan')
-                match = re.compile('0x0{1,}').sub('0x', match)
-            return Flow(self.bridge, table, packet, priority, match, actions)
-        else:
+        fields = flow_line_fields(line)
+        if not fields:
             return None
+        cookie, duration, table, n_packets, n_bytes, idle_timeout, \
+            hard_timeout, priority, raw_match, raw_actions = fields
+        port_map = self.get_port_map()
+        match = raw_match or '*'
+        i = match.find('in_port=')
+        if i >= 0 and port_map:
+            j = match.find(',', i)
+            if j < 0:
+                j = len(match)
+            port_no = match[i + 8:j]
+            if port_no.isdigit():
+                intf = port_map.get(int(port_no))
+                if intf:
+                    match = match[:i + 8] + intf + match[j:]
+        if len(match) >= 30 and '0x0' in match:
+            match = compress_hex_str(match)
+        actions = raw_actions
+        if port_map and 'output:' in actions:
+            actions = self._process_actions(actions)
+        return Flow(self.bridge, table, n_packets, priority, match, actions,
+                    0, cookie, n_bytes, duration, idle_timeout, hard_timeout,
+                    raw_match, raw_actions)
 
+    @check_exist
     def dump_flows(self):
         """
-        Dump out the flows of this bridge
+        Dump out the flows of this bridge, each one is output once parsed.
         :return:
         """
-        self.load_flows()
-        debug('br_dump: len flows=%u\n' % len(self.flows))
-        table = 0
-        if self.flows:
-            Flow.banner_output()
-            for f in self.flows:
-                if f.table != table:
-                    output('\n')
-                    table = f.table
-                f.fmt_output()
+        num = output_flows(self.iter_sorted_flows())
+        debug('br_dump: len flows=%u\n' % num)
 
+    def sample_flows(self):
+        """
+        Return the counters of the flows at now, as
+        {(table, priority, match): (n_packets, n_bytes, line)}.
+        """
+        samples = {}
+        for l in self._dump_lines():
+            l = l.strip()
+            if l.startswith('cookie='):
+                counters = parse_flow_counters(l)
+                if counters:
+                    table, priority, match, n_packets, n_bytes = counters
+                    samples[(table, priority, match)] = \
+                        (n_packets, n_bytes, l)
+        return samples
+
+    @check_exist
+    def top_flows(self, interval=1.0, num=20, rounds=0):
+        """
+        Show the flows with the highest packet rates, redrawn in place every
+        interval seconds. Only the shown flows are parsed into Flow.
+        :param interval: seconds between two samples
+        :param num: number of flows to show
+        :param rounds: stop after the rounds, 0 for running until Ctrl-C
+        """
+        self.load_ports()
+        prev, last = self.sample_flows(), time.time()
+        i = 0
+        try:
+            while not rounds or i < rounds:
+                time.sleep(interval)
+                cur, now = self.sample_flows(), time.time()
+                top = top_flow_rates(prev, cur, now - last, num)
+                output('\033[H\033[J')  # move to top-left and clear
+                output('%s: %u flows, top %u in %.1fs, at %s\n'
+                       % (self.bridge, len(cur), len(top), now - last,
+                          time.strftime('%H:%M:%S')))
+                Flow.rate_banner_output()
+                for pkt_rate, byte_rate, line in top:
+                    flow = self._parse_flow(line)
+                    if flow:
+                        flow.fmt_rate_output(pkt_rate, byte_rate)
+                prev, last = cur, now
+                i += 1
+        except KeyboardInterrupt:
+            output('\n')
 
-    def _process_actions(self, actions_str):
+    def _process_actions(self, actions):
         """
         Process the actions fields to make it more readable
-        :param actions_str: input action string
+        :param actions: the original actions, e.g., output:2
         :return: The converted string.
         """
-        actions = actions_str.replace('actions=', '').rstrip('\n')
-        for act in actions_str.split(','):
-            if act.startswith('output:'):
-                port_no = get_num_after(act, 'output:')
-                if isinstance(port_no, int):
-                    intf = self._get_port_intf(port_no)
-                    if intf:
-                        actions = \
-                            actions.replace('output:%u'
-                                            % port_no, 'output:%s' % intf)
-        return actions
+        if 'output:' not in actions:
+            return actions
+        port_map = self.get_port_map()
+        result = []
+        for act in split_actions(actions):
+            if act[:7] == 'output:' and act[7:].isdigit() and \
+                    int(act[7:]) in port_map:
+                act = 'output:%s' % port_map[int(act[7:])]
+            result.append(act)
+        return ','.join(result)
 
     def _get_port_intf(self, port_no):
         """
@@ -257,27 +405,55 @@ class Bridge(object):
         """
         if not port_no:
             return None
-        ovs_ports = self.get_ports()
-        for intf in ovs_ports:
-            if ovs_ports[intf].get('port') == str(port_no):
-                return intf
-        return None
+        return self.get_port_map().get(port_no)
+
+    def get_port_map(self):
+        """
+        Return the dict of ovs port number to interface name, like
+        {
+            1: 'qvoxxx',
+            'LOCAL': 'br-int',
+        }
+        The map is built together with self.ports, and reused until the next
+        load_ports().
+        """
+        if not self.ports_loaded:
+            self.load_ports()
+        return self.port_map
 
     @check_exist
     def has_port(self, name):
+        inventory = get_inventory()
+        if inventory:
+            return inventory.get_index().has_port(self.bridge, name)
         return name in self.get_ports()
 
     @check_exist
     def has_port_start_with(self, name):
+        inventory = get_inventory()
+        if inventory:
+            return bool(inventory.get_index().ports_start_with(self.bridge,
+                                                               name))
         for p in self.get_ports():
             if p.startswith(name):
                 return True
         return False
 
     @check_exist
-    def get_ports(self):
+    def get_ports(self, fresh=False):
         """
-        Return a dict of the ports (port, addr, tag, type) on the bridge, like
+        Return a dict of the ports (port, addr, tag, type) on the bridge.
+        The loaded result is cached in self.ports, use fresh to reload it.
+        """
+        if fresh or not self.ports_loaded:
+            self.load_ports()
+        return self.ports
+
+    def load_ports(self):
+        """
+        Load the ports (port, addr, tag, type) on the bridge into self.ports,
+        and the ovs port number to interface map into self.port_map.
+        self.ports looks like
         {
             'qvoxxx':{
                 'port':'2',
@@ -287,11 +463,21 @@ class Bridge(object):
             }
         }
         """
-        ports = {}
+        ports, port_map = {}, {}
+        inventory = get_inventory()
+        if inventory:
+            ports = inventory.get_ports(self.bridge)
+            for intf in ports:
+                port = ports[intf]['port']
+                port_map[int(port) if port.isdigit() else port] = intf
+            self.ports, self.port_map, self.ports_loaded = \
+                ports, port_map, True
+            return ports
         cmd = "ovs-ofctl show %s" % self.bridge
         result, error = \
             Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True).communicate()
         if error:
+            self.ports, self.port_map, self.ports_loaded = {}, {}, False
             return {}
         #output('%-8s%-16s%-16s\n' %('PORT','INTF','ADDR'))
         brs = get_all_bridges()
@@ -309,4 +495,9 @@ class Bridge(object):
                     tag, intf_type = '', ''
                 ports[intf] = {'port': port, 'addr': addr, 'vlan': tag,
                                'type': intf_type}
+                if port.isdigit():
+                    port_map[int(port)] = intf
+                else:
+                    port_map[port] = intf
+        self.ports, self.port_map, self.ports_loaded = ports, port_map, True
         return ports
@@ -1,12 +1,25 @@
 __author__ = 'baohua'
 
+import os
 from subprocess import Popen, PIPE
+import sys
+import time
 
-from easyovs.bridge import Bridge
-from easyovs.flow import Flow
-from easyovs.log import debug, error, output
+from easyovs.bridge import Bridge, confirm
+from easyovs.flow import Flow, diff_flows, output_flows
+from easyovs.flow_index import parse_query
+from easyovs.flow_lint import IDLE_DURATION, lint_flows
+from easyovs.log import debug, error, output, warn
 from easyovs.neutron import neutron_handler
-from easyovs.util import color_str, get_all_bridges
+from easyovs.render import Renderer
+from easyovs.snapshot import Snapshot, SnapshotError, write_snapshot
+from easyovs.trace import Tracer
+from easyovs.util import color_str, fmt_flow_str, get_all_bridges, \
+    get_all_interfaces, get_port_index, run_concurrently
+
+# intf port vlan type, then vm ip and vm mac if known
+_format_str_ports_ = '%-20s%-12s%-8s%-12s\n'
+_format_str_ports_ip_ = '%-20s%-12s%-8s%-12s%-16s%-24s\n'
 
 
 def br_addflow(bridge, flow):
@@ -16,6 +29,39 @@ def br_addflow(bridge, flow):
         return False
 
 
+def br_addflows(bridge, path):
+    """
+    Add all the flows in a file, one flow per line, to a bridge in one
+    transaction. Nothing is added if any line is invalid.
+    :param bridge: name of the bridge
+    :param path: path of the file, or - for stdin
+    :return: True or False
+    """
+    try:
+        f = sys.stdin if path == '-' else open(path)
+    except IOError as e:
+        error('Cannot open %s: %s\n' % (path, e))
+        return False
+    flows, errors = [], []
+    for i, line in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        flow = fmt_flow_str(line)
+        if flow:
+            flows.append(flow)
+        else:
+            errors.append((i, line))
+    if f is not sys.stdin:
+        f.close()
+    for i, line in errors:
+        error('Invalid flow at line %u: %s\n' % (i, line))
+    if errors or not flows:
+        return False
+    debug('Adding %u flows to %s\n' % (len(flows), bridge))
+    return Bridge(bridge).add_flows(flows)
+
+
 def br_delflow(bridge, ids, forced=False):
     debug('br_delflow: %s: %s\n' % (bridge, ','.join(ids)))
     if type(ids) == str and ids.isdigit():
@@ -23,6 +69,240 @@ def br_delflow(bridge, ids, forced=False):
     else:
         return Bridge(bridge).del_flow(ids, forced)
 
+def br_find_flows(bridge, query):
+    """
+    Show the flows of a bridge matched by all the predicates of the query.
+    :param bridge: name of the bridge
+    :param query: list of predicates, e.g., ['in_port=qvo*', 'priority>=1']
+    """
+    query = parse_query(query)
+    if query is None:
+        return
+    br = Bridge(bridge)
+    br.load_flows()
+    if not br.flows:
+        return
+    flows = br.find_flows(query)
+    if not flows:
+        output('No flow matched.\n')
+        return
+    output_flows(flows)
+
+
+def br_del_flows(bridge, query, forced=False):
+    """
+    Delete the flows of a bridge matched by all the predicates of the query.
+    :param bridge: name of the bridge
+    :param query: list of predicates, e.g., ['in_port=qvo*', 'priority>=1']
+    :param forced: delete without confirmation
+    :return: True or False
+    """
+    if not query:
+        error('No predicate is given, will not delete all flows\n')
+        return False
+    query = parse_query(query)
+    if query is None:
+        return False
+    br = Bridge(bridge)
+    br.load_flows()
+    if not br.flows:
+        return False
+    flows = br.find_flows(query)
+    if not flows:
+        output('No flow matched.\n')
+        return False
+    if not forced:
+        output_flows(flows)
+        if not confirm('Del the %u flows?' % len(flows)):
+            return False
+    return br.del_flows(flows)
+
+def br_top(bridge, interval=1.0, num=20):
+    """
+    Show the hottest flows of a bridge until Ctrl-C.
+    :param bridge: name of the bridge
+    :param interval: seconds between two samples
+    :param num: number of flows to show
+    """
+    Bridge(bridge).top_flows(interval, num)
+
+
+def _load_bridge(source):
+    """
+    Return a Bridge with the flows loaded from a live bridge, a saved
+    dump-flows output or a snapshot, or None if no flow is found.
+    The bridge of a file is only named after it, its ports are never
+    looked up on this node.
+    :param source: name of the bridge or path of the file
+    """
+    if os.path.isfile(source):
+        br = Bridge(os.path.basename(source))
+        try:
+            br.load_saved_flows(source)
+        except (IOError, SnapshotError) as e:
+            error('Cannot read %s: %s\n' % (source, e))
+            return None
+    else:
+        br = Bridge(source)
+        br.load_flows()
+    if not br.flows:
+        output('No flow is found in %s.\n' % source)
+        return None
+    return br
+
+
+def br_diff_flows(source, target):
+    """
+    Show the flows added, removed and changed from the source to the target,
+    and the ones with only the counters changed.
+    :param source: name of the bridge, or path of a dump or a snapshot
+    :param target: the same as source
+    :return: True if the flows are the same
+    """
+    old, new = _load_bridge(source), _load_bridge(target)
+    if not old or not new:
+        return False
+    # ports are compared by name only when both sides have their own map,
+    # otherwise by the numbers of the original match and actions
+    raw = not (old.get_port_map() and new.get_port_map())
+    added, removed, changed, counters = \
+        diff_flows(old.flows, new.flows, raw=raw)
+    with Renderer() as out:
+        for f in removed:
+            out.write('- %s\n' % f.canonical(), 'r')
+        for f in added:
+            out.write('+ %s\n' % f.canonical(), 'g')
+        for a, b in changed:
+            out.write('- %s\n' % a.canonical(), 'r')
+            out.write('+ %s\n' % b.canonical(), 'g')
+        if counters:
+            out.write('Counters changed:\n')
+        out.write_rows('  table=%u,priority=%u,%s n_packets=%u->%u '
+                       'n_bytes=%u->%u\n',
+                       [(a.table, a.priority, a.match, a.packet, b.packet,
+                         a.n_bytes, b.n_bytes) for a, b in counters])
+    output('%u flows in %s, %u in %s: %u added, %u removed, %u changed, '
+           '%u counters changed\n'
+           % (len(old.flows), source, len(new.flows), target, len(added),
+              len(removed), len(changed), len(counters)))
+    return not (added or removed or changed)
+
+
+def br_lint_flows(bridge, min_duration=IDLE_DURATION):
+    """
+    Show the flows which are shadowed by a higher priority flow, duplicate
+    with one, or without hit for a long time.
+    :param bridge: name of the bridge, or path of a dump or a snapshot
+    :param min_duration: seconds to report a flow without hit
+    """
+    br = _load_bridge(bridge)
+    if not br:
+        return
+    port_numbers = dict((intf, port) for port, intf
+                        in br.get_port_map().items())
+    result = lint_flows(br.flows, min_duration, port_numbers)
+    for flow, e in result['skipped']:
+        warn('Skip the flow not parsed (%s): %s\n' % (e, flow.canonical()))
+    with Renderer() as out:
+        for kind, title in (('shadowed', 'Shadowed by a higher priority '
+                                         'flow'),
+                            ('duplicate', 'Duplicate with a higher priority '
+                                          'flow of the same actions')):
+            if not result[kind]:
+                continue
+            out.write('%s:\n' % title, 'r')
+            out.write(Flow.banner_str(), 'g')
+            for flow, by in result[kind]:
+                out.write(flow.fmt_str(), 'b' if flow.packet > 0 else None)
+                out.write('    by #%u priority=%u %s\n'
+                          % (by.id, by.priority, by.match))
+        if result['idle']:
+            out.write('No hit in %us:\n' % min_duration, 'r')
+            out.write(Flow.banner_str(), 'g')
+            for flow in result['idle']:
+                out.write(flow.fmt_str())
+    output('%u flows: %u shadowed, %u duplicate, %u without hit in %us\n'
+           % (len(br.flows), len(result['shadowed']),
+              len(result['duplicate']), len(result['idle']), min_duration))
+
+
+def br_trace(bridge, packets):
+    """
+    Trace packets through the flows of a bridge offline, the path is shown
+    for a single packet, otherwise only the verdict of each one.
+    :param bridge: name of the bridge, or path of a saved dump-flows output
+    :param packets: list of the packet fields, e.g., ['in_port=1,ip']
+    """
+    br = _load_bridge(bridge)
+    if not br:
+        return
+    tracer = Tracer(br.flows, br.get_port_map())
+    for flow, e in tracer.classifier.skipped:
+        warn('Skip the flow not parsed (%s): %s\n' % (e, flow.canonical()))
+    for spec in packets:
+        try:
+            result = tracer.trace(spec)
+        except ValueError as e:
+            error('%s in %s\n' % (e, spec))
+            continue
+        if len(packets) > 1:
+            output('%-60s %s\n' % (spec, result.verdict()))
+            continue
+        for depth, table, flow in result.path:
+            if flow:
+                output('%stable=%u priority=%u %s -> %s\n'
+                       % ('    ' * depth, table, flow.priority, flow.match,
+                          flow.actions))
+            else:
+                output('%stable=%u no match, drop\n'
+                       % ('    ' * depth, table))
+        for note in result.notes:
+            warn('%s\n' % note)
+        output('Verdict: %s\n' % color_str(result.verdict(), 'b'))
+
+
+def br_snapshot(bridge, path=None):
+    """
+    Save the flows of a bridge into a binary snapshot file.
+    :param bridge: name of the bridge
+    :param path: path of the file, <bridge>-<time>.snap by default
+    :return: the path or None
+    """
+    br = Bridge(bridge)
+    if not br.exists():
+        error('The bridge %s does not exist.\n' % bridge)
+        return None
+    br.load_flows()
+    path = path or '%s-%s.snap' % (bridge, time.strftime('%Y%m%d-%H%M%S'))
+    try:
+        num = write_snapshot(path, bridge, br.flows, br.get_port_map())
+    except IOError as e:
+        error('Cannot write %s: %s\n' % (path, e))
+        return None
+    output('Saved %u flows of %s into %s\n' % (num, bridge, path))
+    return path
+
+
+def snapshot_show(path):
+    """
+    Show the flows saved in a snapshot file.
+    :param path: path of the snapshot file
+    """
+    try:
+        snapshot = Snapshot(path)
+    except (IOError, SnapshotError) as e:
+        error('Cannot load snapshot %s: %s\n' % (path, e))
+        return
+    try:
+        output('%u flows of %s at %s\n'
+               % (len(snapshot), snapshot.bridge,
+                  time.strftime('%Y-%m-%d %H:%M:%S',
+                                time.localtime(snapshot.time))))
+        output_flows(snapshot)
+    finally:
+        snapshot.close()
+
+
 def br_exists(name):
     """
     Return True of False of a bridge's existence.
@@ -58,90 +338,231 @@ def br_addbr(name):
     """
     Create a new bridge.
     """
-    cmd = "ovs-vsctl --may-exist add-br %s" % name
-    result, err = \
-        Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True).communicate()
+    return br_addbrs([name])
+
+
+def br_addbrs(names):
+    """
+    Create the bridges in one ovs-vsctl transaction, so ovs-vswitchd is
+    reconfigured once for all of them.
+    :param names: names of the bridges
+    :return: True if all bridges exist after the command
+    """
+    existed = get_all_bridges()
+    err = _br_transact(names, ['--may-exist', 'add-br'])
     if err:
-        error("Error when adding new bridge %s\n" % name)
-    else:
-        output("bridge %s was created\n" % name)
+        error("Error when adding new bridge %s, none is added: %s\n"
+              % (', '.join(_unique(names)), err))
+        return False
+    for name in _unique(names):
+        if name in existed:
+            output("bridge %s already exists\n" % name)
+        else:
+            output("bridge %s was created\n" % name)
+    return True
+
 
 def br_delbr(name):
     """
     Delete a bridge.
     """
-    cmd = "ovs-vsctl --if-exists del-br %s" % name
-    result, err = \
-        Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True).communicate()
+    return br_delbrs([name])
+
+
+def br_delbrs(names):
+    """
+    Delete the bridges in one ovs-vsctl transaction, so ovs-vswitchd is
+    reconfigured once for all of them.
+    :param names: names of the bridges
+    :return: True if none of the bridges exists after the command
+    """
+    existed = get_all_bridges()
+    err = _br_transact(names, ['--if-exists', 'del-br'])
     if err:
-        error("Error when deleting bridge %s\n" % name)
-    else:
-        output("bridge %s was deleted\n" % name)
+        error("Error when deleting bridge %s, none is deleted: %s\n"
+              % (', '.join(_unique(names)), err))
+        return False
+    for name in _unique(names):
+        if name not in existed:
+            output("bridge %s does not exist\n" % name)
+        else:
+            output("bridge %s was deleted\n" % name)
+    return True
+
+
+def _unique(names):
+    """
+    Return the names without the duplicate ones, in order.
+    >>> _unique(['br1', 'br2', 'br1'])
+    ['br1', 'br2']
+    """
+    seen = set()
+    return [n for n in names if not (n in seen or seen.add(n))]
+
+
+def _br_transact(names, command):
+    """
+    Run the command on each bridge, all in one ovs-vsctl transaction, e.g.,
+    ovs-vsctl -- --may-exist add-br br1 -- --may-exist add-br br2.
+    The transaction is atomic, none of the bridges is changed if it fails.
+    :param names: names of the bridges
+    :param command: the command and its options, e.g., ['del-br']
+    :return: the error message, or '' if done
+    """
+    cmd = ['ovs-vsctl']
+    for name in _unique(names):
+        cmd += ['--'] + command + [name]
+    debug('Run %s\n' % ' '.join(cmd))
+    p = Popen(cmd, stdout=PIPE, stderr=PIPE)
+    _, err = p.communicate()
+    if p.returncode == 0:
+        return ''
+    return err.decode().strip() or 'failed'
+
 
 def br_dump(name):
     """
-    Dump the port information of a given bridges.
+    Dump the flows of a given bridge, or of all bridges if name is all.
     """
-    Bridge(name).dump_flows()
+    if name == 'all':
+        br_dump_all()
+    else:
+        Bridge(name).dump_flows()
+
+
+def br_dump_all():
+    """
+    Dump the flows of all bridges, collected concurrently and shown in
+    order of the bridge names.
+    """
+    names = sorted(get_all_bridges().keys())
+
+    def load(name):
+        br = Bridge(name)
+        br.load_flows()
+        return br.flows
+
+    for name, (flows, err) in zip(names, run_concurrently(load, names)):
+        output(color_str('%s\n' % name, 'r'))
+        if err:
+            error('Failed to dump flows of %s: %s\n' % (name, err))
+        elif not output_flows(flows):
+            output('No flow.\n')
+        output('\n')
+
 
 def br_show(name):
     """
-    Show information of a given bridges.
+    Show information of a given bridge, or of all bridges if name is all.
     """
-    ovs_ports = Bridge(name).get_ports()
+    if name == 'all':
+        br_show_all()
+        return
+    br = Bridge(name)
+    ovs_ports = br.get_ports()
     if not ovs_ports:
         return
-    neutron_ports = neutron_handler.get_neutron_ports()
+    intf_ids = get_all_interfaces()
+    neutron_ports = neutron_handler.get_ports_by_ids(
+        _port_ids([ovs_ports], intf_ids))
     debug('get neutron_ports\n')
+    _output_ports(name, ovs_ports, intf_ids, neutron_ports)
+
+
+def br_show_all():
+    """
+    Show information of all bridges, the ports of the bridges and the
+    external_ids of the interfaces are collected concurrently, then the
+    neutron ports on them in one query, and shown in order of the bridge
+    names.
+    """
+    names = sorted(get_all_bridges().keys())
+    tasks = [get_all_interfaces] + [Bridge(name).get_ports for name in names]
+    results = run_concurrently(lambda task: task(), tasks)
+    intf_ids = results[0][0] or {}
+    neutron_ports = neutron_handler.get_ports_by_ids(
+        _port_ids([ports for ports, err in results[1:] if ports], intf_ids))
+    for name, (ovs_ports, err) in zip(names, results[1:]):
+        output(color_str('%s\n' % name, 'r'))
+        if err:
+            error('Failed to get ports of %s: %s\n' % (name, err))
+        elif ovs_ports:
+            _output_ports(name, ovs_ports, intf_ids, neutron_ports)
+        output('\n')
+
+
+def _port_ids(ports_list, intf_ids):
+    """
+    Return the neutron port ids of the interfaces on the bridges.
+    :param ports_list: list of dicts from Bridge.get_ports()
+    :param intf_ids: dict from get_all_interfaces()
+    """
+    result = set()
+    for ports in ports_list:
+        for intf in ports:
+            port_id = intf_ids.get(intf, {}).get('iface-id')
+            if port_id:
+                result.add(port_id)
+    return result
+
+
+def _output_ports(bridge, ovs_ports, intf_ids, neutron_ports):
+    """
+    Output the ports of a bridge, joined with the vm information from the
+    external_ids of the interfaces, and the ips of the neutron ports.
+    :param bridge: name of the bridge
+    :param ovs_ports: dict from Bridge.get_ports()
+    :param intf_ids: dict from get_all_interfaces()
+    :param neutron_ports: dict of neutron port id --> port
+    """
     content = []
     mac_ip_show = False
     for intf in ovs_ports:  # e.g., qvo-xxx, int-br-eth0, qr-xxx, tapxxx
         port, tag, intf_type = \
             ovs_ports[intf]['port'], ovs_ports[intf]['vlan'], ovs_ports[
                 intf]['type']
-        if neutron_ports and intf[3:] in neutron_ports:
-            p = neutron_ports[intf[3:]]
+        ids = intf_ids.get(intf, {})
+        port_id = ids.get('iface-id', '')
+        vm_mac, vm_uuid = ids.get('attached-mac', ''), ids.get('vm-uuid', '')
+        if port_id in neutron_ports:
             vm_ips = ','.join(map(lambda x: x.get('ip_address'),
-                                  p['fixed_ips']))
-            vm_mac = p.get('mac_address')
-            mac_ip_show = True
+                                  neutron_ports[port_id]['fixed_ips']))
         else:
-            vm_ips, vm_mac = '', ''
-        content.append((intf, port, tag, intf_type, vm_ips, vm_mac))
-        # output('%-20s%-8s%-16s%-24s%-8s\n' %(intf,port,vmIP,vmMac,tag))
+            vm_ips = ''
+        if port_id:
+            mac_ip_show = True
+        content.append((intf, port, tag, intf_type, vm_ips, vm_mac, port_id,
+                        vm_uuid))
     content.sort(key=lambda x: x[1])  # sort by port
     content.sort(key=lambda x: x[4])  # sort by vm_ip
     content.sort(key=lambda x: x[3])  # sort by type
-    output(color_str('%-20s%-12s%-8s%-12s'
-                     % ('Intf', 'Port', 'Vlan', 'Type'), 'r'))
-    if mac_ip_show:
-        output(color_str('%-16s%-24s\n' % ('vmIP', 'vmMAC'), 'r'))
-    else:
-        output('\n')
-    i = 0
-    for _ in content:
-        #color = ['w','g'][i%2]
-        color = 'b'
-        output(color_str('%-20s%-12s%-8s%-12s'
-                         % (_[0], _[1], _[2], _[3]), color))
-        if mac_ip_show:
-            output(color_str('%-16s%-24s\n' % (_[4], _[5]), color))
+    with Renderer() as out:
+        if out.structured:
+            for intf, port, tag, intf_type, vm_ips, vm_mac, port_id, \
+                    vm_uuid in content:
+                out.record('port', bridge=bridge, intf=intf, port=port,
+                           vlan=tag, type=intf_type,
+                           vm_ips=vm_ips.split(',') if vm_ips else [],
+                           vm_mac=vm_mac, port_id=port_id, vm_uuid=vm_uuid)
+        elif mac_ip_show:
+            out.write(_format_str_ports_ip_ % ('Intf', 'Port', 'Vlan', 'Type',
+                                              'vmIP', 'vmMAC'), 'r')
+            out.write_rows(_format_str_ports_ip_, [c[:6] for c in content],
+                           'b')
         else:
-            output('\n')
-        i += 1
+            out.write(_format_str_ports_ % ('Intf', 'Port', 'Vlan', 'Type'),
+                      'r')
+            out.write_rows(_format_str_ports_, [c[:4] for c in content],
+                           'b')
 
 
-def find_br_ports(port_id):
+def find_br_ports(port_id, index=None):
     '''
     Find a port with given id
     :param port_id: a4111776-bd
+    :param index: the PortIndex to look up, get_port_index() by default
 
     :return: qr-a4111776-bd
     '''
-    brs = get_all_bridges()
-    for br_id in brs:
-        if 'Port'in brs[br_id]:
-            for p in brs[br_id]['Port']:
-                if p.endswith(port_id):
-                    return p
-    return None
+    found = (index or get_port_index()).find_id(port_id)
+    return found[1] if found else None
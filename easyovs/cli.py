@@ -11,9 +11,12 @@ import os
 import sys
 
 from easyovs import VERSION
-from easyovs.bridge_ctrl import br_addflow, br_delbr, br_addbr, br_delflow, \
-    br_dump, br_exists, br_list, br_show
+from easyovs.bridge_ctrl import br_addflow, br_addflows, br_delbrs, \
+    br_addbrs, br_delflow, br_del_flows, br_diff_flows, br_dump, br_exists, \
+    br_find_flows, br_lint_flows, br_list, br_show, br_snapshot, br_top, \
+    br_trace, snapshot_show
 from easyovs.common import CMDS_ONE, CMDS_BR, CMDS_OTHER
+from easyovs.inventory import start_inventory
 from easyovs.iptables import IPtables
 from easyovs.log import info, output, error, debug, warn
 from easyovs.neutron import query_info
@@ -61,6 +64,8 @@ class CLI(Cmd):
             output("***\n Welcome to EasyOVS %s, "
                    "type help to see available cmds.\n***\n" % VERSION)
             info('*** Starting CLI:\n')
+            if not start_inventory():
+                debug('No live inventory, will query ovs for each cmd\n')
             debug("==Loading credentials==\n")
             debug("auth_url = %s\n" % os.getenv('OS_AUTH_URL') or
                   cfg.CONF.OS.auth_url)
@@ -106,6 +111,25 @@ class CLI(Cmd):
         else:
             output('Add flow <%s> to %s done.\n' % (flow, bridge))
 
+    def do_addflows(self, arg, forced=False):
+        """
+        addflows [bridge] file
+        Add all flows in the file (- for stdin), one per line, to a bridge
+        in one transaction.
+        """
+        args = arg.split()
+        if len(args) == 1 and self.bridge:
+            bridge, path = self.bridge, args[0]
+        elif len(args) == 2:
+            bridge, path = args
+        else:
+            output('Please use like [bridge] addflows file.\n')
+            return
+        if not br_addflows(bridge, path):
+            output('Add flows from %s to %s failed.\n' % (path, bridge))
+        else:
+            output('Add flows from %s to %s done.\n' % (path, bridge))
+
     def do_delflow(self, arg, forced=False):
         """
         [bridge] delflow flow_id, flow_id
@@ -140,8 +164,7 @@ class CLI(Cmd):
             output('Not enough parameters are given, use like ')
             output('addbr br1,br2\n')
             return
-        for br in brs:
-            br_addbr(br)
+        br_addbrs(brs)
 
     def do_delbr(self, arg, forced=False):
         """
@@ -153,13 +176,12 @@ class CLI(Cmd):
             output('Not enough parameters are given, use like ')
             output('delbr br1,br2\n')
             return
-        for br in brs:
-            br_delbr(br)
+        br_delbrs(brs)
 
     def do_dump(self, arg, forced=False):
         """
-        [bridge] dump
-        Dump the flows from a bridge.
+        [bridge] dump, or dump all
+        Dump the flows from a bridge, or from all bridges.
         """
         if arg:
             br_dump(arg)
@@ -169,6 +191,55 @@ class CLI(Cmd):
             output("Please give a valid bridge.\n")
             return
 
+    def do_top(self, arg, forced=False):
+        """
+        [bridge] top [interval] [N]
+        Show the N flows with the highest packet rates, refreshed every
+        interval seconds (1 and 20 by default), press Ctrl-C to stop.
+        """
+        args = arg.split()
+        if args and br_exists(args[0]):
+            bridge, args = args[0], args[1:]
+        elif self.bridge:
+            bridge = self.bridge
+        else:
+            output("Please give a valid bridge.\n")
+            return
+        try:
+            interval = float(args[0]) if args else 1.0
+            num = int(args[1]) if len(args) > 1 else 20
+        except ValueError:
+            output("Please use like [bridge] top [interval] [N].\n")
+            return
+        if interval <= 0 or num <= 0:
+            output("The interval and N should be positive.\n")
+            return
+        br_top(bridge, interval, num)
+
+    def do_trace(self, arg, forced=False):
+        """
+        [bridge] trace fields, or trace dump_file fields
+        Trace a packet through the flows offline from table 0, e.g.,
+        br-int trace in_port=qvo1 ip nw_dst=10.0.0.2
+        Use - as the fields to trace one packet per line from stdin.
+        """
+        args = arg.split()
+        if args and (br_exists(args[0]) or os.path.isfile(args[0])):
+            bridge, args = args[0], args[1:]
+        elif self.bridge:
+            bridge = self.bridge
+        else:
+            output("Please give a valid bridge.\n")
+            return
+        if not args:
+            output("Please use like [bridge] trace in_port=1 ip.\n")
+            return
+        if args == ['-']:
+            packets = [l.strip() for l in sys.stdin if l.strip()]
+        else:
+            packets = [' '.join(args)]
+        br_trace(bridge, packets)
+
     def do_EOF(self, arg):
         """
         Exit.
@@ -188,6 +259,47 @@ class CLI(Cmd):
         else:
             return self.do_quit(_arg)
 
+    def do_flows(self, arg, forced=False):
+        """
+        Search the flows of a bridge, or delete them in one transaction, e.g.,
+        flows find br-int in_port=qvo* dl_vlan=1 output=patch-tun
+        flows find br-int table=0 priority>=10 packets>0
+        flows del br-int in_port=qvo* packets=0
+        Or compare the flows of bridges, dump files or snapshots, e.g.,
+        flows diff br-int br-int-20160101.snap
+        Or find the shadowed, duplicate and long unused flows, e.g.,
+        flows lint br-int [min_duration]
+        """
+        args = arg.split()
+        if len(args) < 2 or (args[0] == 'diff' and len(args) != 3):
+            warn("Not correct parameters, use as:\n")
+            warn("flows find bridge [key=value|key>=num ...]\n")
+            warn("flows del bridge key=value|key>=num ...\n")
+            warn("flows diff bridge|file bridge|file\n")
+            warn("flows lint bridge [min_duration]\n")
+            return
+        cmd = args[0]
+        if cmd == 'find':
+            debug('run br_find_flows(%s, %s)\n' % (args[1], args[2:]))
+            br_find_flows(args[1], args[2:])
+        elif cmd == 'del':
+            debug('run br_del_flows(%s, %s)\n' % (args[1], args[2:]))
+            if not br_del_flows(args[1], args[2:], forced):
+                output('Del flows from %s failed.\n' % args[1])
+            else:
+                output('Del flows from %s done.\n' % args[1])
+        elif cmd == 'diff':
+            debug('run br_diff_flows(%s, %s)\n' % (args[1], args[2]))
+            br_diff_flows(args[1], args[2])
+        elif cmd == 'lint':
+            debug('run br_lint_flows(%s, %s)\n' % (args[1], args[2:]))
+            if len(args) > 2 and not args[2].isdigit():
+                warn("The min_duration should be seconds.\n")
+                return
+            br_lint_flows(*([args[1]] + [int(a) for a in args[2:3]]))
+        else:
+            error('Unsupported cmd=%s\n' % cmd)
+
     def do_get(self, _arg):
         """
         Get current default bridge.
@@ -237,30 +349,50 @@ class CLI(Cmd):
     def do_ipt(self, arg):
         """
         Show the iptables rules, e.g.,
-        ipt vm vm1,vm2
+        ipt vm vm1,vm2 10.0.0.0/24, or - to read the ips from stdin
         ipt show nat,raw,filter [INPUT]
         ipt check nat,raw,filter
+        ipt trace [ns|file] tcp src=10.0.0.5 dst=10.0.0.3 dport=22
+        Use - as the fields to trace one packet per line from stdin.
         """
         args = arg.split()
+        if args and args[0] == 'vm':  # any number of ips or networks
+            ips = ' '.join(args[1:]).replace(',', ' ').split()
+            if ips == ['-']:
+                ips = ' '.join(sys.stdin).replace(',', ' ').split()
+            if not ips:
+                error('No vm ip is given\n')
+                return
+            debug('run self.ipt.vm(%s)\n' % ips)
+            IPtables().vm(ips)
+            return
+        if args and args[0] == 'trace':  # any number of packet fields
+            ns, path = None, None
+            if len(args) > 1 and args[1] in NameSpaces().get_ids():
+                ns = args.pop(1)
+            elif len(args) > 1 and os.path.isfile(args[1]):
+                path = args.pop(1)
+            if len(args) == 1:
+                warn("ipt trace [ns|file] fields\n")
+                return
+            if args[1:] == ['-']:
+                packets = [l.strip() for l in sys.stdin if l.strip()]
+            else:
+                packets = [' '.join(args[1:])]
+            IPtables().trace(packets, ns, path)
+            return
         if len(args) < 1 or len(args) > 3:  # only 1-3 is valid
             warn("Not correct parameters, use as:\n")
-            warn("ipt vm vm_ip\n")
+            warn("ipt vm vm_ip|network...\n")
             warn("ipt show|check [filter] [INPUT]\n")
+            warn("ipt trace [ns|file] fields\n")
             return
         self.ipt = IPtables()
         cmd = args[0]
         if not hasattr(self.ipt, '%s' % cmd):
             error('Unsupported cmd=%s\n' % cmd)
             return
-        if cmd == 'vm':
-            if len(args) == 1:
-                error('No vm ip is given\n')
-                return
-            else:
-                for vm_ip in args[1:]:
-                    debug('run self.ipt.%s(%s)\n' % (cmd, vm_ip))
-                    getattr(self.ipt, '%s' % cmd)(vm_ip)
-        elif cmd in ['check', 'show']:
+        if cmd in ['check', 'show']:
             ns = None
             if args[-1] in NameSpaces().get_ids():
                 ns = args.pop()
@@ -286,6 +418,22 @@ class CLI(Cmd):
                 else:
                     warn("Unknown table, table=%s\n" % args[1])
 
+    def do_snapshot(self, arg):
+        """
+        Save the flows of a bridge into a binary snapshot, or show one, e.g.,
+        snapshot flows br-int [file]
+        snapshot show file
+        """
+        args = arg.split()
+        if len(args) == 2 and args[0] == 'show':
+            snapshot_show(args[1])
+        elif len(args) in (2, 3) and args[0] == 'flows':
+            br_snapshot(*args[1:])
+        else:
+            warn("Not correct parameters, use as:\n")
+            warn("snapshot flows bridge [file]\n")
+            warn("snapshot show file\n")
+
     def do_ns(self, arg):
         """
         Show the network namespace content, e.g.,
@@ -368,6 +516,7 @@ class CLI(Cmd):
     def do_show(self, arg, forced=False):
         """
         Show port details of a bridge, with neutron information.
+        Use show all for all bridges.
         """
         if arg:
             br_show(arg)
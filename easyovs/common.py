@@ -5,8 +5,9 @@ __author__ = 'baohua'
 # optional tests to run
 CMDS_ONE = ['cli', 'list']
 CMDS_BR = \
-    ['addbr', 'delbr', 'addflow', 'delflow', 'dump', 'show']
+    ['addbr', 'delbr', 'addflow', 'addflows', 'delflow', 'dump', 'show',
+     'flows', 'top', 'trace']
 CMDS_OTHER = \
-    ['ipt', 'query', 'ns', 'dvr']
+    ['ipt', 'query', 'ns', 'dvr', 'snapshot']
 if __name__ == '__main__':
     pass
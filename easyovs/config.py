@@ -7,6 +7,7 @@ except ImportError:
     from oslo.config import cfg
 from easyovs import VERSION
 from easyovs.log import LEVELS, LOGLEVELDEFAULT
+from easyovs.render import FORMATS
 
 default_opts = [
 ]
@@ -48,6 +49,11 @@ cli_opts = [
                short='f',
                default=False,
                help='Run command without confirmation'),
+    cfg.StrOpt('format',
+               default='text',
+               choices=FORMATS,
+               help='Output format of the command run by -m, the json and '
+                    'ndjson records are streamed to stdout, logs to stderr.'),
     cfg.BoolOpt('clean',
                 short='c',
                 default=False,
@@ -4,9 +4,11 @@ from subprocess import call, Popen, PIPE
 from easyovs.namespaces import NameSpace, NameSpaces
 from easyovs.log import error, output, warn
 from easyovs.util import r, g, b, ipStrToNum, networkMask, ipInNetwork, \
-    ipInNetworks, fileHasLine, get_all_bridges, numToipStr
+    ipInNetworks, fileHasLine, get_all_bridges, get_port_index, numToipStr, \
+    run_concurrently
 from easyovs.bridge import Bridge
 from easyovs.iptables import IPtables
+from easyovs.render import Renderer
 
 
 class DVR(object):
@@ -18,9 +20,42 @@ class DVR(object):
         """
         self.node = None
         self.br_int = Bridge('br-int')
+        self.bridges = {'br-int': self.br_int}  # name --> Bridge
         self.nss = NameSpaces()
+        self._index = None  # PortIndex of all bridges, reloaded by check()
+        self.ipt = IPtables()  # tables of each namespace, loaded once
+
+    @property
+    def index(self):
+        """
+        The PortIndex of all bridges, loaded at the first use if the checks
+        are called without check().
+        """
+        if self._index is None:
+            self._index = get_port_index()
+        return self._index
+
+    def _get_bridge(self, name):
+        """
+        Get the Bridge instance with given name, the loaded ports are reused.
+        :param name: name of the bridge
+        :return: the Bridge instance
+        """
+        if name not in self.bridges:
+            self.bridges[name] = Bridge(name)
+        return self.bridges[name]
+
+    def _load_bridges(self, names):
+        """
+        Load the ports of the bridges concurrently, so the checks later on
+        each bridge use the loaded ports.
+        :param names: names of the bridges
+        """
+        run_concurrently(lambda name: self._get_bridge(name).get_ports(),
+                         list(names))
 
     def check(self, _node=None):
+        self._index = get_port_index()
         guess = 'compute'
         for ns_id in NameSpaces().get_ids():
             if ns_id.startswith('snat-'):  # only network has snat-*
@@ -82,8 +117,8 @@ class DVR(object):
         c_name = 'neutron-l3-agent-PREROUTING'
         rule = {'in': 'qr-+', 'source': '*', 'out': '*',
                 'destination': '169.254.169.254',
-                'target': 'REDIRECT', 'prot': 'tcp',
-                'flags': 'tcp dpt:80 redir ports 9697'}
+                'target': 'REDIRECT', 'prot': 'tcp', 'dport': '80',
+                'to-ports': '9697'}
         if not self._check_chain_has_rule(nat, c_name, rule):
             return False
 
@@ -100,14 +135,19 @@ class DVR(object):
                     warn(r('dip %s not in rfp ports %s\n'
                            % (dip, ips_rfp)))
                     return False
-                rule = nat.get_rule(c_name, {'destination': dip})
-                sip = rule.get_flags().split(':')[1]
+                rule = nat.get_rule(c_name, {'destination': dip,
+                                             'target': 'DNAT'})
+                if not rule:
+                    warn(r('No DNAT rule for dip %s in %s\n'
+                           % (dip, c_name)))
+                    return False
+                sip = rule.get_option('to-destination')
                 if not ipInNetworks(sip, ips_qr):
                     warn(r('sip %s not in qr port %s\n' % (sip, ips_qr)))
                     return False
                 rule_expect = {'in': '*', 'source': '*', 'out': '*',
                                'destination': dip, 'target': 'DNAT',
-                               'prot': '*', 'flags': 'to:'+sip}
+                               'prot': '*', 'to-destination': sip}
                 if not rule.is_match(rule_expect):
                     warn(r('rule not matched in %s\n' % (c_name)))
                     return False
@@ -120,7 +160,7 @@ class DVR(object):
                              % (dip, sip)))
                 rule_expect = {'in': '*', 'source': sip, 'out': '*',
                                'destination': '*', 'target': 'SNAT',
-                               'prot': '*', 'flags': 'to:'+dip}
+                               'prot': '*', 'to-source': dip}
                 if not self._check_chain_has_rule(
                         nat,
                         'neutron-l3-agent-float-snat',
@@ -138,8 +178,7 @@ class DVR(object):
         :param ns_fip:
         :return:
         """
-        ipt = IPtables(ns_q)
-        nat = ipt.get_table(table='nat')
+        nat = self.ipt.get_table(table='nat', ns=ns_q)
         chains = [
             'neutron-postrouting-bottom',
             'neutron-l3-agent-OUTPUT',
@@ -199,7 +238,7 @@ class DVR(object):
             rule = {'in': '!'+intf['intf'], 'source': '*',
                     'out': '!'+intf['intf'], 'destination': '*',
                     'target': 'ACCEPT', 'prot': '*',
-                    'flags': '! ctstate DNAT'}
+                    'ctstate': '!DNAT'}
             self._check_chain_has_rule(nat, c_name, rule)  # empty when no fip
 
         qr_intfs = NameSpace(ns_q).find_intfs('qr-')
@@ -275,7 +314,7 @@ class DVR(object):
         if not fg_port:
             warn('Cannot find fg_port in fip ns %s\n' % ns_fip)
             return False
-        if fg_port['intf'] in Bridge('br-ex').get_ports():
+        if self.index.has_port('br-ex', fg_port['intf']):
             output(g('fg port is attached to br-ex\n'))
         else:
             warn(g('fg port is NOT attached to br-ex\n'))
@@ -296,18 +335,17 @@ class DVR(object):
         """
         checked_ns = []
         output(b('>>> Checking vports ...\n'))
-        for port in self.br_int.get_ports():
-            if port.startswith('qr-'):  # qrouter port
-                output(b('## Checking router port = %s\n' % port))
-                nsrouter = self.nss.get_ns_by_port(port)
-                if nsrouter in checked_ns:
-                    output(g('Checking passed already\n'))
-                    continue
-                else:
-                    checked_ns.append(nsrouter)  # the names of the ns checked
-                    if not self._compute_check_router_ns(nsrouter):
-                        warn(r('<<< Checking vports failed\n'))
-                        return False
+        for port in self.index.ports_start_with('br-int', 'qr-'):  # qrouter
+            output(b('## Checking router port = %s\n' % port))
+            nsrouter = self.nss.get_ns_by_port(port)
+            if nsrouter in checked_ns:
+                output(g('Checking passed already\n'))
+                continue
+            else:
+                checked_ns.append(nsrouter)  # the names of the ns checked
+                if not self._compute_check_router_ns(nsrouter):
+                    warn(r('<<< Checking vports failed\n'))
+                    return False
         output(b('<<< Checking vports passed\n'))
         return True
 
@@ -385,6 +423,7 @@ class DVR(object):
         output(b('>>> Checking bridges...\n'))
         bridges = get_all_bridges()
         names = bridges.keys()
+        self._load_bridges(names)
         brvlans = [e for e in names
                   if e not in ['br-int', 'br-ex', 'br-tun']]
         if not brvlans:
@@ -402,7 +441,7 @@ class DVR(object):
             warn(r('No integration bridge is found\n'))
             return False
         else:
-            br = Bridge('br-int')
+            br = self._get_bridge('br-int')
             if 'vlan' in tunnel_types and not br.has_port('int-'+brvlan):
                 warn(r('tunnel port %s not found in br-int\n' %
                        'int-'+brvlan))
@@ -416,7 +455,7 @@ class DVR(object):
             warn(r('No external bridge is found\n'))
             return False
         else:
-            br = Bridge('br-ex')
+            br = self._get_bridge('br-ex')
             if not br.has_port_start_with('fg-'):
                 warn(r('No fg port found in br-ex\n'))
             if not br.has_port('phy-br-ex'):
@@ -425,14 +464,14 @@ class DVR(object):
 
         # check gre tunnel bridge
         if 'gre' in tunnel_types:
-            br = Bridge('br-tun')
+            br = self._get_bridge('br-tun')
             if not br.has_port('patch-int'):
                 warn(r('port %s not found in br-tun\n' % 'patch-int'))
                 return False
 
         # check vlan tunnel bridge
         if 'vlan' in tunnel_types:
-            br = Bridge(brvlan)
+            br = self._get_bridge(brvlan)
             if not br.has_port('phy-'+brvlan):
                 warn(r('port %s not found in %s\n' % ('phy-'+brvlan, brvlan)))
 
@@ -476,44 +515,45 @@ class DVR(object):
         Check the qrouter-***  fip-*** spaces in the compute node.
         :return:
         """
-        output(b('=== Checking DVR on compute node ===\n'))
-        flag = True
-        if not self._compute_check_config_files():
-            flag = False
-        output('\n')
-        if not self._compute_check_bridges():
-            flag = False
-        output('\n')
-        if not self._compute_check_vports():
-            flag = False
-        if flag:
-            output(g('=== PASSED Checking DVR on compute node ===\n'))
-        else:
-            warn(r('=== FAILED Checking DVR on compute node ===\n'))
-        return flag
+        return self._run_checks('compute', [
+            ('config_files', self._compute_check_config_files),
+            ('bridges', self._compute_check_bridges),
+            ('vports', self._compute_check_vports)])
 
     def _network_node_check(self):
         """
         Check the qrouter-***  fip-*** snat-*** spaces in the network node.
         :return:
         """
-        output(b('=== Checking DVR on network node ===\n'))
+        return self._run_checks('network', [
+            ('config_files', self._network_check_config_files),
+            ('processes', self._network_check_processes),
+            ('bridges', self._network_check_bridges),
+            ('vports', self._network_check_vports)])
+
+    def _run_checks(self, node, checks):
+        """
+        Run the checks in order, the result of each one is recorded once
+        it is done.
+        :param node: type of the node, compute or network
+        :param checks: list of (name, check function)
+        :return: True if all checks passed
+        """
+        output(b('=== Checking DVR on %s node ===\n' % node))
         flag = True
-        if not self._network_check_config_files():
-            flag = False
-        output('\n')
-        if not self._network_check_processes():
-            flag = False
-        output('\n')
-        if not self._network_check_bridges():
-            flag = False
-        output('\n')
-        if not self._network_check_vports():
-            flag = False
+        for i, (name, check) in enumerate(checks):
+            if i > 0:
+                output('\n')
+            passed = bool(check())
+            with Renderer() as out:
+                out.record('dvr_check', node=node, check=name, passed=passed)
+            flag = flag and passed
+        with Renderer() as out:
+            out.record('dvr_result', node=node, passed=flag)
         if flag:
-            output(g('=== PASSED Checking DVR on network node ===\n'))
+            output(g('=== PASSED Checking DVR on %s node ===\n' % node))
         else:
-            warn(r('=== FAILED Checking DVR on network node ===\n'))
+            warn(r('=== FAILED Checking DVR on %s node ===\n' % node))
         return flag
 
     def _network_check_config_files(self):
@@ -647,6 +687,7 @@ class DVR(object):
         output(b('>>> Checking bridges...\n'))
         bridges = get_all_bridges()
         names = bridges.keys()
+        self._load_bridges(names)
         brvlans = [e for e in names
                   if e not in ['br-int', 'br-ex', 'br-tun']]
         if not brvlans:
@@ -659,7 +700,7 @@ class DVR(object):
             warn(r('No integration bridge is found\n'))
             return False
         else:
-            br = Bridge('br-int')
+            br = self._get_bridge('br-int')
             if not br.has_port('int-'+brvlan) and not br.has_port('patch-tun'):
                 if not br.has_port('int-'+brvlan):
                     warn(r('port %s not found in br-int\n' % 'int-'+brvlan))
@@ -672,7 +713,7 @@ class DVR(object):
             warn(r('No external bridge is found\n'))
             return False
         else:
-            br = Bridge('br-ex')
+            br = self._get_bridge('br-ex')
             if not br.has_port_start_with('qg-'):
                 warn(r('No qg port found in br-ex\n'))
 
@@ -680,12 +721,12 @@ class DVR(object):
             warn(r('No tunnel bridge is found\n'))
             return False
         else:
-            br = Bridge('br-tun')
+            br = self._get_bridge('br-tun')
             if not br.has_port('patch-int'):
                 warn(r('port %s not found in br-tun\n' % 'patch-int'))
                 return False
 
-        br = Bridge(brvlan)
+        br = self._get_bridge(brvlan)
         if not br.has_port('phy-'+brvlan):
             warn(r('port %s not found in %s\n' % ('phy-'+brvlan, brvlan)))
 
@@ -700,16 +741,10 @@ class DVR(object):
         """
         checked_ns = []
         output(b('>>> Checking vports ...\n'))
-        qr_ports, dhcp_ports, sg_ports = [], [], []
         qr_ports_ips = []
-        br_ports = self.br_int.get_ports()
-        for port in br_ports:
-            if port.startswith('qr-'):  # qrouter port
-                qr_ports.append(port)
-            elif port.startswith('tap'):  # qrouter port
-                dhcp_ports.append(port)
-            elif port.startswith('sg-'):  # qrouter port
-                sg_ports.append(port)
+        qr_ports = self.index.ports_start_with('br-int', 'qr-')  # qrouter
+        dhcp_ports = self.index.ports_start_with('br-int', 'tap')  # dhcp
+        sg_ports = self.index.ports_start_with('br-int', 'sg-')  # snat
         if not qr_ports:
             output('# no qrouter port found\n')
         if not dhcp_ports:
@@ -888,8 +923,7 @@ class DVR(object):
         return True
 
     def _network_check_nat_table(self, ns_snat):
-        ipt = IPtables(ns_snat)
-        nat = ipt.get_table(table='nat')
+        nat = self.ipt.get_table(table='nat', ns=ns_snat)
         qg_intfs = NameSpace(ns_snat).find_intfs('qg-')
         chains = [
             'PREROUTING',
@@ -941,7 +975,7 @@ class DVR(object):
             rule = {'in': '!'+intf['intf'], 'source': '*',
                     'out': '!'+intf['intf'], 'destination': '*',
                     'target': 'ACCEPT', 'prot': '*',
-                    'flags': '! ctstate DNAT'}
+                    'ctstate': '!DNAT'}
             if not self._check_chain_has_rule(nat, c_name, rule):
                 warn(r("Chain %s's rule failed\n" % c_name))
                 return False
@@ -952,7 +986,7 @@ class DVR(object):
                 ip = ip_m.split('/')[0]
                 rule = {'in': '*', 'source': '*', 'out': intf['intf'],
                         'destination': '*', 'target': 'SNAT', 'prot': '*',
-                        'flags': 'to:'+ip}
+                        'to-source': ip}
                 if not self._check_chain_has_rule(nat, c_name, rule):
                     warn(r("Chain %s's rule failed\n" % c_name))
                     return False
@@ -1,46 +1,122 @@
 __author__ = 'baohua'
 
+from collections import namedtuple
+import heapq
+from operator import attrgetter, itemgetter
+import re
+
 from easyovs.log import output
+from easyovs.render import Renderer
 from easyovs.util import compress_mac_str, color_str
 
+try:
+    _intern = intern
+except NameError:  # python 3
+    from sys import intern as _intern
+
+flow_sort_key = attrgetter('sort_key')
+
 
 class Flow(object):
     """
     An OpenvSwitch flow rule.
     """
+    __slots__ = ('bridge', 'table', 'packet', 'priority', 'match', 'actions',
+                 'id', 'cookie', 'n_bytes', 'duration', 'idle_timeout',
+                 'hard_timeout', 'raw_match', 'raw_actions', 'sort_key')
+
+    # self.id, self.packet, self.table, self.priority, self.match,
+    # self.actions
+    _format_str_ = '%-3u%-10u%-4u%-6u%-60s%-20s\n'
+    # pkt rate, byte rate, self.table, self.priority, self.match, self.actions
+    _rate_format_str_ = '%-10.1f%-12.1f%-4u%-6u%-60s%-20s\n'
 
     def __init__(self, bridge='', table=0, packet=0, priority=0, match='',
-                 actions='', flow_id=0):
+                 actions='', flow_id=0, cookie=0, n_bytes=0, duration=0.0,
+                 idle_timeout=0, hard_timeout=0, raw_match='',
+                 raw_actions=''):
         self.bridge = bridge
         self.table = table
         self.packet = packet
         self.priority = priority
         self.match = match
-        self.actions = actions
+        self.actions = _intern(actions)
         self.id = flow_id
-        self._format_str_ = '%-3u%-10u%-4u%-6u%-60s%-20s\n'
-        # self.id, self.table, self.packet, self.priority, self.match,
-        # self.actions
+        self.cookie = cookie
+        self.n_bytes = n_bytes
+        self.duration = duration
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.raw_match = raw_match  # original match, e.g., in_port=1
+        self.raw_actions = _intern(raw_actions)  # original, e.g., output:2
+        # ascending in order of table:priority, hit flows first
+        self.sort_key = \
+            (table << 17) | ((0xffff - priority) << 1) | (packet == 0)
+
+    def canonical(self):
+        """
+        Return the flow as a string of the fields compared by __eq__.
+        """
+        return 'table=%u,priority=%u,%s actions=%s' % (
+            self.table, self.priority, self.match, self.actions)
+
+    def strict_match(self):
+        """
+        Return the match to del this flow strictly, e.g.,
+        table=0,priority=2,in_port=1
+        """
+        if self.raw_match:
+            return 'table=%u,priority=%u,%s' % (self.table, self.priority,
+                                                self.raw_match)
+        return 'table=%u,priority=%u' % (self.table, self.priority)
+
+    _banner_ = '%-3s%-10s%-4s%-6s%-60s%-20s\n' \
+        % ('ID', 'PKT', 'TAB', 'PRI', 'MATCH', 'ACT')
+
+    @staticmethod
+    def banner_str():
+        return Flow._banner_
 
     @staticmethod
     def banner_output():
-        output(color_str('%-3s%-10s%-4s%-6s%-60s%-20s\n'
-               % ('ID', 'PKT', 'TAB', 'PRI', 'MATCH', 'ACT'), 'g'))
+        output(color_str(Flow._banner_, 'g'))
+
+    def fmt_str(self):
+        """
+        Return the flow rendered as a row under the banner.
+        """
+        return self._format_str_ % (self.id, self.packet, self.table,
+                                    self.priority,
+                                    compress_mac_str(self.match),
+                                    self.actions)
+
+    def to_dict(self):
+        """
+        Return the fields of the flow as a dict, for the json output.
+        """
+        return {'bridge': self.bridge, 'id': self.id, 'table': self.table,
+                'priority': self.priority, 'cookie': '0x%x' % self.cookie,
+                'n_packets': self.packet, 'n_bytes': self.n_bytes,
+                'duration': self.duration, 'idle_timeout': self.idle_timeout,
+                'hard_timeout': self.hard_timeout, 'match': self.match,
+                'actions': self.actions, 'raw_match': self.raw_match,
+                'raw_actions': self.raw_actions}
 
     def fmt_output(self):
         if self.packet > 0:
-            result = \
-                color_str( self._format_str_ % (self.id, self.packet,
-                                                self.table,
-                                                self.priority,
-                                                compress_mac_str(self.match),
-                                                self.actions), 'b')
+            output(color_str(self.fmt_str(), 'b'))
         else:
-            result = \
-                self._format_str_ \
-                % (self.id, self.packet, self.table,
-                   self.priority, compress_mac_str(self.match), self.actions)
-        output(result)
+            output(self.fmt_str())
+
+    @staticmethod
+    def rate_banner_output():
+        output(color_str('%-10s%-12s%-4s%-6s%-60s%-20s\n'
+               % ('PKT/s', 'BYTE/s', 'TAB', 'PRI', 'MATCH', 'ACT'), 'g'))
+
+    def fmt_rate_output(self, pkt_rate, byte_rate):
+        output(self._rate_format_str_
+               % (pkt_rate, byte_rate, self.table, self.priority,
+                  compress_mac_str(self.match), self.actions))
 
     def __eq__(self, other):
         return \
@@ -50,6 +126,9 @@ class Flow(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash((self.table, self.priority, self.match, self.actions))
+
     def __gt__(self, other):
         return \
             self.table < other.table or \
@@ -59,3 +138,329 @@ class Flow(object):
 
     def __lt__(self, other):
         return not self.__eq__(other) and not self.__gt__(other)
+
+
+# the common layout of a flow printed by ovs-ofctl dump-flows
+_flow_line = re.compile(
+    r'\s*cookie=0x([0-9a-fA-F]+), duration=([0-9.]+)s, table=(\d+), '
+    r'n_packets=(\d+), n_bytes=(\d+),(?: idle_timeout=(\d+),)?'
+    r'(?: hard_timeout=(\d+),)?(.*) actions=(.*)')
+
+# counters and flags printed before the match of a flow by ovs-ofctl
+_FLOW_STATS = {
+    'cookie': lambda v: int(v, 16),
+    'duration': lambda v: float(v.rstrip('s')),
+    'table': int,
+    'n_packets': int,
+    'n_bytes': int,
+    'idle_timeout': int,
+    'hard_timeout': int,
+}
+
+OFP_DEFAULT_PRIORITY = 32768
+
+FlowFields = namedtuple('FlowFields', [
+    'cookie', 'duration', 'table', 'n_packets', 'n_bytes', 'idle_timeout',
+    'hard_timeout', 'priority', 'match', 'actions', 'raw_match',
+    'raw_actions'])
+
+
+def split_actions(actions):
+    """
+    Split the actions string into a list, commas inside () and [] are kept.
+    >>> split_actions('mod_vlan_vid:1,NORMAL')
+    ['mod_vlan_vid:1', 'NORMAL']
+    >>> split_actions('ct(commit,zone=1),resubmit(,2)')
+    ['ct(commit,zone=1)', 'resubmit(,2)']
+    >>> split_actions('')
+    []
+    """
+    if not actions:
+        return []
+    if '(' not in actions and '[' not in actions:
+        return actions.split(',')
+    result, depth = [], 0
+    for part in actions.split(','):  # rejoin the parts inside brackets
+        if depth:
+            result[-1] += ',' + part
+        else:
+            result.append(part)
+        if '(' in part or ')' in part or '[' in part or ']' in part:
+            depth += part.count('(') + part.count('[') - \
+                part.count(')') - part.count(']')
+    return result
+
+
+def match_fields(match):
+    """
+    Return the list of (key, value) of the match items, value is None for
+    a protocol like ip.
+    >>> match_fields(['ip', 'in_port=1'])
+    [('ip', None), ('in_port', '1')]
+    """
+    result = []
+    for m in match:
+        key, eq, value = m.partition('=')
+        result.append((key, value if eq else None))
+    return result
+
+
+def parse_flow_line(line):
+    """
+    Parse a line of ovs-ofctl dump-flows in one pass.
+    Return a FlowFields with the numbers converted, the match as a list of
+    items and the actions as a list of actions, or None.
+    >>> f = parse_flow_line(' cookie=0x1a, duration=5.3s, table=2, '
+    ...     'n_packets=7, n_bytes=420, idle_timeout=10, idle_age=1, '
+    ...     'priority=3,ip,in_port=1 actions=output:2,NORMAL')
+    >>> f.cookie, f.duration, f.table, f.n_packets, f.n_bytes
+    (26, 5.3, 2, 7, 420)
+    >>> f.idle_timeout, f.hard_timeout, f.priority
+    (10, 0, 3)
+    >>> f.match, f.raw_match, f.actions
+    (['ip', 'in_port=1'], 'ip,in_port=1', ['output:2', 'NORMAL'])
+    >>> parse_flow_line('cookie=0x0, duration=1s, table=0, n_packets=0, '
+    ...     'n_bytes=0, actions=drop').priority
+    32768
+    """
+    fields = flow_line_fields(line)
+    if fields is None:
+        return None
+    match, actions = fields[8:]
+    return FlowFields(*(fields[:8] + (match.split(',') if match else [],
+                                      split_actions(actions), match,
+                                      actions)))
+
+
+def flow_line_fields(line):
+    """
+    Return the (cookie, duration, table, n_packets, n_bytes, idle_timeout,
+    hard_timeout, priority, match, actions) of a line of ovs-ofctl
+    dump-flows as parse_flow_line(), without splitting the match and the
+    actions, or None.
+    >>> flow_line_fields('cookie=0x0, duration=1s, table=0, n_packets=0, '
+    ...     'n_bytes=0, idle_age=1, priority=1,ip actions=drop')
+    (0, 1.0, 0, 0, 0, 0, 0, 1, 'ip', 'drop')
+    """
+    m = _flow_line.match(line)
+    if m is None:
+        fields = _parse_flow_line_fields(line)
+        return fields and fields[:8] + fields[10:]
+    cookie, duration, table, n_packets, n_bytes, idle_timeout, \
+        hard_timeout, rest, actions = m.groups()
+    # flags or counters are before a space
+    match = rest[rest.rfind(' ') + 1:]
+    priority = OFP_DEFAULT_PRIORITY
+    if match[:9] == 'priority=':
+        i = match.find(',')
+        if i < 0:
+            priority, match = int(match[9:]), ''
+        else:
+            priority, match = int(match[9:i]), match[i + 1:]
+    elif match[-1:] == ',':  # no match, only counters
+        match = ''
+    return (int(cookie, 16), float(duration), int(table), int(n_packets),
+            int(n_bytes), int(idle_timeout) if idle_timeout else 0,
+            int(hard_timeout) if hard_timeout else 0, priority, match,
+            actions.strip())
+
+
+def parse_flow_counters(line):
+    """
+    Return the (table, priority, match, n_packets, n_bytes) of a line of
+    ovs-ofctl dump-flows, or None. It's cheaper than parse_flow_line() as
+    the match and the actions are not split.
+    >>> parse_flow_counters(' cookie=0x1a, duration=5.3s, table=2, '
+    ...     'n_packets=7, n_bytes=420, idle_age=1, '
+    ...     'priority=3,ip,in_port=1 actions=output:2,NORMAL')
+    (2, 3, 'ip,in_port=1', 7, 420)
+    """
+    m = _flow_line.match(line)
+    if m is None:
+        fields = _parse_flow_line_fields(line)
+        if not fields:
+            return None
+        return fields.table, fields.priority, fields.raw_match, \
+            fields.n_packets, fields.n_bytes
+    match = m.group(8).rpartition(' ')[2]
+    priority = OFP_DEFAULT_PRIORITY
+    if match.startswith('priority='):
+        p, _, match = match.partition(',')
+        priority = int(p[9:])
+    elif match.endswith(','):
+        match = ''
+    return int(m.group(3)), priority, match, int(m.group(4)), \
+        int(m.group(5))
+
+
+def _parse_flow_line_fields(line):
+    """
+    Parse a flow line field by field, for the layouts not matched by
+    _flow_line, e.g., counters in other order.
+    >>> _parse_flow_line_fields('cookie=0x0, table=1, duration=2.0s, '
+    ...     'n_bytes=0, n_packets=0, send_flow_rem priority=5,arp '
+    ...     'actions=drop').priority
+    5
+    """
+    line = line.strip()
+    if not line.startswith('cookie='):
+        return None
+    i = line.find(' actions=')
+    if i < 0:
+        return None
+    fields = {'cookie': 0, 'duration': 0.0, 'table': 0, 'n_packets': 0,
+              'n_bytes': 0, 'idle_timeout': 0, 'hard_timeout': 0}
+    match, priority = '', OFP_DEFAULT_PRIORITY
+    try:
+        for part in line[:i].split(', '):
+            key, _, value = part.partition('=')
+            if key in _FLOW_STATS:
+                fields[key] = _FLOW_STATS[key](value.rstrip(','))
+        match = line[:i].rpartition(' ')[2]
+        if match.startswith('priority='):
+            p, _, match = match.partition(',')
+            priority = int(p[9:])
+        elif match.endswith(',') or match.partition('=')[0] in _FLOW_STATS:
+            match = ''
+    except ValueError:
+        return None
+    actions = line[i + 9:].strip()
+    return FlowFields(fields['cookie'], fields['duration'], fields['table'],
+                      fields['n_packets'], fields['n_bytes'],
+                      fields['idle_timeout'], fields['hard_timeout'],
+                      priority, match.split(',') if match else [],
+                      split_actions(actions), match, actions)
+
+
+def output_flows(flows):
+    """
+    Output the flows under a banner, with an empty line between tables.
+    The rows are buffered and written by chunks, not logged one by one.
+    :param flows: iterable of Flow in order of table
+    :return: number of the flows
+    """
+    table, num = 0, 0
+    with Renderer() as out:
+        for f in flows:
+            if out.structured:
+                out.record('flow', **f.to_dict())
+                num += 1
+                continue
+            if num == 0:
+                out.write(Flow.banner_str(), 'g')
+            elif f.table != table:
+                out.write('\n')
+            table = f.table
+            out.write(f.fmt_str(), 'b' if f.packet > 0 else None)
+            num += 1
+    return num
+
+
+def diff_flows(old, new, raw=False):
+    """
+    Compare two lists of flows by hashing them once, flows are the same
+    one if they have the same table, priority and match.
+    :param old: list of Flow
+    :param new: list of Flow
+    :param raw: compare the original match and actions with the port
+        numbers, instead of the ones with the ports named
+    :return: lists of the added, the removed, (old, new) of the changed
+        actions, and (old, new) of the equal flows with changed counters
+    >>> a = [Flow(table=0, priority=1, match='ip', actions='drop'),
+    ...      Flow(table=0, priority=2, match='arp', actions='NORMAL'),
+    ...      Flow(table=1, priority=0, match='*', actions='drop', packet=3)]
+    >>> b = [Flow(table=0, priority=1, match='ip', actions='NORMAL'),
+    ...      Flow(table=1, priority=0, match='*', actions='drop', packet=5),
+    ...      Flow(table=2, priority=0, match='*', actions='drop')]
+    >>> added, removed, changed, counters = diff_flows(a, b)
+    >>> [f.table for f in added], [f.match for f in removed]
+    ([2], ['arp'])
+    >>> [(x.actions, y.actions) for x, y in changed]
+    [('drop', 'NORMAL')]
+    >>> [(x.packet, y.packet) for x, y in counters]
+    [(3, 5)]
+    >>> a = [Flow(match='in_port=qvo1', actions='output:qvo2',
+    ...           raw_match='in_port=1', raw_actions='output:2')]
+    >>> b = [Flow(match='in_port=1', actions='output:2',
+    ...           raw_match='in_port=1', raw_actions='output:2')]
+    >>> [len(x) for x in diff_flows(a, b, raw=True)]
+    [0, 0, 0, 0]
+    """
+    if raw:
+        def key(f):
+            return f.table, f.priority, f.raw_match
+
+        def actions(f):
+            return f.raw_actions
+    else:
+        def key(f):
+            return f.table, f.priority, f.match
+
+        def actions(f):
+            return f.actions
+    old_flows = {}
+    for f in old:
+        old_flows.setdefault(key(f), []).append(f)
+    added, changed, counters = [], [], []
+    for f in new:
+        flows = old_flows.get(key(f))
+        if not flows:
+            added.append(f)
+            continue
+        o = flows.pop(0)
+        if actions(o) != actions(f):
+            changed.append((o, f))
+        elif o.packet != f.packet or o.n_bytes != f.n_bytes:
+            counters.append((o, f))
+    left = set(id(f) for flows in old_flows.values() for f in flows)
+    removed = [f for f in old if id(f) in left]
+    return added, removed, changed, counters
+
+
+def sort_flows_per_table(flows):
+    """
+    Yield the flows in order of table:priority.
+    ovs-ofctl dumps the flows table by table, so only the flows of the
+    current table are buffered and sorted before being yielded.
+    :param flows: iterable of Flow objects, grouped by table
+    """
+    group, table = [], None
+    for flow in flows:
+        if flow.table != table and group:
+            group.sort(key=flow_sort_key)
+            for f in group:
+                yield f
+            group = []
+        table = flow.table
+        group.append(flow)
+    group.sort(key=flow_sort_key)
+    for f in group:
+        yield f
+
+
+def top_flow_rates(prev, cur, elapsed, num):
+    """
+    Return the num flows with the highest rates between two samples, as a
+    list of (pkt rate, byte rate, line), only the top ones are kept in a
+    heap instead of sorting all.
+    :param prev: {(table, priority, match): (n_packets, n_bytes, line)}
+    :param cur: the sample taken elapsed seconds after prev
+    :param elapsed: seconds between the samples
+    :param num: number of flows to return
+    >>> prev = {(0, 1, 'ip'): (10, 1000, 'a'), (0, 2, ''): (5, 50, 'b')}
+    >>> cur = {(0, 1, 'ip'): (30, 3000, 'a'), (0, 2, ''): (5, 50, 'b'),
+    ...        (1, 0, ''): (4, 400, 'c')}
+    >>> top_flow_rates(prev, cur, 2.0, 5)
+    [(10.0, 1000.0, 'a'), (2.0, 200.0, 'c')]
+    >>> top_flow_rates(prev, cur, 2.0, 1)
+    [(10.0, 1000.0, 'a')]
+    """
+    def rates():
+        for key, (n_packets, n_bytes, line) in cur.items():
+            old = prev.get(key)
+            if old and n_packets >= old[0]:
+                n_packets, n_bytes = n_packets - old[0], n_bytes - old[1]
+            # else: a new flow, or re-added with counters reset
+            if n_packets or n_bytes:
+                yield n_packets / elapsed, n_bytes / elapsed, line
+    return heapq.nlargest(num, rates(), key=itemgetter(0, 1))
@@ -0,0 +1,188 @@
+__author__ = 'baohua'
+
+from bisect import bisect_left, bisect_right
+import re
+
+from easyovs.flow import split_actions
+from easyovs.log import warn
+
+# numeric attributes of Flow which support range queries
+RANGE_KEYS = {'table': 'table', 'priority': 'priority', 'packets': 'packet',
+              'n_packets': 'packet', 'bytes': 'n_bytes',
+              'n_bytes': 'n_bytes', 'duration': 'duration'}
+
+_predicate = re.compile(r'^([\w.:-]+)(>=|<=|!=|=|>|<)(.*)$')
+
+
+def _number(value):
+    """
+    Convert the value of a range key into a number.
+    >>> _number('0x10'), _number('010'), _number('1.5'), _number('abc')
+    (16, 10, 1.5, None)
+    """
+    try:
+        if '.' in value:
+            return float(value)
+        try:
+            return int(value, 0)
+        except ValueError:  # decimal with leading zeros, e.g., 010
+            return int(value, 10)
+    except ValueError:
+        return None
+
+
+def parse_query(args):
+    """
+    Parse the query tokens into a list of (key, op, value).
+    A bare token like ip is (ip, =, ''), the value of a range key is
+    converted into a number.
+    :return: the list, or None if any predicate is invalid
+    >>> parse_query(['in_port=qvo1*', 'priority>=10', 'ip'])
+    [('in_port', '=', 'qvo1*'), ('priority', '>=', 10), ('ip', '=', '')]
+    >>> parse_query(['dl_vlan=1,output=2'])
+    [('dl_vlan', '=', '1'), ('output', '=', '2')]
+    """
+    result = []
+    for arg in args:
+        for token in arg.split(','):
+            token = token.strip()
+            if not token:
+                continue
+            m = _predicate.match(token)
+            if not m:
+                result.append((token, '=', ''))
+                continue
+            key, op, value = m.groups()
+            if key in RANGE_KEYS:
+                value = _number(value)
+                if value is None:
+                    warn('Invalid number in %s\n' % token)
+                    return None
+            elif op not in ('=', '!='):
+                warn('%s only supports = and !=, the range keys are %s\n'
+                     % (key, ', '.join(sorted(RANGE_KEYS))))
+                return None
+            elif key == 'cookie' and value and not value.endswith('*'):
+                try:
+                    int(value, 16)
+                except ValueError:
+                    warn('Invalid cookie in %s\n' % token)
+                    return None
+            result.append((key, op, value))
+    return result
+
+
+class FlowIndex(object):
+    """
+    Inverted indexes over a list of flows, to answer the predicate queries
+    without scanning all flows.
+    """
+
+    def __init__(self, flows):
+        self.flows = flows
+        self.match = {}  # key --> value --> set of flow positions
+        self.actions = {}  # action name --> argument --> set of positions
+        self.sorted_values = {}  # (index, key) --> sorted values, for prefix
+        self.ranges = {}  # attribute --> (sorted values, their positions)
+        for i, f in enumerate(flows):
+            self._add(self.match, 'cookie', hex(f.cookie), i)
+            for m in set(f.match.split(',') + f.raw_match.split(',')):
+                if m and m != '*':
+                    key, _, value = m.partition('=')
+                    self._add(self.match, key, value, i)
+            for act in split_actions(f.actions) + \
+                    split_actions(f.raw_actions):
+                name, value = act, ''
+                for sep in (':', '(', '='):
+                    if sep in act:
+                        name, _, value = act.partition(sep)
+                        break
+                self._add(self.actions, name, value.rstrip(')'), i)
+
+    @staticmethod
+    def _add(index, key, value, i):
+        index.setdefault(key, {}).setdefault(value, set()).add(i)
+
+    def _values(self, name, key, value):
+        """
+        Return the set of positions of the key equal to the value, or with
+        the value as prefix if it ends with *.
+        :param name: name of the index, match or actions
+        """
+        values = getattr(self, name).get(key)
+        if not values:
+            return set()
+        if not value.endswith('*'):
+            return values.get(value, set())
+        prefix = value[:-1]
+        if (name, key) not in self.sorted_values:
+            self.sorted_values[(name, key)] = sorted(values.keys())
+        keys = self.sorted_values[(name, key)]
+        result = set()
+        for k in keys[bisect_left(keys, prefix):]:
+            if not k.startswith(prefix):
+                break
+            result |= values[k]
+        return result
+
+    def _range(self, attr, op, value):
+        """
+        Return the set of positions whose numeric attribute is in range.
+        """
+        if attr not in self.ranges:
+            pairs = sorted((getattr(f, attr), i)
+                           for i, f in enumerate(self.flows))
+            self.ranges[attr] = ([v for v, _ in pairs], [i for _, i in pairs])
+        values, positions = self.ranges[attr]
+        lo, hi = 0, len(values)
+        if op == '>':
+            lo = bisect_right(values, value)
+        elif op == '>=':
+            lo = bisect_left(values, value)
+        elif op == '<':
+            hi = bisect_left(values, value)
+        elif op == '<=':
+            hi = bisect_right(values, value)
+        else:
+            lo, hi = bisect_left(values, value), bisect_right(values, value)
+        return set(positions[lo:hi])
+
+    def _select(self, key, op, value):
+        """
+        Return the set of positions matched by one predicate.
+        """
+        if key in RANGE_KEYS:
+            if op == '!=':
+                return set(range(len(self.flows))) - \
+                    self._range(RANGE_KEYS[key], '=', value)
+            return self._range(RANGE_KEYS[key], op, value)
+        if key in ('output', 'action', 'actions'):
+            if key == 'output':
+                result = self._values('actions', 'output', value)
+            else:
+                result = self._values('actions', value, '*')
+        elif key == 'cookie' and value and not value.endswith('*'):
+            result = self._values('match', key, hex(int(value, 16)))
+        else:
+            result = self._values('match', key, value)
+        if op == '!=':
+            return set(range(len(self.flows))) - result
+        return result
+
+    def find(self, query):
+        """
+        Return the flows matched by all the predicates, in original order.
+        :param query: list of (key, op, value) from parse_query(), with the
+        numeric value of the range keys
+        :return: list of Flow
+        """
+        if not query:
+            return list(self.flows)
+        sets = [self._select(k, op, v) for k, op, v in query]
+        sets.sort(key=len)
+        result = sets[0]
+        for s in sets[1:]:
+            if not result:
+                break
+            result = result & s
+        return [self.flows[i] for i in sorted(result)]
@@ -0,0 +1,138 @@
+__author__ = 'baohua'
+
+from easyovs.trace import parse_match
+
+IDLE_DURATION = 3600  # seconds of a flow without any hit to report
+
+
+def _covers(mask, other):
+    """
+    Return True if the flows with mask match a superset of the packets
+    matched by the flows with the other mask on the same values, i.e.,
+    every field of mask is also matched by other with the same bits.
+    :param mask: dict of field --> mask, None for a non-numeric field
+    :param other: the same as mask
+    >>> _covers({'in_port': 1}, {'in_port': 1, 'dl_vlan': 0xfff})
+    True
+    >>> _covers({'nw_dst': 0xffffff00}, {'nw_dst': 0xffff0000})
+    False
+    >>> _covers({'ct_state': None}, {})
+    False
+    """
+    for f, m in mask.items():
+        if f not in other:
+            return False
+        o = other[f]
+        if m is None or o is None:
+            if m is not o:
+                return False
+        elif o & m != m:
+            return False
+    return True
+
+
+class _MaskGroup(object):
+    """
+    The flows of a table with the same fields and masks, indexed by their
+    masked values.
+    """
+
+    def __init__(self, mask):
+        self.mask = mask  # dict of field --> mask
+        self.fields = sorted(mask.keys())
+        self.max_priority = -1
+        self.flows = []  # list of (flow, parsed fields)
+        self.rules = {}  # masked values --> flows, highest priority first
+
+    def key(self, fields):
+        """
+        Return the values of the given parsed fields under this mask.
+        """
+        key = []
+        for f in self.fields:
+            v, m = fields[f][0], self.mask[f]
+            key.append(v if m is None else v & m)
+        return tuple(key)
+
+    def add(self, flow, fields):
+        self.flows.append((flow, fields))
+        self.rules.setdefault(self.key(fields), []).append(flow)
+        self.max_priority = max(self.max_priority, flow.priority)
+
+
+def lint_flows(flows, min_duration=IDLE_DURATION, port_numbers=None):
+    """
+    Find the flows which can never match as a higher priority flow in the
+    same table covers them, and the ones without hit for a long time.
+    The flows are grouped by table and masks, so a flow is only checked
+    against the groups whose masks are covered by its own, by one hash
+    lookup per group instead of comparing with every other flow.
+    :param flows: list of Flow
+    :param min_duration: seconds to report a flow without hit as idle
+    :param port_numbers: dict of interface name --> ofport
+    :return: dict of 'shadowed' and 'duplicate' --> list of (flow, by the
+        higher priority flow), 'idle' --> list of flows, and 'skipped' -->
+        list of (flow, error) of the flows not parsed. A duplicate one is
+        covered by a flow with the same actions.
+    >>> from easyovs.flow import Flow
+    >>> fs = [Flow(table=0, priority=1, raw_match='ip,nw_dst=10.0.0.1',
+    ...            raw_actions='drop'),
+    ...       Flow(table=0, priority=2, raw_match='ip,nw_dst=10.0.0.0/24',
+    ...            raw_actions='drop'),
+    ...       Flow(table=0, priority=1, raw_match='ip,nw_dst=10.0.1.1',
+    ...            raw_actions='NORMAL'),
+    ...       Flow(table=0, priority=3, raw_match='ip', raw_actions='NORMAL',
+    ...            packet=5),
+    ...       Flow(table=1, priority=1, raw_match='ip', raw_actions='drop',
+    ...            duration=4000)]
+    >>> r = lint_flows(fs)
+    >>> [(f.raw_match, by.priority) for f, by in r['shadowed']]
+    [('ip,nw_dst=10.0.0.1', 3), ('ip,nw_dst=10.0.0.0/24', 3)]
+    >>> [(f.raw_match, by.priority) for f, by in r['duplicate']]
+    [('ip,nw_dst=10.0.1.1', 3)]
+    >>> [f.table for f in r['idle']]
+    [1]
+    """
+    result = {'shadowed': [], 'duplicate': [], 'idle': [], 'skipped': []}
+    tables = {}  # table id --> {mask signature: _MaskGroup}
+    for flow in sorted(flows, key=lambda f: -f.priority):
+        try:
+            fields = parse_match(flow.raw_match, port_numbers)
+        except ValueError as e:
+            result['skipped'].append((flow, e))
+            continue
+        mask = dict((f, m) for f, (v, m) in fields.items())
+        groups = tables.setdefault(flow.table, {})
+        signature = tuple(sorted(mask.items()))
+        if signature not in groups:
+            groups[signature] = _MaskGroup(mask)
+        groups[signature].add(flow, fields)
+    for table in sorted(tables):
+        groups = list(tables[table].values())
+        for group in groups:
+            covering = [g for g in groups if _covers(g.mask, group.mask)]
+            for flow, fields in group.flows:
+                by = None
+                for g in covering:
+                    if g.max_priority <= flow.priority or \
+                            (by and by.priority >= g.max_priority):
+                        continue
+                    for other in g.rules.get(g.key(fields), []):
+                        if other.priority <= flow.priority:
+                            break
+                        if by is None or other.priority > by.priority:
+                            by = other
+                        break
+                if by is None:
+                    continue
+                if by.raw_actions == flow.raw_actions:
+                    result['duplicate'].append((flow, by))
+                else:
+                    result['shadowed'].append((flow, by))
+    for flow in flows:
+        if flow.packet == 0 and flow.duration >= min_duration:
+            result['idle'].append(flow)
+    order = dict((id(f), i) for i, f in enumerate(flows))
+    for k in ('shadowed', 'duplicate', 'skipped'):
+        result[k].sort(key=lambda x: order[id(x[0])])
+    return result
@@ -0,0 +1,319 @@
+__author__ = 'baohua'
+
+from bisect import bisect_left
+import threading
+
+from easyovs.log import debug
+from easyovs.ovsdb import OVSDBClient, OVSDBError, OVSDB_DB, ovsdb_map, \
+    ovsdb_set, ovsdb_str
+
+MONITOR_TABLES = {
+    'Bridge': ['name', 'ports', 'controller', 'fail_mode', 'external_ids'],
+    'Port': ['name', 'tag', 'interfaces'],
+    'Interface': ['name', 'type', 'ofport', 'external_ids', 'mac_in_use'],
+    'Controller': ['target'],
+}
+
+OFPP_LOCAL = 65534
+
+# length of the neutron port id prefix in the interface names, e.g.,
+# a4111776-bd of qr-a4111776-bd
+PORT_ID_LEN = 11
+
+_inventory = None
+
+
+class Inventory(object):
+    """
+    A live copy of the ovsdb bridge/port/interface tables, kept up to date
+    by an ovsdb monitor in the background.
+    """
+
+    def __init__(self, client=None):
+        self.client = client or OVSDBClient()
+        self.tables = dict((t, {}) for t in MONITOR_TABLES)
+        self.lock = threading.Lock()
+        self.alive = False
+        self.thread = None
+        self.bridges = None  # view of get_bridges(), None when out of date
+        self.ports = {}  # bridge name --> view of get_ports()
+        self.index = None  # PortIndex of all bridges, None when out of date
+
+    def start(self):
+        """
+        Subscribe to the tables and wait for the initial content, then keep
+        applying the updates in a daemon thread.
+        :return: True or False
+        """
+        monitor = dict((t, {'columns': MONITOR_TABLES[t]})
+                       for t in MONITOR_TABLES)
+        try:
+            updates = self.client.call('monitor',
+                                       [OVSDB_DB, 'easyovs', monitor])
+        except OVSDBError as e:
+            debug('Inventory: monitor failed, %s\n' % e)
+            self.client.close()
+            return False
+        self.apply(updates)
+        self.client.sock.settimeout(None)  # updates may come at any time
+        self.alive = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def stop(self):
+        self.alive = False
+        self.client.close()
+
+    def _run(self):
+        while self.alive:
+            try:
+                msg = self.client.recv()
+            except OVSDBError as e:
+                debug('Inventory: monitor stopped, %s\n' % e)
+                self.alive = False
+                return
+            method = msg.get('method')
+            if method == 'update':
+                self.apply(msg.get('params', [None, {}])[1])
+            elif method == 'echo':
+                try:
+                    self.client.send({'result': msg.get('params'),
+                                      'error': None, 'id': msg.get('id')})
+                except OVSDBError:
+                    self.alive = False
+                    return
+
+    def apply(self, updates):
+        """
+        Apply the table-updates of the ovsdb monitor.
+        :param updates: {table: {uuid: {'old': row, 'new': row}}}
+        """
+        with self.lock:
+            for t, rows in (updates or {}).items():
+                if t not in self.tables:
+                    continue
+                for uuid, row in rows.items():
+                    if row.get('new') is None:
+                        self.tables[t].pop(uuid, None)
+                    else:
+                        self.tables[t][uuid] = row['new']
+            self.bridges, self.ports, self.index = None, {}, None
+
+    def has_bridge(self, name):
+        """
+        Return True of False of a bridge's existence.
+        """
+        with self.lock:
+            for row in self.tables['Bridge'].values():
+                if row.get('name') == name:
+                    return True
+        return False
+
+    def get_bridges(self):
+        """
+        Return a dict of all bridges, in the same shape as
+        easyovs.util.get_all_bridges().
+        """
+        with self.lock:
+            if self.bridges is None:
+                self.bridges = self._build_bridges()
+            return self.bridges
+
+    def get_ports(self, bridge):
+        """
+        Return a dict of the ports on the bridge, like
+        {
+            'qvoxxx':{
+                'port':'2',
+                'addr':'fa:16:3e:ff:f3:01',
+                'vlan':'1',
+                'type':'',
+                'external_ids': {'iface-id': 'xxx', ...},
+            }
+        }
+        """
+        with self.lock:
+            if bridge not in self.ports:
+                self.ports[bridge] = self._build_ports(bridge)
+            return self.ports[bridge]
+
+    def get_index(self):
+        """
+        Return the PortIndex of the ports on all bridges, which is built
+        once after each update of the tables.
+        """
+        with self.lock:
+            if self.index is None:
+                bridges = {}
+                for row in self.tables['Bridge'].values():
+                    name = row.get('name')
+                    if name not in self.ports:
+                        self.ports[name] = self._build_ports(name)
+                    bridges[name] = self.ports[name]
+                self.index = PortIndex(bridges)
+            return self.index
+
+    def get_interfaces(self):
+        """
+        Return a dict of interface name --> external_ids of all interfaces,
+        in the same shape as easyovs.ovsdb.get_interfaces().
+        """
+        with self.lock:
+            return dict((i['name'], ovsdb_map(i.get('external_ids')))
+                        for i in self.tables['Interface'].values())
+
+    def _iter_ports(self, br_row):
+        """
+        Yield the (port row, interface row) of a bridge row.
+        """
+        ports, intfs = self.tables['Port'], self.tables['Interface']
+        for p in ovsdb_set(br_row.get('ports', ['set', []])):
+            if p not in ports:
+                continue
+            for i in ovsdb_set(ports[p].get('interfaces', ['set', []])):
+                if i in intfs:
+                    yield ports[p], intfs[i]
+
+    def _build_bridges(self):
+        ctrls = self.tables['Controller']
+        brs = {}
+        for row in self.tables['Bridge'].values():
+            br = {'Controller': [], 'Port': {},
+                  'fail_mode': ovsdb_str(row.get('fail_mode', ''))}
+            for c in ovsdb_set(row.get('controller', ['set', []])):
+                if c in ctrls:
+                    br['Controller'].append(ctrls[c].get('target'))
+            for port, intf in self._iter_ports(row):
+                br['Port'][port['name']] = {
+                    'vlan': ovsdb_str(port.get('tag', ['set', []])),
+                    'type': intf.get('type', ''),
+                    'intf': intf['name']}
+            brs[row['name']] = br
+        return brs
+
+    def _build_ports(self, bridge):
+        ports = {}
+        for row in self.tables['Bridge'].values():
+            if row.get('name') != bridge:
+                continue
+            for port, intf in self._iter_ports(row):
+                ofport = ovsdb_str(intf.get('ofport', ['set', []]))
+                if ofport == str(OFPP_LOCAL):
+                    ofport = 'LOCAL'
+                ports[intf['name']] = {
+                    'port': ofport,
+                    'addr': ovsdb_str(intf.get('mac_in_use', ['set', []])),
+                    'vlan': ovsdb_str(port.get('tag', ['set', []])),
+                    'type': intf.get('type', ''),
+                    'external_ids': ovsdb_map(intf.get('external_ids'))}
+        return ports
+
+
+class PortIndex(object):
+    """
+    Indexes of the interfaces on all bridges by name, neutron port id
+    prefix, mac and ofport, so each lookup is a dict get instead of a scan
+    of all ports.
+    >>> index = PortIndex({'br-int': {
+    ...     'qvoa4111776-bd': {'port': '2', 'addr': 'FA:16:3E:00:00:01'},
+    ...     'tap1': {'port': '3', 'external_ids': {
+    ...         'iface-id': 'b5222887-ce12', 'attached-mac': 'fa:16:3e:2'}}}})
+    >>> index.find_id('a4111776-bd'), index.find_id('b5222887-ce')
+    (('br-int', 'qvoa4111776-bd'), ('br-int', 'tap1'))
+    >>> index.find_mac('fa:16:3e:00:00:01'), index.find_ofport('br-int', 3)
+    (('br-int', 'qvoa4111776-bd'), 'tap1')
+    >>> index.has_port('br-int', 'tap1'), index.has_port('br-ex', 'tap1')
+    (True, False)
+    >>> index.ports_start_with('br-int', 'qvo')
+    ['qvoa4111776-bd']
+    """
+
+    def __init__(self, bridges):
+        """
+        :param bridges: dict of bridge name --> dict of the ports, like
+            Inventory.get_ports(), only the names are required
+        """
+        self.bridges = {}  # interface name --> bridge
+        self.ids = {}  # port id prefix --> (bridge, interface)
+        self.macs = {}  # mac --> (bridge, interface)
+        self.ofports = {}  # (bridge, ofport) --> interface
+        self.names = {}  # bridge --> sorted interface names
+        for bridge, ports in bridges.items():
+            for intf, info in ports.items():
+                entry = (bridge, intf)
+                self.bridges[intf] = bridge
+                ids = info.get('external_ids') or {}
+                for port_id in (intf[-PORT_ID_LEN:],
+                                ids.get('iface-id', '')[:PORT_ID_LEN]):
+                    if len(port_id) == PORT_ID_LEN:
+                        self.ids.setdefault(port_id, entry)
+                for mac in (info.get('addr'), ids.get('attached-mac')):
+                    if mac:
+                        self.macs.setdefault(mac.lower(), entry)
+                if info.get('port'):
+                    self.ofports[(bridge, info['port'])] = intf
+            self.names[bridge] = sorted(ports)
+
+    def find_id(self, port_id):
+        """
+        Return the (bridge, interface) of a neutron port id, or None.
+        :param port_id: the id prefix, e.g., a4111776-bd
+        """
+        if len(port_id) == PORT_ID_LEN:
+            return self.ids.get(port_id)
+        for intf, bridge in self.bridges.items():  # not a prefix, scan
+            if intf.endswith(port_id):
+                return bridge, intf
+        return None
+
+    def find_mac(self, mac):
+        """
+        Return the (bridge, interface) with the mac, or None.
+        """
+        return self.macs.get(mac.lower())
+
+    def find_ofport(self, bridge, ofport):
+        """
+        Return the interface of the ofport on the bridge, or None.
+        """
+        return self.ofports.get((bridge, str(ofport)))
+
+    def has_port(self, bridge, name):
+        return self.bridges.get(name) == bridge
+
+    def ports_start_with(self, bridge, prefix):
+        """
+        Return the sorted interface names on the bridge with the prefix.
+        """
+        names = self.names.get(bridge, [])
+        result = []
+        for name in names[bisect_left(names, prefix):]:
+            if not name.startswith(prefix):
+                break
+            result.append(name)
+        return result
+
+
+def start_inventory():
+    """
+    Start the global live inventory, if the ovsdb-server is reachable.
+    :return: the Inventory or None
+    """
+    global _inventory
+    if _inventory and _inventory.alive:
+        return _inventory
+    inv = Inventory()
+    if inv.start():
+        _inventory = inv
+    return get_inventory()
+
+
+def get_inventory():
+    """
+    Return the running global inventory, or None.
+    """
+    if _inventory and _inventory.alive:
+        return _inventory
+    return None
@@ -1,25 +1,31 @@
 __author__ = 'baohua'
 
-from subprocess import PIPE, Popen
 from easyovs.bridge_ctrl import find_br_ports
+from easyovs.iptables_save import VALID_TABLES, iptables_save, match_rule, \
+    parse_rule, query_key, rule_key, split_tables
+from easyovs.iptables_trace import IPTracer, rule_str, saved_tables
 from easyovs.log import debug, error, output, warn
-from easyovs.util import b, r
-from easyovs.neutron import get_port_id_from_ip
+from easyovs.util import b, color_str, get_port_index, r
 from easyovs.namespaces import NameSpaces
+from easyovs.neutron import get_port_ids_from_ips
+from easyovs.render import Renderer
 
 
 # pkts in source out destination prot target other
 _format_str_iptables_rule_ = ' %-10s%-16s%-16s%-16s%-20s%-6s%-30s%-20s\n'
 
+# fields to index the rules of a chain by, the most specific first
+INDEX_FIELDS = (('in', 'out', 'source', 'destination', 'prot', 'target'),
+                ('target', 'destination'), ('target', 'source'))
+
 class IPrule(object):
     """
     represent one rule
-    INPUT: rule line splits
+    INPUT: rule line of iptables-save
     """
-    def __init__(self, fields, rule=None):
-        self.fields = fields  # rule keys + flags
-        self.len = len(fields)
+    def __init__(self, rule=None, num=0):
         self.content = {}  # {num:1, 'target': SNAT, ...}
+        self.num = num  # position in the chain, from 1
         if rule:
             self.load(rule)
 
@@ -29,35 +35,34 @@ class IPrule(object):
         """
         if not rule:
             return False
-        rule_fmt = ' '.join(rule.split())
-        segs = rule_fmt.split(' ', self.len - 1)  # have flags or not
-        for i in range(len(segs)):
-            self.content[self.fields[i]] = segs[i]
-        if 'flags' not in self.content:
-            self.content['flags'] = ''
-        r = self.content
-        if r['source'] == '0.0.0.0/0':
-            r['source'] = '*'
-        if r['destination'] == '0.0.0.0/0':
-            r['destination'] = '*'
-        if r['prot'] == 'all':
-            r['prot'] = '*'
+        self.content = parse_rule(rule, self.num)
         return True
 
-    def show(self):
+    def row(self):
+        """
+        Return the fields of the rule in the columns of the table.
+        """
         r = self.content
-        output(_format_str_iptables_rule_
-               % (r['pkts'], r['in'], r['source'], r['out'],
-                  r['destination'], r['prot'], r['target'], r['flags']))
+        return (r['pkts'], r['in'], r['source'], r['out'],
+                r['destination'], r['prot'], r['target'], r['flags'])
+
+    def show(self):
+        output(_format_str_iptables_rule_ % self.row())
+
+    def to_dict(self):
+        """
+        Return the fields of the rule as a dict, for the json output.
+        """
+        return dict((k, v) for k, v in self.content.items()
+                    if k != 'matches')
 
     def is_match(self, rule_dic):
         """
-        Compare the dict on each field
+        Compare the dict on each field, the addresses, ports and states
+        are compared by value, e.g., {'destination': '10.0.0.0/24',
+        'dport': '80', 'ctstate': '!DNAT'}
         """
-        for k in rule_dic:
-            if k not in self.fields or rule_dic[k] != self.content[k]:
-                return False
-        return True
+        return match_rule(self.content, rule_dic)
 
     def get_content(self):
         return self.content
@@ -65,27 +70,37 @@ class IPrule(object):
     def get_flags(self):
         return self.content.get('flags', '')
 
+    def get_option(self, name):
+        """
+        Get the text of an option, e.g., 10.0.0.3 of to-destination
+        """
+        return self.content.get('options', {}).get(name)
+
 class IPchain(object):
     """
     represent one chain
     """
-    def __init__(self, name='INPUT', policy='ACCEPT'):
+    def __init__(self, name='INPUT', policy='ACCEPT', rules=None):
         self.name = name
         self.rules = []  # list of rule objects
-        self.keys = []
-        self.policy = policy
-        #  num pkts bytes target prot opt in out source destination flags
+        self.indexes = {}  # fields --> {values: rules}, built when queried
+        # user defined chains have no policy, take them as ACCEPT
+        self.builtin = policy != '-'
+        self.policy = policy if self.builtin else 'ACCEPT'
+        if rules:
+            self.add_rules(rules)
 
     def add_rules(self, rules):
         '''
         Add list of rules into this chain
-        :param rules:
+        :param rules: rule lines of iptables-save
         :return:
         '''
         for r in rules:
-            ipr = IPrule(self.keys)
+            ipr = IPrule(num=len(self.rules) + 1)
             if ipr.load(r):
                 self.rules.append(ipr)
+        self.indexes = {}
 
     def get_policy(self):
         '''
@@ -104,32 +119,61 @@ class IPchain(object):
     def set_policy(self, policy):
         self.policy = policy
 
-    def set_keys(self, keys):
-        self.keys = keys
-
-    def show(self):
+    def show(self, table=None, ns=None):
         '''
         Print all rules in this chain
+        :param table: name of the table, for the json output
+        :param ns: the namespace, for the json output
         :return:
         '''
-        output(b("chain=%s, policy=%s\n" % (self.name, self.policy)))
-        if len(self.rules) > 0:
-            output(b( _format_str_iptables_rule_ % (
-                'PKTS', 'IN', 'SOURCE', 'OUT', 'DESTINATION', 'PROT',
-                'TARGET', 'OTHER')))
+        with Renderer() as out:
             for r in self.rules:
-                r.show()
-        else:
-            output('--- Empty ---\n')
+                out.record('iptables_rule', ns=ns, table=table,
+                           **r.to_dict())
+            out.write("chain=%s, policy=%s\n" % (self.name, self.policy),
+                      'b')
+            if len(self.rules) > 0:
+                out.write(_format_str_iptables_rule_ % (
+                    'PKTS', 'IN', 'SOURCE', 'OUT', 'DESTINATION', 'PROT',
+                    'TARGET', 'OTHER'), 'b')
+                out.write_rows(_format_str_iptables_rule_,
+                               [r.row() for r in self.rules])
+            else:
+                out.write('--- Empty ---\n')
+
+    def _get_index(self, fields):
+        """
+        Get the index of the rules by the values of the fields, it is built
+        at the first query.
+        """
+        index = self.indexes.get(fields)
+        if index is None:
+            index = self.indexes[fields] = {}
+            for r in self.rules:
+                index.setdefault(rule_key(r.content, fields), []).append(r)
+        return index
+
+    def get_rule(self, rule_dic):
+        """
+        Find the first rule on the chain that has the key:value, by the
+        index of the most specific fields given in the dict.
+        """
+        rules = self.rules
+        for fields in INDEX_FIELDS:
+            key = query_key(rule_dic, fields)
+            if key is not None:
+                rules = self._get_index(fields).get(key, [])
+                break
+        for r in rules:
+            if r.is_match(rule_dic):
+                return r
+        return None
 
     def has_rule(self, rule_dic):
         """
         Check if some rule exists on the chain
         """
-        for r in self.rules:
-            if r.is_match(rule_dic):
-                return True
-        return False
+        return self.get_rule(rule_dic) is not None
 
     def get_rule_num(self):
         return len(self.rules)
@@ -137,49 +181,55 @@ class IPchain(object):
 
 class IPtable(object):
     """
-    represent one table
+    represent one table, the chains are only parsed when accessed
     """
-    def __init__(self, name='filter', ns=None):
+    def __init__(self, name='filter', ns=None, saved=None):
+        """
+        :param name: name of the table
+        :param ns: the namespace, None for root
+        :param saved: (list of (chain, policy), dict of chain --> rule
+            lines) from split_tables(), loaded from the system if None
+        """
         self.name = name
-        self.chains = {}
-        self.run_cmd = 'iptables --line-numbers -nvL -t %s' % self.name
         self.ns = ns
-        self.load(ns=self.ns)
+        self.policies = []  # list of (chain, policy) in order
+        self.lines = {}  # chain name --> rule lines not parsed yet
+        self.chains = {}  # chain name --> IPchain parsed, None if missing
+        self.policy_of = None  # chain name --> policy
+        self.upper_names = None  # upper case name --> chain name
+        if saved is None:
+            self.load(ns=self.ns)
+        else:
+            self.policies, self.lines = saved
 
-    def load(self, chain=None, ns=None):
+    def load(self, ns=None):
         '''
         Load chains of this table from the system
-        :param chain: which chain to load, None for all
         :param ns: which ns to load, None for root
         :return:
         '''
-        if chain:
-            run_cmd = self.run_cmd + ' ' + chain
-        else:
-            run_cmd = self.run_cmd
-        if ns:
-            run_cmd = 'ip netns exec %s %s' % (ns, run_cmd)
-        rules, err = Popen(run_cmd, stdout=PIPE, stderr=PIPE,
-                           shell=True).communicate()
-        if err:
-            error("Failed to run %s, err=%s\n" % (run_cmd, err))
+        text = iptables_save(ns)
+        if text is None:
             return
+        self.policies, self.lines = \
+            split_tables(text).get(self.name, ([], {}))
         self.chains, self.ns = {}, ns  # cleaning exiting rules
-        chains = rules.split('\n\n')
-        for chain in chains:  # some chain
-            r = chain.splitlines()  # lines of rule
-            #if not r:
-            #    continue
-            title = r[0].split()  # r[0] is the title row
-            if title[0] == 'Chain' and title[1] not in self.chains:  # title
-                if 'DROP' in title:
-                    self.chains[title[1]] = IPchain(title[1], 'DROP')
-                else:
-                    self.chains[title[1]] = IPchain(title[1])
-            keys = r[1].split()
-            keys.append('flags')
-            self.chains[title[1]].set_keys(keys)
-            self.chains[title[1]].add_rules(r[2:])  # those are real rules
+        self.policy_of, self.upper_names = None, None
+
+    def get_chain_names(self):
+        """
+        Return the names of the chains in order of iptables-save.
+        """
+        return [c for c, _ in self.policies]
+
+    def _chain_name(self, chain):
+        """
+        Return the name of the chain given in any case, or None.
+        """
+        if self.upper_names is None:
+            self.upper_names = dict((cn.upper(), cn)
+                                    for cn in self.get_chain_names())
+        return self.upper_names.get(chain.upper())
 
     def show(self, chain=None):
         '''
@@ -192,26 +242,34 @@ class IPtable(object):
                                                           self.name)))
         else:
             output(b("===table=%s===\n" % self.name))
-        for cn in self.chains:
+        for cn in self.get_chain_names():
             if not chain or cn.upper() == chain.upper():
-                self.chains[cn].show()
+                self.get_chain(cn).show(self.name, self.ns)
 
     def get_chain(self, chain='INPUT'):
         '''
-        Get some chain handler of this table instance.
+        Get some chain handler of this table instance, the chain is parsed
+        at the first time.
         :param chain:
         :return: the chain instance, None if failed
         '''
-        return self.chains.get(chain, None)
+        if chain in self.chains:
+            return self.chains[chain]
+        if self.policy_of is None:
+            self.policy_of = dict(self.policies)
+        c = None
+        if chain in self.policy_of:
+            c = IPchain(chain, self.policy_of[chain],
+                        self.lines.pop(chain, None))
+        self.chains[chain] = c
+        return c
 
     def get_rule(self, chain, rule_dic):
         """
         Find a rule on the chain that has the key:value
         """
-        for rule in self.get_rules(chain):
-            if rule.is_match(rule_dic):
-                return rule
-        return None
+        cn = self._chain_name(chain)
+        return self.get_chain(cn).get_rule(rule_dic) if cn else None
 
     def get_rules(self, chain=None):
         '''
@@ -222,12 +280,10 @@ class IPtable(object):
         :return:
         '''
         if not chain:
-            return self.chains
-        else:
-            for cn in self.chains:
-                if cn.upper() == chain.upper():
-                    return self.chains[cn].get_rules()
-        return []
+            return dict((cn, self.get_chain(cn))
+                        for cn in self.get_chain_names())
+        cn = self._chain_name(chain)
+        return self.get_chain(cn).get_rules() if cn else []
 
     def has_rule_in_chain(self, chain, rule_dic):
         """
@@ -240,75 +296,172 @@ class IPtable(object):
             return c.has_rule(rule_dic)
 
 
+def load_tables(ns=None):
+    """
+    Load all tables of a namespace by one run of iptables-save.
+    :param ns: the namespace, None for root
+    :return: dict of table name --> IPtable
+    """
+    text = iptables_save(ns)
+    saved = split_tables(text) if text else {}
+    return dict((t, IPtable(t, ns, saved.get(t, ([], {}))))
+                for t in VALID_TABLES)
+
+
 class IPtables(object):
     """
     represent a iptables object, which can handle the table rules
+    The tables of each namespace are loaded at the first access, and
+    reused by the later queries.
     """
     def __init__(self, ns=None):
-        self.valid_tables = ['raw', 'nat', 'filter', 'mangle', 'security']
-        self.tables = {}
+        self.valid_tables = VALID_TABLES
+        self.loaded = {}  # namespace --> dict of table name --> IPtable
         self.nss = NameSpaces()
         self.ns = ns
-        for tb in self.valid_tables:
-            self.tables[tb] = IPtable(tb, ns)
-        self._load(ns=self.ns)
 
     def get_valid_tables(self):
         return self.valid_tables
 
-    def _load(self, table=None, chain=None, ns=None):
+    def get_tables(self, ns=None):
+        """
+        Return the tables of the namespace, loaded at the first time.
+        :param ns: which ns, None for the default one
+        :return: dict of table name --> IPtable
+        """
+        ns = ns or self.ns
+        if ns not in self.loaded:
+            self.loaded[ns] = load_tables(ns)
+        return self.loaded[ns]
+
+    def _load(self, ns=None):
         '''
-        Load the rules from system.
-        If given table name, then only load that table.
-        :param table: which table to load, None for all
-        :param chain: which chain to load, None for all
-        :param ns: which ns to load, None for root
+        Reload the rules of the namespace from system.
+        :param ns: which ns to load, None for the default one
         :return:
         '''
-        _ns = ns or self.ns
-        if table in self.valid_tables:
-            self.tables[table].load(chain, _ns)
-        else:
-            for tb in self.valid_tables:
-                self.tables[tb].load(chain, _ns)
+        self.loaded.pop(ns or self.ns, None)
+        return self.get_tables(ns)
+
+    @property
+    def tables(self):
+        return self.get_tables()
 
     def show(self, table='filter', chain=None, ns=None):
         '''
         Show the content.
         :param table: which table to show, None for all
         :param chain: which chain to show, None for all.
+        :param ns: which ns to show, None for the default one
         :return:
         '''
         debug("Show table=%s, chain=%s, ns=%s\n" % (table, chain, ns))
-        #self._load(table, chain, ns)
         if table in self.valid_tables:
-            self.tables[table].show(chain)
+            self.get_tables(ns)[table].show(chain)
 
-    def vm(self, ip):
+    def get_trace_tables(self, ns=None):
+        """
+        Return the loaded rules of all tables, to trace by IPTracer.
+        :param ns: which ns, None for the default one
+        :return: dict of table --> {chain: (policy, list of parsed rules)}
+        """
+        tables = {}
+        for name, tb in self.get_tables(ns).items():
+            chains = tables[name] = {}
+            for cn in tb.get_chain_names():
+                c = tb.get_chain(cn)
+                chains[cn] = (c.policy if c.builtin else None,
+                              [rule.get_content() for rule in c.get_rules()])
+        return tables
+
+    def trace(self, packets, ns=None, path=None):
         '''
-        list vm related rules
-        :param ip: vm ip
+        Trace packets through the rules offline, the path is shown for a
+        single packet, otherwise only the verdict of each one.
+        :param packets: list of the packet fields, e.g.,
+            ['tcp src=10.0.0.5 dst=10.0.0.3 dport=22']
+        :param ns: which ns, None for the default one
+        :param path: path of a saved iptables-save output to trace instead
         :return:
         '''
-        debug("Try to show vm rules, ip=%s\n" % ip)
-        port_id = get_port_id_from_ip(ip)
-        debug('The port id is %s\n' % port_id)
-        if not port_id:
-            warn('No port id is found for ip=%s\n' % ip)
-            return
-        br_port = find_br_ports(port_id)
-        if not br_port:
-            warn('No br port is found for ip=%s\n' % ip)
+        if path:
+            try:
+                with open(path) as f:
+                    tables = saved_tables(f.read())
+            except IOError as e:
+                error('Cannot read %s: %s\n' % (path, e))
+                return
+        else:
+            tables = self.get_trace_tables(ns)
+        if not any(tables.values()):
+            source = path or ('ns=%s' % ns if ns else 'the system')
+            error('No iptables rule is loaded from %s\n' % source)
             return
-        output(r('## IP = %s, port = %s\n' % (ip, br_port)))
-        rules_dic = self._query_port_rules(br_port)
-        if rules_dic:
-            output(b( _format_str_iptables_rule_ % (
-                'PKTS', 'IN', 'SOURCE', 'OUT', 'DESTINATION', 'PROT',
-                'TARGET', 'OTHER')))
-            for rule in rules_dic:
-                output(b('%s:\n' % rule))
-                self._fmt_show_rules(rules_dic[rule])
+        tracer = IPTracer(tables)
+        for spec in packets:
+            try:
+                result = tracer.trace(spec)
+            except ValueError as e:
+                error('%s in %s\n' % (e, spec))
+                continue
+            if len(packets) > 1:
+                # some rules or targets were not simulated
+                output('%-60s %s%s\n' % (spec, result.verdict(),
+                                          ' (approx)' if result.notes
+                                          else ''))
+                continue
+            for depth, table, chain, rule in result.path:
+                if rule:
+                    output('%s%s %s #%s %s\n'
+                           % ('    ' * depth, table, chain, rule['num'],
+                              rule_str(rule)))
+                else:
+                    output('%s%s %s policy %s\n'
+                           % ('    ' * depth, table, chain,
+                              tables[table][chain][0]))
+            for note in result.notes:
+                warn('%s\n' % note)
+            output('Verdict: %s\n' % color_str(result.verdict(), 'b'))
+
+    def vm(self, ips):
+        '''
+        list vm related rules, the ips of the same port are shown together
+        :param ips: list of vm ips or networks, e.g., 10.0.0.0/24
+        :return:
+        '''
+        if isinstance(ips, str):
+            ips = [ips]
+        debug("Try to show vm rules, ips=%s\n" % ips)
+        index = get_port_index()
+        br_ports, port_ips, missed = [], {}, 0  # br port --> its ips
+        for ip, port_id in get_port_ids_from_ips(ips):
+            debug('The port id of %s is %s\n' % (ip, port_id))
+            br_port = find_br_ports(port_id, index) if port_id else None
+            if not port_id:
+                warn('No port id is found for ip=%s\n' % ip)
+            elif not br_port:
+                warn('No br port is found for ip=%s\n' % ip)
+            if br_port:
+                if br_port not in port_ips:  # keep the order of the ips
+                    br_ports.append(br_port)
+                    port_ips[br_port] = []
+                port_ips[br_port].append(ip)
+            else:
+                missed += 1
+        for br_port in br_ports:
+            ip = ', '.join(port_ips[br_port])
+            output(r('## IP = %s, port = %s\n' % (ip, br_port)))
+            rules_dic = self._query_port_rules(br_port)
+            if rules_dic:
+                output(b( _format_str_iptables_rule_ % (
+                    'PKTS', 'IN', 'SOURCE', 'OUT', 'DESTINATION', 'PROT',
+                    'TARGET', 'OTHER')))
+                for rule in rules_dic:
+                    output(b('%s:\n' % rule))
+                    self._fmt_show_rules(rules_dic[rule], ip, br_port, rule)
+        if len(br_ports) + missed > 1:
+            output('%u ports found, %u ips without port\n'
+                   % (len(br_ports), missed))
 
     def has_rule(self, table='filter', chain='INPUT', rule_dic=None, ns=None):
         """
@@ -319,28 +472,30 @@ class IPtables(object):
         :param ns:
         :return:
         """
-        t = self.get_table(table)
+        t = self.get_table(table, ns)
         if not t:
             return False
         else:
-            return t.has_rule(chain, rule_dic)
-        pass
+            return t.has_rule_in_chain(chain, rule_dic)
 
-    def get_table(self, table='filter'):
+    def get_table(self, table='filter', ns=None):
         '''
         Get some table handler of this ipt instance.
         :param table:
+        :param ns: which ns, None for the default one
         :return: the table instance, None if failed
         '''
-        return self.tables.get(table, None)
+        return self.get_tables(ns).get(table, None)
 
-    def get_chain(self, table='filter', chain='INPUT'):
+    def get_chain(self, table='filter', chain='INPUT', ns=None):
         '''
-        Get some table handler of this ipt instance.
+        Get some chain handler of this ipt instance.
         :param table:
-        :return: the table instance, None if failed
+        :param chain:
+        :param ns: which ns, None for the default one
+        :return: the chain instance, None if failed
         '''
-        tb = self.tables.get(table, None)
+        tb = self.get_table(table, ns)
         if tb:
             return tb.get_chain(chain)
 
@@ -349,11 +504,12 @@ class IPtables(object):
         Get the rule list of a given chain
         :param table:
         :param chain:
+        :param ns: which ns, None for the default one
         :return: [{},{}]
         '''
-        ch = self.get_chain(table, chain)
+        ch = self.get_chain(table, chain, ns)
         if ch:
-            return ch._get_rules()
+            return ch.get_rules()
         else:
             return None
 
@@ -368,7 +524,6 @@ class IPtables(object):
         results = {}
         if br_port.startswith('qvo'):  # vm port
             debug('qvo should be vm port\n')
-            #self._load(table='filter')
             chain_tag = br_port[3:13]
             i_rules = self._get_rules(chain='neutron-openvswi-i' +
                                            chain_tag)
@@ -389,18 +544,19 @@ class IPtables(object):
                 warn("port %s not in namespaces\n" % br_port)
             else:
                 output('ns=%s\n' % ns)
-            self._load(table='nat', ns=ns)
             if br_port.startswith('tap'):  # dhcp
                 return None
             elif br_port.startswith('qr-') or br_port.startswith('qg-'):
                 pre = self._get_rules(table='nat',
-                                     chain='neutron-l3-agent-PREROUTING')
+                                     chain='neutron-l3-agent-PREROUTING',
+                                     ns=ns)
                 out = self._get_rules(table='nat',
-                                     chain='neutron-l3-agent-OUTPUT')
+                                     chain='neutron-l3-agent-OUTPUT', ns=ns)
                 float_snat = self._get_rules(table='nat',
-                                       chain='neutron-l3-agent-float-snat')
+                                       chain='neutron-l3-agent-float-snat',
+                                       ns=ns)
                 snat = self._get_rules(table='nat',
-                                      chain='neutron-l3-agent-snat')
+                                      chain='neutron-l3-agent-snat', ns=ns)
                 if pre:
                     results['PRE'] = pre
                 if out:
@@ -411,13 +567,20 @@ class IPtables(object):
                     results['SNAT'] = snat
         return results
 
-    def _fmt_show_rules(self, rule_list):
+    def _fmt_show_rules(self, rule_list, ip=None, port=None, kind=None):
         """
         Possible columns:
         num   pkts bytes target prot opt in out source destination flags
+        :param ip: ip of the vm, for the json output
+        :param port: the port of the vm, for the json output
+        :param kind: kind of the rules, e.g., IN, for the json output
         """
-        for r in rule_list:
-            r.show()
+        with Renderer() as out:
+            for r in rule_list:
+                out.record('vm_rule', ip=ip, port=port, rule_kind=kind,
+                           **r.to_dict())
+            out.write_rows(_format_str_iptables_rule_,
+                           [r.row() for r in rule_list])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,371 @@
+__author__ = 'baohua'
+
+import shlex
+import socket
+import struct
+from subprocess import PIPE, Popen
+
+from easyovs.log import error
+
+IPTABLES_SAVE = 'iptables-save -c'
+
+# the tables of iptables, in the order to show
+VALID_TABLES = ['raw', 'nat', 'filter', 'mangle', 'security']
+
+# options of a rule --> the field in the rule content
+RULE_OPTIONS = {'-s': 'source', '--source': 'source',
+                '-d': 'destination', '--destination': 'destination',
+                '-i': 'in', '--in-interface': 'in',
+                '-o': 'out', '--out-interface': 'out',
+                '-p': 'prot', '--protocol': 'prot'}
+TARGET_OPTIONS = ('-j', '--jump', '-g', '--goto')
+MATCH_OPTIONS = ('-m', '--match')
+ANY_ADDR = '0.0.0.0/0'
+
+# fields of a parsed rule, the other names are of the options
+FIELDS = ('num', 'pkts', 'bytes', 'chain', 'in', 'out', 'source',
+          'destination', 'prot', 'opt', 'target', 'goto', 'flags',
+          'modules', 'options')
+
+
+def iptables_save(ns=None):
+    """
+    Run iptables-save once for all tables.
+    :param ns: the namespace to run in, None for root
+    :return: the output text, or None if failed
+    """
+    cmd = IPTABLES_SAVE
+    if ns:
+        cmd = 'ip netns exec %s %s' % (ns, cmd)
+    p = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True)
+    result, err = p.communicate()
+    if p.returncode != 0:
+        error("Failed to run %s, err=%s\n" % (cmd, err.decode()))
+        return None
+    return result.decode()
+
+
+def split_tables(text):
+    """
+    Split the output of iptables-save into the tables, the rules are only
+    grouped by their chains but not parsed.
+    :param text: the output of iptables-save
+    :return: dict of table name --> (list of (chain, policy), dict of
+        chain --> list of rule lines)
+    >>> tables = split_tables('''*nat
+    ... :PREROUTING ACCEPT [2:120]
+    ... :neutron-l3-agent-snat - [0:0]
+    ... [2:120] -A PREROUTING -j neutron-l3-agent-snat
+    ... COMMIT
+    ... ''')
+    >>> tables['nat'][0]
+    [('PREROUTING', 'ACCEPT'), ('neutron-l3-agent-snat', '-')]
+    >>> tables['nat'][1]
+    {'PREROUTING': ['[2:120] -A PREROUTING -j neutron-l3-agent-snat']}
+    """
+    tables, chains, lines = {}, [], {}
+    for l in text.splitlines():
+        l = l.strip()
+        if not l or l[0] == '#':
+            continue
+        if l[0] == '*':
+            chains, lines = [], {}
+            tables[l[1:]] = (chains, lines)
+        elif l[0] == ':':
+            fields = l[1:].split()
+            chains.append((fields[0], fields[1] if len(fields) > 1 else '-'))
+        elif l[0] == '[' or l.startswith('-A'):
+            fields = l.split(None, 3 if l[0] == '[' else 2)
+            chain = fields[2] if l[0] == '[' else fields[1]
+            lines.setdefault(chain, []).append(l)
+    return tables
+
+
+def split_rule(line):
+    """
+    Split a rule line into the tokens, the quoted ones are kept as one.
+    >>> split_rule('-A INPUT -m comment --comment "from vm" -j ACCEPT')
+    ['-A', 'INPUT', '-m', 'comment', '--comment', 'from vm', '-j', 'ACCEPT']
+    """
+    if '"' in line or "'" in line:
+        return shlex.split(line)
+    return line.split()
+
+
+def _ip_int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+def ip_range(addr):
+    """
+    Return the range of integers covered by an address, a CIDR or an
+    address range.
+    >>> ip_range('10.0.0.0/30')
+    (167772160, 167772163)
+    >>> ip_range('10.0.0.1') == ip_range('10.0.0.1/255.255.255.255')
+    True
+    >>> ip_range('10.0.0.1-10.0.0.5')
+    (167772161, 167772165)
+    """
+    if '-' in addr:
+        lo, _, hi = addr.partition('-')
+        return _ip_int(lo), _ip_int(hi)
+    ip, _, mask = addr.partition('/')
+    if not mask:
+        bits = 32
+    elif '.' in mask:
+        bits = bin(_ip_int(mask)).count('1')
+    else:
+        bits = int(mask)
+    if not 0 <= bits <= 32:
+        raise ValueError('invalid prefix length %s' % mask)
+    host = (1 << (32 - bits)) - 1
+    n = _ip_int(ip)
+    return n & ~host & 0xffffffff, n | host
+
+
+def port_range(ports):
+    """
+    Return the range of ports, e.g., (80, 80) for 80, and (1000, 2000) for
+    1000:2000 or 1000-2000.
+    """
+    lo, _, hi = ports.replace('-', ':').partition(':')
+    return int(lo), int(hi or lo)
+
+
+def port_list(ports):
+    """
+    Return the ranges of the ports of multiport.
+    >>> port_list('22,80:90')
+    ((22, 22), (80, 90))
+    """
+    return tuple(port_range(p) for p in ports.split(','))
+
+
+def nat_range(to):
+    """
+    Return the range of addresses and the range of ports, None if not given,
+    of a NAT target.
+    >>> nat_range('10.0.0.3')
+    ((167772163, 167772163), None)
+    >>> nat_range('10.0.0.3:8080')
+    ((167772163, 167772163), (8080, 8080))
+    """
+    addr, _, ports = to.partition(':')
+    return ip_range(addr), port_range(ports) if ports else None
+
+
+def name_set(names):
+    """
+    Return the set of the names separated by comma, e.g., of ctstate.
+    """
+    return frozenset(names.split(','))
+
+
+def match_set(args):
+    """
+    Return the set name and the directions of set match.
+    >>> match_set('allowed src,dst')
+    ('allowed', ('src', 'dst'))
+    """
+    name, _, flags = args.partition(' ')
+    return name, tuple(flags.split(','))
+
+
+# options whose values are compared by their types instead of the text
+OPTION_TYPES = {'source': ip_range, 'destination': ip_range,
+                'src-range': ip_range, 'dst-range': ip_range,
+                'sport': port_range, 'dport': port_range,
+                'to-ports': port_range, 'sports': port_list,
+                'dports': port_list, 'ports': port_list,
+                'to-destination': nat_range, 'to-source': nat_range,
+                'ctstate': name_set, 'state': name_set,
+                'match-set': match_set}
+
+
+def parse_value(name, text):
+    """
+    Parse the value of an option into its type, the text is kept if the
+    type is unknown or fails to parse.
+    :param name: name of the option, e.g., dport
+    :param text: the value, with a leading ! if negated
+    :return: (negated, value)
+    >>> parse_value('dport', '!80')
+    (True, (80, 80))
+    >>> parse_value('comment', 'from vm')
+    (False, 'from vm')
+    """
+    neg = text.startswith('!')
+    if neg:
+        text = text[1:]
+    conv = OPTION_TYPES.get(name)
+    if conv:
+        try:
+            return neg, conv(text)
+        except (ValueError, socket.error):
+            pass
+    return neg, text
+
+
+def _short_addr(addr):
+    """
+    Return the address as iptables -nvL shows it, e.g., 10.0.0.1 for
+    10.0.0.1/32 and * for 0.0.0.0/0.
+    """
+    if addr.endswith('/32'):
+        return addr[:-3]
+    if addr == '0.0.0.0/0':
+        return '*'
+    return addr
+
+
+def parse_rule(line, num=0):
+    """
+    Parse a rule line of iptables-save into a dict of the fields, the
+    matches and options not in the fields are kept in flags as the text,
+    in options by name as the text and in matches by name as the typed
+    values from parse_value().
+    :param line: e.g., [5:300] -A INPUT -s 10.0.0.0/24 -p tcp -j ACCEPT
+    :param num: position of the rule in the chain, from 1
+    :return: dict of FIELDS and matches
+    >>> r = parse_rule('[5:300] -A POSTROUTING ! -i rfp-1 ! -o rfp-1 '
+    ...                '-m conntrack ! --ctstate DNAT -j ACCEPT')
+    >>> r['pkts'], r['chain'], r['in'], r['out'], r['target']
+    ('5', 'POSTROUTING', '!rfp-1', '!rfp-1', 'ACCEPT')
+    >>> r['flags']
+    '-m conntrack ! --ctstate DNAT'
+    >>> r['modules'], r['options'], r['matches']['ctstate']
+    (['conntrack'], {'ctstate': '!DNAT'}, (True, frozenset({'DNAT'})))
+    >>> r = parse_rule('-A PREROUTING -d 172.24.4.3/32 -j DNAT '
+    ...                '--to-destination 10.0.0.3')
+    >>> r['destination'], r['source'], r['prot'], r['flags']
+    ('172.24.4.3', '*', '*', '--to-destination 10.0.0.3')
+    >>> sorted(r['matches'])
+    ['destination', 'to-destination']
+    """
+    tokens = split_rule(line)
+    r = {'num': str(num), 'pkts': '0', 'bytes': '0', 'chain': '',
+         'in': '*', 'out': '*', 'source': '*', 'destination': '*',
+         'prot': '*', 'opt': '--', 'target': '', 'goto': False, 'flags': ''}
+    i, n = 0, len(tokens)
+    if n and tokens[0][0] == '[':
+        r['pkts'], _, r['bytes'] = tokens[0][1:-1].partition(':')
+        i = 1
+    flags, modules, options, matches = [], [], {}, {}
+    while i < n:
+        t = tokens[i]
+        neg = ''
+        if t == '!' and i + 1 < n:
+            neg, i = '!', i + 1
+            t = tokens[i]
+        if t.startswith('--') and t not in RULE_OPTIONS and \
+                t not in TARGET_OPTIONS and t not in MATCH_OPTIONS:
+            j = i + 1
+            while j < n and tokens[j] != '!' and tokens[j][:1] != '-':
+                j += 1
+            name, args = t[2:], tokens[i + 1:j]
+            options[name] = neg + ' '.join(args)
+            matches[name] = parse_value(name, options[name])
+            flags.extend(([neg] if neg else []) + [t] +
+                         ['"%s"' % a if ' ' in a else a for a in args])
+            i = j
+            continue
+        if i + 1 >= n:
+            flags.extend(([neg] if neg else []) + [t])
+            break
+        value = tokens[i + 1]
+        if t in RULE_OPTIONS:
+            field = RULE_OPTIONS[t]
+            if field in ('source', 'destination'):
+                if neg or value != ANY_ADDR:
+                    matches[field] = parse_value(field, neg + value)
+                value = _short_addr(value)
+            elif field == 'prot' and value == 'all':
+                value = '*'
+            r[field] = neg + value
+        elif t in TARGET_OPTIONS:
+            r['target'], r['goto'] = value, t in ('-g', '--goto')
+        elif t in ('-A', '--append'):
+            r['chain'] = value
+        elif t in MATCH_OPTIONS:
+            modules.append(value)
+            flags.extend([t, value])
+        else:
+            flags.extend(([neg] if neg else []) + [t])
+            i += 1
+            continue
+        i += 2
+    r['flags'] = ' '.join(flags)
+    r['modules'], r['options'], r['matches'] = modules, options, matches
+    return r
+
+
+def rule_value(rule, name):
+    """
+    Return the value of a field or option of a parsed rule, typed for the
+    options, and None if the option is not given.
+    """
+    if name in OPTION_TYPES or name not in FIELDS:
+        return rule['matches'].get(name)
+    return rule[name]
+
+
+def query_value(name, text):
+    """
+    Return the value of a field or option in a query, to compare with
+    rule_value(), * means the option is not given.
+    >>> query_value('target', 'SNAT'), query_value('source', '*')
+    ('SNAT', None)
+    >>> query_value('to-source', '10.0.0.3')
+    (False, ((167772163, 167772163), None))
+    """
+    if name in OPTION_TYPES or name not in FIELDS:
+        if text == '*' or text == ANY_ADDR and name in RULE_OPTIONS.values():
+            return None
+        return parse_value(name, text)
+    return text
+
+
+def rule_key(rule, fields):
+    """
+    Return the values of the fields of a parsed rule, to index the rules.
+    >>> r = parse_rule('-A snat -s 10.0.0.3/32 -j SNAT')
+    >>> q = query_key({'source': '10.0.0.3', 'target': 'SNAT'},
+    ...               ('target', 'source'))
+    >>> rule_key(r, ('target', 'source')) == q
+    True
+    """
+    return tuple(rule_value(rule, f) for f in fields)
+
+
+def query_key(query, fields):
+    """
+    Return the values of the fields of a query as rule_key() does, None if
+    the query does not have all the fields.
+    """
+    for f in fields:
+        if f not in query:
+            return None
+    return tuple(query_value(f, query[f]) for f in fields)
+
+
+def match_rule(rule, query):
+    """
+    Return True if the rule has all the fields in the query. The options of
+    known types are compared by the values instead of the text, and * means
+    the option is not given.
+    :param rule: dict from parse_rule()
+    :param query: dict of field or option name --> text, with a leading !
+        if negated
+    >>> r = parse_rule('-A snat -s 10.0.0.3/32 -p tcp -m tcp --dport 80 '
+    ...                '-j SNAT --to-source 172.24.4.3')
+    >>> match_rule(r, {'source': '10.0.0.3', 'dport': '80', 'prot': 'tcp',
+    ...                'to-source': '172.24.4.3/32', 'destination': '*'})
+    True
+    >>> match_rule(r, {'target': 'SNAT', 'dport': '!80'})
+    False
+    """
+    for k, v in query.items():
+        if rule_value(rule, k) != query_value(k, v):
+            return False
+    return True
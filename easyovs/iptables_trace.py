@@ -0,0 +1,383 @@
+__author__ = 'baohua'
+
+import socket
+
+from easyovs.iptables_save import ip_range, parse_rule, split_tables
+
+MAX_JUMP_DEPTH = 64  # nested user chains followed before giving up
+
+# the built-in chains a packet goes through on each path
+HOOKS = {
+    'forward': ('PREROUTING', 'FORWARD', 'POSTROUTING'),
+    'input': ('PREROUTING', 'INPUT'),
+    'output': ('OUTPUT', 'POSTROUTING'),
+}
+BUILTIN_CHAINS = ('PREROUTING', 'INPUT', 'FORWARD', 'OUTPUT', 'POSTROUTING')
+
+# the tables of a built-in chain in the order of the kernel
+TABLE_ORDER = ('raw', 'mangle', 'nat', 'filter', 'security')
+
+PROTOCOLS = {'icmp': 1, 'igmp': 2, 'tcp': 6, 'udp': 17, 'gre': 47,
+             'esp': 50, 'ah': 51, 'icmpv6': 58, 'sctp': 132}
+
+# targets ending the packet, or the chains of the table for ACCEPT
+VERDICTS = ('ACCEPT', 'DROP', 'REJECT', 'QUEUE', 'NFQUEUE')
+NAT_TARGETS = ('DNAT', 'SNAT', 'MASQUERADE', 'REDIRECT', 'NETMAP')
+
+# options of the targets, which are not matches of the packet
+TARGET_ARGS = frozenset((
+    'to-destination', 'to-source', 'to-ports', 'to', 'reject-with',
+    'log-prefix', 'log-level', 'log-uid', 'log-ip-options',
+    'log-tcp-options', 'log-tcp-sequence', 'set-xmark', 'set-mark',
+    'and-mark', 'or-mark', 'xor-mark', 'save-mark', 'restore-mark', 'nfmask',
+    'ctmask', 'mask', 'zone', 'notrack', 'random', 'random-fully',
+    'persistent', 'queue-num', 'queue-bypass', 'queue-balance',
+    'checksum-fill', 'clamp-mss-to-pmtu', 'set-mss', 'set-dscp',
+    'set-dscp-class', 'nflog-group', 'nflog-prefix', 'nflog-range',
+    'nflog-threshold', 'comment'))
+
+
+def parse_packet(spec):
+    """
+    Return the packet as a dict from the given fields, e.g.,
+    tcp src=10.0.0.5 dst=10.0.0.3 dport=22 physdev-out=tap1 state=NEW
+    The other fields are sport, in, out, physdev-in, mac, mark and hook,
+    which is forward, input, output or a built-in chain.
+    The state is NEW and the path is forward if not given.
+    >>> p = parse_packet('udp,src=10.0.0.1,sport=68,in=qr-1')
+    >>> p['proto'], p['src'], p['sport'], p['in'], p['states'], p['hook']
+    (17, 167772161, 68, 'qr-1', {'NEW'}, 'forward')
+    """
+    packet = {'states': set(['NEW']), 'mark': 0, 'hook': 'forward'}
+    for item in spec.replace(',', ' ').split():
+        try:
+            _parse_field(packet, item)
+        except (KeyError, ValueError, socket.error):
+            raise ValueError('Invalid field %s' % item)
+    return packet
+
+
+def _parse_field(packet, item):
+    key, sep, value = item.partition('=')
+    if not sep:
+        key, value = 'proto', key
+    if key in ('proto', 'prot', 'p'):
+        packet['proto'] = int(value) if value.isdigit() \
+            else PROTOCOLS[value.lower()]
+    elif key in ('src', 'dst'):
+        packet[key] = ip_range(value)[0]
+    elif key in ('sport', 'dport'):
+        packet[key] = int(value)
+    elif key in ('in', 'out', 'physdev-in', 'physdev-out'):
+        packet[key] = value
+    elif key in ('mac', 'mac-source'):
+        packet['mac-source'] = value.upper()
+    elif key in ('state', 'ctstate'):
+        packet['states'] = set([value.upper()])
+    elif key == 'mark':
+        packet['mark'] = int(value, 0)
+    elif key == 'hook':
+        if value.lower() in HOOKS:
+            packet['hook'] = value.lower()
+        elif value.upper() in BUILTIN_CHAINS:
+            packet['hook'] = value.upper()
+        else:
+            raise ValueError('Unknown hook %s' % value)
+    else:
+        raise ValueError('Unknown field %s' % key)
+
+
+def _range_check(field, lo, hi, neg):
+    def check(packet):
+        v = packet.get(field)
+        return v is not None and (lo <= v <= hi) != neg
+    return check
+
+
+def _ranges_check(fields, ranges, neg):
+    def check(packet):
+        values = [packet[f] for f in fields if f in packet]
+        if not values:
+            return False
+        return any(lo <= v <= hi for v in values
+                   for lo, hi in ranges) != neg
+    return check
+
+
+def _iface_check(field, name):
+    """
+    Check the interface of the packet, a name ending with + matches all the
+    interfaces with the prefix, e.g., qr-+
+    """
+    neg = name.startswith('!')
+    name = name.lstrip('!')
+    if name.endswith('+'):
+        prefix = name[:-1]
+        return lambda packet: \
+            packet.get(field, '').startswith(prefix) != neg
+    return lambda packet: (packet.get(field, '') == name) != neg
+
+
+def _proto_check(prot):
+    neg = prot.startswith('!')
+    prot = prot.lstrip('!')
+    num = int(prot) if prot.isdigit() else PROTOCOLS.get(prot.lower())
+    if num is None:
+        return None
+    return lambda packet: (packet.get('proto') == num) != neg
+
+
+def _state_check(states, neg):
+    return lambda packet: bool(packet['states'] & states) != neg
+
+
+def _mark_check(mark, neg):
+    value, _, mask = mark.partition('/')
+    value, mask = int(value, 0), int(mask, 0) if mask else 0xffffffff
+    return lambda packet: (packet['mark'] & mask == value) != neg
+
+
+def compile_rule(rule):
+    """
+    Compile the matches of a parsed rule into one predicate of a packet,
+    checking each match by a closure with its values parsed already.
+    :param rule: dict from parse_rule()
+    :return: (predicate, list of the options not simulated)
+    >>> match, unknown = compile_rule(parse_rule(
+    ...     '-A FORWARD -d 10.0.0.0/24 -i qr-+ -p tcp -m tcp --dport 22 '
+    ...     '-m conntrack --ctstate NEW -j ACCEPT'))
+    >>> match(parse_packet('tcp dst=10.0.0.3 dport=22 in=qr-1')), unknown
+    (True, [])
+    >>> match(parse_packet('tcp dst=10.0.0.3 dport=22 in=qg-1'))
+    False
+    """
+    checks, unknown = [], []
+    for field in ('in', 'out'):
+        if rule[field] != '*':
+            checks.append(_iface_check(field, rule[field]))
+    if rule['prot'] != '*':
+        check = _proto_check(rule['prot'])
+        if check:
+            checks.append(check)
+        else:
+            unknown.append('protocol')
+    for name, (neg, value) in rule['matches'].items():
+        if name in TARGET_ARGS:
+            continue
+        check = None
+        if name in ('source', 'destination', 'src-range', 'dst-range'):
+            if isinstance(value, tuple):
+                check = _range_check('src' if name[0] == 's' else 'dst',
+                                     value[0], value[1], neg)
+        elif name in ('sport', 'dport'):
+            if isinstance(value, tuple):
+                check = _range_check(name, value[0], value[1], neg)
+        elif name in ('sports', 'dports', 'ports'):
+            if isinstance(value, tuple):
+                fields = {'sports': ('sport',), 'dports': ('dport',),
+                          'ports': ('sport', 'dport')}[name]
+                check = _ranges_check(fields, value, neg)
+        elif name in ('ctstate', 'state'):
+            check = _state_check(value, neg)
+        elif name in ('physdev-in', 'physdev-out'):
+            check = _iface_check(name, ('!' if neg else '') + value)
+        elif name == 'mac-source':
+            check = lambda packet, mac=value.upper(), neg=neg: \
+                (packet.get('mac-source') == mac) != neg
+        elif name == 'physdev-is-bridged':
+            check = lambda packet, neg=neg: \
+                bool(packet.get('physdev-in') or
+                     packet.get('physdev-out')) != neg
+        elif name == 'mark':
+            try:
+                check = _mark_check(value, neg)
+            except ValueError:
+                pass
+        if check:
+            checks.append(check)
+        else:
+            unknown.append(name)
+
+    def match(packet):
+        for check in checks:
+            if not check(packet):
+                return False
+        return True
+    return match, unknown
+
+
+def saved_tables(text):
+    """
+    Return the tables to trace from the output of iptables-save.
+    :return: dict of table --> {chain: (policy, list of parsed rules)},
+        with policy None for user defined chains
+    """
+    tables = {}
+    for table, (policies, lines) in split_tables(text).items():
+        chains = tables[table] = {}
+        for chain, policy in policies:
+            chains[chain] = (policy if policy != '-' else None,
+                             [parse_rule(l, i + 1) for i, l in
+                              enumerate(lines.get(chain, []))])
+    return tables
+
+
+def rule_str(rule):
+    """
+    Return a short text of the matches and the target of a rule.
+    >>> rule_str(parse_rule('-A INPUT -i qr-+ -p tcp -m tcp --dport 80 '
+    ...                     '-j ACCEPT'))
+    'in=qr-+ prot=tcp -m tcp --dport 80 -> ACCEPT'
+    """
+    fields = ['%s=%s' % (f, rule[f]) for f in
+              ('in', 'out', 'source', 'destination', 'prot')
+              if rule[f] != '*']
+    if rule['flags']:
+        fields.append(rule['flags'])
+    return '%s -> %s' % (' '.join(fields) or '*', rule['target'] or '-')
+
+
+class IPTraceResult(object):
+    """
+    The chains and rules a packet went through, and the final verdict.
+    """
+
+    def __init__(self, packet):
+        self.packet = packet
+        self.path = []  # list of (depth, table, chain, rule or None)
+        self.final = None  # the verdict dropping the packet, if any
+        self.notes = []
+
+    def verdict(self):
+        return self.final or 'ACCEPT'
+
+
+class IPTracer(object):
+    """
+    Run packets through the iptables rules offline: the built-in chains of
+    the path in the order of the tables, following jumps, gotos and
+    returns. The rules of a chain are compiled at the first visit and
+    reused for all the packets.
+    """
+
+    def __init__(self, tables):
+        """
+        :param tables: dict of table --> {chain: (policy, list of parsed
+            rules)}, policy is None for user defined chains
+        """
+        self.tables = tables
+        self.compiled = {}  # (table, chain) --> list of (rule, match)
+
+    def _compile(self, table, chain):
+        key = (table, chain)
+        rules = self.compiled.get(key)
+        if rules is None:
+            rules = self.compiled[key] = \
+                [(r,) + compile_rule(r) for r in self.tables[table][chain][1]]
+        return rules
+
+    def trace(self, spec):
+        """
+        Trace a packet through the built-in chains of its hook.
+        :param spec: the packet fields, e.g., tcp dst=10.0.0.2 dport=22
+        :return: IPTraceResult
+        """
+        packet = parse_packet(spec)
+        result = IPTraceResult(dict(packet))
+        hook = packet['hook']
+        for chain in HOOKS.get(hook, (hook,)):
+            for table in TABLE_ORDER:
+                if chain not in self.tables.get(table, {}):
+                    continue
+                if table == 'nat' and 'NEW' not in packet['states']:
+                    continue  # only the first packet is seen by nat
+                verdict = self._run_chain(table, chain, packet, 0, result)
+                if verdict is None:
+                    verdict = self.tables[table][chain][0]
+                    result.path.append((0, table, chain, None))
+                if verdict not in ('ACCEPT', None):
+                    result.final = verdict
+                    return result
+        return result
+
+    def _run_chain(self, table, chain, packet, depth, result):
+        """
+        Run the rules of a chain.
+        :return: the verdict, or None to return to the calling chain
+        """
+        if depth >= MAX_JUMP_DEPTH:
+            result.notes.append('Stopped after %u jumps' % depth)
+            return 'DROP'
+        for rule, match, unknown in self._compile(table, chain):
+            if unknown:
+                note = 'Rule %s of %s is skipped, %s not simulated' % (
+                    rule['num'], chain, ','.join(unknown))
+                if note not in result.notes:
+                    result.notes.append(note)
+                continue
+            if not match(packet):
+                continue
+            result.path.append((depth, table, chain, rule))
+            target = rule['target']
+            if target in VERDICTS:
+                return target
+            if target in NAT_TARGETS:
+                self._nat(target, rule['matches'], packet, result)
+                return 'ACCEPT'
+            if target == 'RETURN':
+                return None
+            if target in self.tables[table]:
+                verdict = self._run_chain(table, target, packet, depth + 1,
+                                          result)
+                if verdict is not None or rule['goto']:
+                    return verdict
+            elif target == 'MARK':
+                self._mark(rule['matches'], packet)
+            elif target and target not in ('LOG', 'NFLOG', 'CT', 'NOTRACK',
+                                            'CHECKSUM', 'CONNMARK', 'TCPMSS',
+                                            'DSCP', 'TOS'):
+                note = 'Target %s is not simulated' % target
+                if note not in result.notes:
+                    result.notes.append(note)
+        return None
+
+    @staticmethod
+    def _nat(target, matches, packet, result):
+        """
+        Change the packet by the NAT target. The option of the target is
+        a tuple if it was parsed, otherwise its text is kept, e.g., of an
+        ipv6 address, and the packet is not changed.
+        """
+        option = {'DNAT': 'to-destination', 'SNAT': 'to-source',
+                  'REDIRECT': 'to-ports'}.get(target)
+        value = matches[option][1] if option in matches else None
+        if option is None or value is None:
+            result.notes.append('%s does not change the packet' % target)
+        elif not isinstance(value, tuple):
+            note = 'Target %s --%s %s is not simulated' % (target, option,
+                                                           value)
+            if note not in result.notes:
+                result.notes.append(note)
+        elif target == 'REDIRECT':
+            packet['dport'] = value[0]
+        else:
+            (ips, ports) = value
+            addr, port = ('dst', 'dport') if target == 'DNAT' \
+                else ('src', 'sport')
+            packet[addr] = ips[0]
+            if ports:
+                packet[port] = ports[0]
+        packet['states'].add('DNAT' if target in ('DNAT', 'REDIRECT')
+                             else 'SNAT')
+
+    @staticmethod
+    def _mark(matches, packet):
+        for name in ('set-xmark', 'set-mark'):
+            if name in matches:
+                value, _, mask = matches[name][1].partition('/')
+                value, mask = int(value, 0), \
+                    int(mask, 0) if mask else 0xffffffff
+                if name == 'set-xmark':
+                    packet['mark'] = (packet['mark'] & ~mask) ^ value
+                else:
+                    packet['mark'] = (packet['mark'] & ~mask) | value
@@ -91,6 +91,9 @@ class OVSLogger(Logger, object):
 
         self.setLevel(level)
         self.handlers[0].setLevel(level)
+        # the cache of isEnabledFor() is only cleared by setLevel() for the
+        # loggers of the manager, which this one is not
+        getattr(self, '_cache', {}).clear()
 
     def output(self, msg, *args, **kwargs):
         """Log 'msg % args' with severity 'OUTPUT'.
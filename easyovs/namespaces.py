@@ -1,6 +1,7 @@
 __author__ = 'baohua'
 from subprocess import PIPE, Popen
 from easyovs.log import debug, error, output, warn
+from easyovs.render import Renderer, is_structured
 from easyovs.util import color_str, b, r
 
 # id intf mac ips
@@ -99,13 +100,20 @@ class NameSpace(object):
         if self.is_empty():
             output('Only lo interface existed\n')
             return
-        output(_format_str_ns_intf_ %('ID', 'Intf', 'Mac', 'IPs'))
-        for d in self.intfs:
-            if self.intfs[d].get('intf') != 'lo':
-                output(_format_str_ns_intf_
-                       % ( d, self.intfs[d].get('intf'),
-                           self.intfs[d].get('mac'),
-                           ', '.join(self.intfs[d].get('ip'))))
+        with Renderer() as out:
+            for d in self.intfs:
+                if self.intfs[d].get('intf') != 'lo':
+                    out.record('ns_intf', ns=self.id, id=d,
+                               intf=self.intfs[d].get('intf'),
+                               mac=self.intfs[d].get('mac'),
+                               ips=self.intfs[d].get('ip'))
+            out.write(_format_str_ns_intf_ % ('ID', 'Intf', 'Mac', 'IPs'))
+            out.write_rows(_format_str_ns_intf_,
+                           [(d, self.intfs[d].get('intf'),
+                             self.intfs[d].get('mac'),
+                             ', '.join(self.intfs[d].get('ip')))
+                            for d in self.intfs
+                            if self.intfs[d].get('intf') != 'lo'])
 
     def _load(self, test_content=None):
         if not test_content: # test_content is null
@@ -217,6 +225,13 @@ class NameSpaces(object):
         if not ns_list:
             output('No namespace exists\n')
             return
+        if is_structured():
+            with Renderer() as out:
+                for ns in ns_list:  # each one is loaded by a command
+                    out.record('namespace', id=ns,
+                               empty=NameSpace(ns).is_empty())
+                    out.flush()
+            return
         output(b('%d namespaces:\n' % len(ns_list)))
         ns_list_valid = filter(lambda x: not NameSpace(x).is_empty(), ns_list)
         if ns_list_valid:
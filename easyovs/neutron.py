@@ -7,8 +7,10 @@ except ImportError:
 import keystoneclient.v2_0.client as ksclient
 from keystoneclient.openstack.common.apiclient.exceptions import \
     AuthorizationFailure, Unauthorized
+from neutronclient.common.exceptions import NeutronClientException
 import neutronclient.v2_0.client as neutronclient
 import os
+import socket
 import sys
 
 from os.path import exists, getmtime
@@ -16,9 +18,14 @@ from time import time
 import _pickle as cPickle
 
 from easyovs import config
+from easyovs.iptables_save import ip_range
 from easyovs.log import output, warn
+from easyovs.render import Renderer, is_structured
 from easyovs.util import color_str
 
+# ids of the ports in one filtered query, to keep the url short
+MAX_IDS_PER_QUERY = 100
+
 
 class NeutronHandler(object):
     """
@@ -63,6 +70,32 @@ class NeutronHandler(object):
             result[port_id[:11]] = p
         return result
 
+    def get_ports_by_ids(self, port_ids):
+        """
+        Return the neutron ports of the given ids, queried with the ids as
+        filter instead of listing all ports, looks like
+        {'583c7038-d3xx-...': {'id': id, 'mac_address': mac,
+        'fixed_ips': [{'subnet_id': subnet_id, 'ip_address': ip}]}}
+        :param port_ids: the full ids of the ports
+        :return: dict of port id --> port
+        """
+        result = {}
+        port_ids = sorted(set(port_ids))
+        if not port_ids or not self.neutron:
+            return result
+        for i in range(0, len(port_ids), MAX_IDS_PER_QUERY):
+            try:
+                ports = self.neutron.list_ports(
+                    id=port_ids[i:i + MAX_IDS_PER_QUERY],
+                    fields=['id', 'mac_address', 'fixed_ips'])
+            except (NeutronClientException, Unauthorized) as e:
+                warn('Failed to query %u of the ports by ids: %s\n'
+                     % (len(port_ids) - i, e))
+                return result
+            for p in ports.get('ports', []):
+                result[p.get('id')] = p
+        return result
+
     def query_port_by_ip(self, ip):
         """
         Query an port having the ip address
@@ -76,6 +109,27 @@ class NeutronHandler(object):
                     return p
         return None
 
+    def query_ports_by_ips(self, ips, networks=()):
+        """
+        Query the ports having the ip addresses, by one pass of the ports
+        :param ips: list of ip addresses
+        :param networks: list of integer ranges (lo, hi) of networks, from
+        ip_range()
+        :return: dict of ip address --> port
+        """
+        result = {}
+        addrs = set(ips)
+        for p in self._neutron_list_ports():
+            for fixed_ip in p.get('fixed_ips'):
+                ip = fixed_ip.get('ip_address')
+                if ip in addrs:
+                    result.setdefault(ip, p)
+                elif networks and ':' not in ip:
+                    n = ip_range(ip)[0]
+                    if any(lo <= n <= hi for lo, hi in networks):
+                        result.setdefault(ip, p)
+        return result
+
     def query_port_by_id(self, id_keyword=''):
         """
         Query an port who's id has the keyword
@@ -150,7 +204,10 @@ def query_info(keywords):
         port = \
             neutron_handler.query_port_by_id(keyword) or \
             neutron_handler.query_port_by_ip(keyword)
-        if port:
+        if port and is_structured():
+            with Renderer() as out:
+                out.record('neutron_port', keyword=keyword, port=port)
+        elif port:
             output(color_str('## port_id = %s\n' % (port.get('id')), 'b'))
             for k in port:
                 output('%s: %s\n' % (k, port.get(k)))
@@ -168,3 +225,38 @@ def get_port_id_from_ip(ip):
     if port:
         return port.get('id')[:11]
     return None
+
+
+def get_port_ids_from_ips(ips):
+    """
+    Return the port 11bit ids of the given ips or networks by one query of
+    the ports, e.g., [('192.168.0.2', 'd4de9fe0-6d')] from 192.168.0.2.
+    The ips of a network are in order, a given ip without port has None.
+    :param ips: list of ip addresses or networks, e.g., 10.0.0.0/24
+    :return: list of (ip, port id or None)
+    """
+    networks = {}
+    for ip in ips:
+        if '/' in ip:
+            try:
+                networks[ip] = ip_range(ip)
+            except (ValueError, socket.error):
+                warn('Invalid network %s\n' % ip)
+    ports = neutron_handler.query_ports_by_ips(
+        [ip for ip in ips if '/' not in ip], list(networks.values()))
+    nums = sorted((ip_range(i)[0], i) for i in ports if ':' not in i)
+    result, seen = [], set()
+    for ip in ips:
+        if '/' in ip:
+            if ip not in networks:
+                continue
+            lo, hi = networks[ip]
+            found = [i for n, i in nums if lo <= n <= hi]
+        else:
+            found = [ip]
+        for i in found:
+            if i not in seen:
+                seen.add(i)
+                port = ports.get(i)
+                result.append((i, port.get('id')[:11] if port else None))
+    return result
@@ -0,0 +1,256 @@
+__author__ = 'baohua'
+
+import json
+import socket
+
+from easyovs.log import debug
+
+OVSDB_SOCK = '/var/run/openvswitch/db.sock'
+OVSDB_DB = 'Open_vSwitch'
+
+
+class OVSDBError(Exception):
+    """
+    Failed to talk with the ovsdb-server.
+    """
+    pass
+
+
+def ovsdb_atom(value):
+    """
+    Convert an ovsdb json atom/set into a python value.
+    >>> ovsdb_atom(['set', []])
+    []
+    >>> ovsdb_atom(['uuid', 'abc'])
+    'abc'
+    >>> ovsdb_atom(['set', [['uuid', 'a'], ['uuid', 'b']]])
+    ['a', 'b']
+    >>> ovsdb_atom(3)
+    3
+    """
+    if isinstance(value, list) and len(value) == 2:
+        if value[0] in ('uuid', 'named-uuid'):
+            return value[1]
+        elif value[0] == 'set':
+            return [ovsdb_atom(v) for v in value[1]]
+        elif value[0] == 'map':
+            return ovsdb_map(value)
+    return value
+
+
+def ovsdb_set(value):
+    """
+    Convert an ovsdb column value into a list, single atom is also a set.
+    >>> ovsdb_set(['uuid', 'a'])
+    ['a']
+    >>> ovsdb_set(['set', [1, 2]])
+    [1, 2]
+    """
+    if isinstance(value, list) and len(value) == 2 and value[0] == 'set':
+        return ovsdb_atom(value)
+    return [ovsdb_atom(value)]
+
+
+def ovsdb_map(value):
+    """
+    Convert an ovsdb map into a python dict.
+    >>> ovsdb_map(['map', [['iface-id', 'xx']]])
+    {'iface-id': 'xx'}
+    """
+    if isinstance(value, list) and len(value) == 2 and value[0] == 'map':
+        return dict((ovsdb_atom(k), ovsdb_atom(v)) for k, v in value[1])
+    return {}
+
+
+def ovsdb_str(value):
+    """
+    Return an optional ovsdb column (set of 0 or 1 atom) as a string.
+    >>> ovsdb_str(['set', []])
+    ''
+    >>> ovsdb_str(['set', [101]])
+    '101'
+    >>> ovsdb_str('secure')
+    'secure'
+    """
+    values = ovsdb_set(value)
+    if not values:
+        return ''
+    return str(values[0])
+
+
+class OVSDBClient(object):
+    """
+    A minimal JSON-RPC client talking to the ovsdb-server over unix socket.
+    """
+
+    def __init__(self, sock_path=OVSDB_SOCK, timeout=5):
+        self.sock_path = sock_path
+        self.timeout = timeout
+        self.sock = None
+        self.buf = ''
+        self.decoder = json.JSONDecoder()
+        self.req_id = 0
+
+    def connect(self):
+        if self.sock:
+            return
+        try:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(self.sock_path)
+        except socket.error as e:
+            self.close()
+            raise OVSDBError('Cannot connect to %s: %s' % (self.sock_path, e))
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+        self.sock, self.buf = None, ''
+
+    def send(self, msg):
+        """
+        Send a json-rpc message to the server.
+        :param msg: the message dict
+        """
+        self.connect()
+        try:
+            self.sock.sendall(json.dumps(msg).encode('utf-8'))
+        except socket.error as e:
+            self.close()
+            raise OVSDBError('Failed to send to %s: %s' % (self.sock_path, e))
+
+    def recv(self):
+        """
+        Receive one complete json-rpc message from the server.
+        :return: the message dict
+        """
+        data = b''
+        while True:
+            buf = self.buf.lstrip()
+            if buf.endswith('}'):  # only try decoding a possibly complete one
+                try:
+                    msg, end = self.decoder.raw_decode(buf)
+                    self.buf = buf[end:]
+                    return msg
+                except ValueError:
+                    pass
+            try:
+                chunk = self.sock.recv(65536)
+            except socket.error as e:
+                self.close()
+                raise OVSDBError('Failed to recv from %s: %s'
+                                 % (self.sock_path, e))
+            if not chunk:
+                self.close()
+                raise OVSDBError('Connection closed by %s' % self.sock_path)
+            data += chunk
+            try:
+                self.buf += data.decode('utf-8')
+                data = b''
+            except UnicodeDecodeError:  # wait for the rest of a multi-byte
+                continue
+
+    def call(self, method, params):
+        """
+        Issue a json-rpc request and wait for its reply.
+        :param method: e.g., transact
+        :param params: list of the params
+        :return: the result of the reply
+        """
+        self.req_id += 1
+        req_id = self.req_id
+        self.send({'method': method, 'params': params, 'id': req_id})
+        while True:
+            msg = self.recv()
+            if msg.get('method') == 'echo':  # keepalive from the server
+                self.send({'result': msg.get('params'), 'error': None,
+                           'id': msg.get('id')})
+                continue
+            if msg.get('id') != req_id:
+                debug('Ignore ovsdb msg %s\n' % msg)
+                continue
+            if msg.get('error'):
+                raise OVSDBError('%s error: %s' % (method, msg.get('error')))
+            return msg.get('result')
+
+    def select(self, tables):
+        """
+        Select rows of several tables in one transact.
+        :param tables: dict of table name --> list of columns
+        :return: dict of table name --> list of rows
+        """
+        names = sorted(tables.keys())
+        ops = [{'op': 'select', 'table': t, 'where': [],
+                'columns': tables[t]} for t in names]
+        result = self.call('transact', [OVSDB_DB] + ops)
+        rows = {}
+        for t, res in zip(names, result):
+            if 'error' in res:
+                raise OVSDBError('select %s error: %s' % (t, res['error']))
+            rows[t] = res.get('rows', [])
+        return rows
+
+
+def get_bridges(client=None):
+    """
+    Return a dict of all bridges from the ovsdb, in the same shape as
+    easyovs.util.get_all_bridges().
+    :param client: the OVSDBClient to use, a new one by default
+    :return: the bridges dict
+    """
+    own = client is None
+    if own:
+        client = OVSDBClient()
+    try:
+        rows = client.select({
+            'Bridge': ['name', 'ports', 'controller', 'fail_mode'],
+            'Port': ['_uuid', 'name', 'tag', 'interfaces'],
+            'Interface': ['_uuid', 'name', 'type'],
+            'Controller': ['_uuid', 'target'],
+        })
+    finally:
+        if own:
+            client.close()
+    intfs = dict((ovsdb_atom(i['_uuid']), i) for i in rows['Interface'])
+    ports = dict((ovsdb_atom(p['_uuid']), p) for p in rows['Port'])
+    ctrls = dict((ovsdb_atom(c['_uuid']), c['target'])
+                 for c in rows['Controller'])
+    brs = {}
+    for row in rows['Bridge']:
+        br = {'Controller': [], 'Port': {},
+              'fail_mode': ovsdb_str(row.get('fail_mode', ''))}
+        for c in ovsdb_set(row.get('controller', ['set', []])):
+            if c in ctrls:
+                br['Controller'].append(ctrls[c])
+        for p in ovsdb_set(row.get('ports', ['set', []])):
+            if p not in ports:
+                continue
+            port = ports[p]
+            info = {'vlan': ovsdb_str(port.get('tag', ['set', []])),
+                    'type': ''}
+            for i in ovsdb_set(port.get('interfaces', ['set', []])):
+                if i in intfs:
+                    info['intf'] = intfs[i]['name']
+                    info['type'] = intfs[i].get('type', '')
+            br['Port'][port['name']] = info
+        brs[row['name']] = br
+    return brs
+
+
+def get_interfaces(client=None):
+    """
+    Return the external_ids of all interfaces from the ovsdb, looks like
+    {'qvoxxx': {'iface-id': 'xxx', 'attached-mac': 'xxx', 'vm-uuid': 'xxx'}}
+    :param client: the OVSDBClient to use, a new one by default
+    :return: dict of interface name --> external_ids
+    """
+    own = client is None
+    if own:
+        client = OVSDBClient()
+    try:
+        rows = client.select({'Interface': ['name', 'external_ids']})
+    finally:
+        if own:
+            client.close()
+    return dict((i['name'], ovsdb_map(i.get('external_ids')))
+                for i in rows['Interface'])
@@ -0,0 +1,158 @@
+__author__ = 'baohua'
+
+import json
+import sys
+
+from easyovs.log import OUTPUT, lg
+from easyovs.util import color_str
+
+CHUNK_SIZE = 64 * 1024  # bytes of rendered text per write
+
+# text tables, a json array of records, or one json record per line
+FORMATS = ('text', 'json', 'ndjson')
+
+_state = {'format': 'text', 'records': 0}
+
+
+def set_format(fmt):
+    """
+    Set the format of the output. In json and ndjson, the records are
+    written to stdout, while the logs go to stderr.
+    :param fmt: one of FORMATS
+    """
+    _state['format'], _state['records'] = fmt, 0
+    lg.handlers[0].stream = sys.stdout if fmt == 'text' else sys.stderr
+
+
+def is_structured():
+    """
+    Return True if the output is in records instead of text tables.
+    """
+    return _state['format'] != 'text'
+
+
+def end_records(stream=None):
+    """
+    Close the output after the command, i.e., the array of json records.
+    """
+    if _state['format'] == 'json':
+        stream = stream or sys.stdout
+        stream.write('\n]\n' if _state['records'] else '[]\n')
+        stream.flush()
+
+
+def is_tty(stream):
+    """
+    Return True if the stream is a terminal, colors are only rendered then.
+    """
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):  # no isatty, or closed
+        return False
+
+
+class Renderer(object):
+    """
+    Render the rows of a table into a buffer, which is written to the output
+    stream by one write per chunk, instead of logging every row.
+    Nothing is rendered when the output level is disabled, like output().
+    In json and ndjson, only the records are rendered, to stdout.
+    >>> import io
+    >>> s = io.StringIO()
+    >>> with Renderer(s) as out:
+    ...     out.write('%-4s%-4s\\n' % ('ID', 'PKT'), 'g')
+    ...     out.write_rows('%-4u%-4u\\n', [(1, 2), (2, 0)])
+    >>> s.getvalue()
+    'ID  PKT \\n1   2   \\n2   0   \\n'
+    """
+
+    def __init__(self, stream=None, chunk_size=CHUNK_SIZE):
+        """
+        :param stream: where to write, default to the stream of output()
+        :param chunk_size: bytes buffered before a write
+        """
+        self.structured = is_structured()
+        if self.structured:
+            self.stream = stream or sys.stdout
+        else:
+            self.stream = stream or lg.handlers[0].stream
+        self.chunk_size = chunk_size
+        self.enabled = not self.structured and \
+            lg.isEnabledFor(OUTPUT) and lg.manager.disable < OUTPUT
+        self.color = is_tty(self.stream)
+        self.buf, self.size = [], 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+    def _append(self, text):
+        self.buf.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def write(self, text, color=None):
+        """
+        Buffer the text, in the color if the stream is a terminal.
+        :param text: rendered text, with the trailing newline
+        :param color: color of color_str(), e.g., 'g'
+        """
+        if not self.enabled:
+            return
+        if color and self.color:
+            line = text.rstrip('\n')
+            text = color_str(line, color) + text[len(line):]
+        self._append(text)
+
+    def write_rows(self, fmt, rows, color=None):
+        """
+        Format the rows of a table in one batch, and buffer them.
+        :param fmt: format string of one row, with the trailing newline
+        :param rows: iterable of tuples of the fields of each row
+        :param color: color of all rows
+        """
+        if not self.enabled:
+            return
+        if color and self.color:
+            for row in rows:
+                self.write(fmt % row, color)
+        else:
+            self._append(''.join([fmt % row for row in rows]))
+
+    def record(self, kind, **fields):
+        """
+        Buffer one record in json, nothing is done for text.
+        :param kind: kind of the record, e.g., flow
+        :param fields: fields of the record
+        >>> import io
+        >>> s = io.StringIO()
+        >>> set_format('ndjson')
+        >>> with Renderer(s) as out:
+        ...     out.write('ID\\n')
+        ...     out.record('flow', id=1)
+        >>> set_format('text')
+        >>> s.getvalue()
+        '{"id": 1, "record": "flow"}\\n'
+        """
+        if not self.structured:
+            return
+        fields['record'] = kind
+        text = json.dumps(fields, sort_keys=True)
+        if _state['format'] == 'json':
+            text = ('[\n' if not _state['records'] else ',\n') + text
+        else:
+            text += '\n'
+        _state['records'] += 1
+        self._append(text)
+
+    def flush(self):
+        """
+        Write the buffered text to the stream at once.
+        """
+        if self.buf:
+            self.stream.write(''.join(self.buf))
+            self.buf, self.size = [], 0
+        self.stream.flush()
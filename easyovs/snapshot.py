@@ -0,0 +1,219 @@
+__author__ = 'baohua'
+
+from array import array
+import mmap
+import struct
+import sys
+import time
+
+from easyovs.flow import Flow
+from easyovs.inventory import OFPP_LOCAL
+
+SNAPSHOT_MAGIC = b'EOVSFLOW'
+SNAPSHOT_VERSION = 1
+
+# magic, version, byte order (0 little, 1 big), index of the bridge name in
+# the strings, number of flows, number of strings, number of ports, time of
+# the snapshot
+_header = struct.Struct('<8sHHIIIId')
+
+# numeric columns in the file order, wider ones first to keep them aligned
+COLUMNS = (
+    ('cookie', 'I'), ('packet', 'I'), ('n_bytes', 'I'), ('duration', 'd'),
+    ('match', 'I'), ('actions', 'I'), ('raw_match', 'I'),
+    ('raw_actions', 'I'), ('priority', 'H'), ('idle_timeout', 'H'),
+    ('hard_timeout', 'H'), ('table', 'B'),
+)
+STRING_COLUMNS = ('match', 'actions', 'raw_match', 'raw_actions')
+# 64-bit columns, saved as the low and high 32-bit words of each value, as
+# python 2 has no array of 64-bit integers
+WIDE_COLUMNS = ('cookie', 'packet', 'n_bytes')
+
+# python 3 reads the columns in place, python 2 copies them into arrays
+_CAST = sys.version_info >= (3, 3)
+
+
+class SnapshotError(Exception):
+    """
+    The file is not a valid flow snapshot.
+    """
+    pass
+
+
+def _pad(n):
+    return (8 - n % 8) % 8
+
+
+def _to_bytes(col):
+    return col.tobytes() if hasattr(col, 'tobytes') else col.tostring()
+
+
+def is_snapshot(path):
+    """
+    Return True if the file starts with the snapshot magic.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+    except IOError:
+        return False
+
+
+def write_snapshot(path, bridge, flows, port_map=None):
+    """
+    Write the flows into a snapshot file: a header, a table of the distinct
+    strings, one fixed-width column per field of the flows, then the ports.
+    :param path: path of the snapshot file
+    :param bridge: name of the bridge
+    :param flows: list of Flow
+    :param port_map: dict of ofport --> interface name
+    :return: number of the flows written
+    """
+    strings, index = [], {}
+
+    def string_id(s):
+        if s not in index:
+            index[s] = len(strings)
+            strings.append(s.encode('utf-8'))
+        return index[s]
+
+    bridge_id = string_id(bridge)
+    columns = dict((name, array(code)) for name, code in COLUMNS)
+    for f in flows:
+        for name, _ in COLUMNS:
+            if name in STRING_COLUMNS:
+                columns[name].append(string_id(getattr(f, name)))
+            elif name in WIDE_COLUMNS:
+                value = getattr(f, name)
+                columns[name].extend((value & 0xffffffff, value >> 32))
+            else:
+                columns[name].append(getattr(f, name))
+    ports, port_names = array('I'), array('I')
+    for port, intf in sorted((port_map or {}).items(), key=str):
+        ports.append(OFPP_LOCAL if port == 'LOCAL' else int(port))
+        port_names.append(string_id(intf))
+    offsets = array('I', [0])
+    for s in strings:
+        offsets.append(offsets[-1] + len(s))
+    order = 0 if sys.byteorder == 'little' else 1
+    with open(path, 'wb') as out:
+        header = _header.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, order,
+                              bridge_id, len(columns['table']),
+                              len(strings), len(ports), time.time())
+        data = [header, _to_bytes(offsets), b''.join(strings)] + \
+            [_to_bytes(columns[name]) for name, _ in COLUMNS] + \
+            [_to_bytes(ports), _to_bytes(port_names)]
+        for d in data:
+            out.write(d)
+            out.write(b'\0' * _pad(len(d)))
+    return len(columns['table'])
+
+
+class Snapshot(object):
+    """
+    A flow snapshot mapped into memory, the columns are read in place and
+    a Flow is only built when it is accessed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise SnapshotError('%s is empty' % path)
+        try:
+            self._load()
+        except (struct.error, ValueError, TypeError) as e:
+            self.close()
+            raise SnapshotError('%s is broken: %s' % (path, e))
+
+    def _load(self):
+        magic, version, order, bridge_id, self.n_flows, n_strings, \
+            n_ports, self.time = _header.unpack_from(self.mm, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotError('%s is not a flow snapshot' % self.path)
+        if version > SNAPSHOT_VERSION:
+            raise SnapshotError('%s is of newer version %u'
+                                % (self.path, version))
+        self.swap = order != (0 if sys.byteorder == 'little' else 1)
+        pos = _header.size + _pad(_header.size)
+        self.offsets, pos = self._column(pos, 'I', n_strings + 1)
+        pos += _pad(pos)
+        self.blob_start = pos
+        pos += self.offsets[-1]
+        pos += _pad(pos)
+        self.columns = {}
+        for name, code in COLUMNS:
+            n = self.n_flows * 2 if name in WIDE_COLUMNS else self.n_flows
+            self.columns[name], pos = self._column(pos, code, n)
+            pos += _pad(pos)
+        ports, pos = self._column(pos, 'I', n_ports)
+        pos += _pad(pos)
+        port_names, pos = self._column(pos, 'I', n_ports)
+        self.strings = {}  # string id --> decoded string
+        self.bridge = self.string(bridge_id)
+        self.port_map = {}  # ofport --> interface name, like Bridge.port_map
+        for port, name in zip(ports, port_names):
+            self.port_map['LOCAL' if port == OFPP_LOCAL else port] = \
+                self.string(name)
+
+    def _column(self, pos, code, n):
+        """
+        Return a view of n items of the typecode at pos, and the end.
+        """
+        size = array(code).itemsize * n
+        end = pos + size
+        if end > len(self.mm):
+            raise SnapshotError('%s is truncated' % self.path)
+        if _CAST and not self.swap:
+            return memoryview(self.mm)[pos:end].cast(code), end
+        col = array(code)
+        if hasattr(col, 'frombytes'):
+            col.frombytes(self.mm[pos:end])
+        else:
+            col.fromstring(self.mm[pos:end])
+        if self.swap:
+            col.byteswap()
+        return col, end
+
+    def close(self):
+        for name in list(getattr(self, 'columns', {})):
+            col = self.columns.pop(name)
+            if _CAST and isinstance(col, memoryview):
+                col.release()
+        if _CAST and isinstance(getattr(self, 'offsets', None), memoryview):
+            self.offsets.release()
+        self.mm.close()
+
+    def string(self, i):
+        s = self.strings.get(i)
+        if s is None:
+            start = self.blob_start + self.offsets[i]
+            end = self.blob_start + self.offsets[i + 1]
+            s = self.mm[start:end]
+            if not isinstance(s, str):  # bytes of python 3
+                s = s.decode('utf-8')
+            self.strings[i] = s
+        return s
+
+    def __len__(self):
+        return self.n_flows
+
+    def __getitem__(self, i):
+        if i < 0 or i >= self.n_flows:
+            raise IndexError(i)
+        c, j = self.columns, i * 2
+        cookie, packet, n_bytes = c['cookie'], c['packet'], c['n_bytes']
+        return Flow(self.bridge, c['table'][i],
+                    packet[j] | packet[j + 1] << 32, c['priority'][i],
+                    self.string(c['match'][i]), self.string(c['actions'][i]),
+                    i, cookie[j] | cookie[j + 1] << 32,
+                    n_bytes[j] | n_bytes[j + 1] << 32, c['duration'][i],
+                    c['idle_timeout'][i], c['hard_timeout'][i],
+                    self.string(c['raw_match'][i]),
+                    self.string(c['raw_actions'][i]))
+
+    def __iter__(self):
+        for i in range(self.n_flows):
+            yield self[i]
@@ -0,0 +1,429 @@
+__author__ = 'baohua'
+
+from numbers import Integral
+import re
+import socket
+import struct
+
+from easyovs.flow import split_actions
+from easyovs.inventory import OFPP_LOCAL
+
+MAX_RESUBMIT_DEPTH = 64  # same as ovs-vswitchd
+
+EXACT = (1 << 128) - 1  # mask of a numeric field without /mask
+
+# protocol shorthands --> the fields they imply
+PROTOCOLS = {
+    'ip': (('dl_type', 0x0800),),
+    'ipv6': (('dl_type', 0x86dd),),
+    'arp': (('dl_type', 0x0806),),
+    'rarp': (('dl_type', 0x8035),),
+    'icmp': (('dl_type', 0x0800), ('nw_proto', 1)),
+    'tcp': (('dl_type', 0x0800), ('nw_proto', 6)),
+    'udp': (('dl_type', 0x0800), ('nw_proto', 17)),
+    'sctp': (('dl_type', 0x0800), ('nw_proto', 132)),
+    'icmp6': (('dl_type', 0x86dd), ('nw_proto', 58)),
+    'tcp6': (('dl_type', 0x86dd), ('nw_proto', 6)),
+    'udp6': (('dl_type', 0x86dd), ('nw_proto', 17)),
+    'sctp6': (('dl_type', 0x86dd), ('nw_proto', 132)),
+}
+
+# other names of the fields in matches, set_field, load and move
+FIELD_ALIASES = {
+    'eth_src': 'dl_src', 'eth_dst': 'dl_dst', 'eth_type': 'dl_type',
+    'ip_src': 'nw_src', 'ip_dst': 'nw_dst', 'ip_proto': 'nw_proto',
+    'ipv4_src': 'nw_src', 'ipv4_dst': 'nw_dst',
+    'arp_spa': 'nw_src', 'arp_tpa': 'nw_dst', 'arp_op': 'nw_proto',
+    'tcp_src': 'tp_src', 'tcp_dst': 'tp_dst',
+    'udp_src': 'tp_src', 'udp_dst': 'tp_dst',
+    'sctp_src': 'tp_src', 'sctp_dst': 'tp_dst',
+    'icmp_type': 'tp_src', 'icmp_code': 'tp_dst',
+    'tunnel_id': 'tun_id', 'tun_ipv4_src': 'tun_src',
+    'tun_ipv4_dst': 'tun_dst',
+    'NXM_OF_IN_PORT': 'in_port', 'NXM_OF_ETH_SRC': 'dl_src',
+    'NXM_OF_ETH_DST': 'dl_dst', 'NXM_OF_ETH_TYPE': 'dl_type',
+    'NXM_OF_VLAN_TCI': 'vlan_tci', 'NXM_OF_IP_SRC': 'nw_src',
+    'NXM_OF_IP_DST': 'nw_dst', 'NXM_OF_IP_PROTO': 'nw_proto',
+    'NXM_OF_ARP_SPA': 'nw_src', 'NXM_OF_ARP_TPA': 'nw_dst',
+    'NXM_OF_ARP_OP': 'nw_proto', 'NXM_NX_ARP_SHA': 'arp_sha',
+    'NXM_NX_ARP_THA': 'arp_tha', 'NXM_OF_TCP_SRC': 'tp_src',
+    'NXM_OF_TCP_DST': 'tp_dst', 'NXM_OF_UDP_SRC': 'tp_src',
+    'NXM_OF_UDP_DST': 'tp_dst', 'NXM_NX_TUN_ID': 'tun_id',
+    'OXM_OF_METADATA': 'metadata',
+}
+
+MAC_FIELDS = ('dl_src', 'dl_dst', 'arp_sha', 'arp_tha')
+IP_FIELDS = ('nw_src', 'nw_dst', 'tun_src', 'tun_dst')
+
+# output ports which are not numbers
+SPECIAL_PORTS = ('NORMAL', 'FLOOD', 'ALL', 'LOCAL', 'IN_PORT', 'CONTROLLER',
+                 'drop')
+
+_reg = re.compile(r'^(?:NXM_NX_)?(?:REG|reg)(\d+)$')
+_subfield = re.compile(r'^([\w.]+)\[(?:(\d+)(?:\.\.(\d+))?)?\]$')
+
+
+def field_name(name):
+    """
+    Return the name used by the classifier for a field.
+    >>> field_name('NXM_NX_REG3'), field_name('eth_dst'), field_name('in_port')
+    ('reg3', 'dl_dst', 'in_port')
+    """
+    m = _reg.match(name)
+    if m:
+        return 'reg%s' % m.group(1)
+    return FIELD_ALIASES.get(name, name)
+
+
+def _ip_to_int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+def _mac_to_int(mac):
+    return int(mac.replace(':', ''), 16)
+
+
+def parse_field(field, value):
+    """
+    Return the (value, mask) of a match field. A value which is not a
+    number is kept as a string, with mask None for an exact comparison.
+    >>> parse_field('nw_dst', '10.0.0.0/24') == (0x0a000000, 0xffffff00)
+    True
+    >>> parse_field('dl_dst', '01:00:00:00:00:00/01:00:00:00:00:00')
+    (1099511627776, 1099511627776)
+    >>> parse_field('tun_id', '0x2/0xff') == (2, 0xff)
+    True
+    >>> parse_field('ct_state', '+trk')
+    ('+trk', None)
+    """
+    v, _, m = value.partition('/')
+    try:
+        if field in MAC_FIELDS:
+            v, m = _mac_to_int(v), _mac_to_int(m) if m else EXACT
+        elif field in IP_FIELDS:
+            v = _ip_to_int(v)
+            if not m:
+                m = EXACT
+            elif '.' in m:
+                m = _ip_to_int(m)
+            else:
+                m = (0xffffffff << (32 - int(m))) & 0xffffffff
+        else:
+            v, m = int(v, 0), int(m, 0) if m else EXACT
+    except (ValueError, socket.error):
+        return value, None
+    return v & m, m
+
+
+def parse_match(match, port_numbers=None):
+    """
+    Return the dict of field --> (value, mask) of a match string.
+    dl_vlan and dl_vlan_pcp are converted into vlan_tci like ovs does.
+    :param match: e.g., ip,in_port=1,nw_dst=10.0.0.0/24
+    :param port_numbers: dict of interface name --> ofport for in_port
+    >>> m = parse_match('tcp,dl_vlan=5,tp_dst=80')
+    >>> m['dl_type'][0], m['nw_proto'][0], m['tp_dst'][0], m['vlan_tci']
+    (2048, 6, 80, (4101, 8191))
+    """
+    fields = {}
+
+    def add(f, v, m):
+        if f in fields and m is not None and fields[f][1] is not None:
+            v, m = fields[f][0] | v, fields[f][1] | m
+        fields[f] = (v, m)
+
+    for item in match.split(','):
+        item = item.strip()
+        if not item or item == '*':
+            continue
+        key, sep, value = item.partition('=')
+        if not sep:
+            if key in PROTOCOLS:
+                for f, v in PROTOCOLS[key]:
+                    add(f, v, EXACT)
+            else:
+                add(key, '', None)
+            continue
+        f = field_name(key)
+        if f == 'in_port':
+            port = port_number(value, port_numbers)
+            add(f, port, EXACT if isinstance(port, Integral) else None)
+        elif f == 'dl_vlan':
+            vid = int(value, 0)
+            if vid == 0xffff:  # no vlan header
+                add('vlan_tci', 0, 0x1000)
+            else:
+                add('vlan_tci', 0x1000 | vid, 0x1fff)
+        elif f == 'dl_vlan_pcp':
+            add('vlan_tci', 0x1000 | (int(value, 0) << 13), 0xf000)
+        else:
+            add(f, *parse_field(f, value))
+    return fields
+
+
+def port_number(port, port_numbers=None):
+    """
+    Return the ofport number of a port given by number or name.
+    >>> port_number('3'), port_number('LOCAL')
+    (3, 65534)
+    >>> port_number('qvo1', {'qvo1': 5}), port_number('qvo2', {'qvo1': 5})
+    (5, 'qvo2')
+    """
+    port = port.strip('"')
+    if port.isdigit():
+        return int(port)
+    if port == 'LOCAL':
+        return OFPP_LOCAL
+    if port_numbers and port in port_numbers:
+        return port_number(str(port_numbers[port]))
+    return port
+
+
+def parse_packet(spec, port_numbers=None):
+    """
+    Return the packet as a dict of field --> value from the given fields,
+    e.g., in_port=1,dl_vlan=2,tcp,nw_dst=10.0.0.2,tp_dst=22
+    >>> p = parse_packet('in_port=qvo1 udp dl_vlan=2', {'qvo1': '7'})
+    >>> p['in_port'], p['dl_type'], p['nw_proto'], p['vlan_tci']
+    (7, 2048, 17, 4098)
+    """
+    packet = {}
+    for f, (v, m) in parse_match(spec.replace(' ', ','),
+                                 port_numbers).items():
+        packet[f] = v
+    return packet
+
+
+class Subtable(object):
+    """
+    The flows of a table with the same fields and masks, indexed by the
+    masked values in a hash table.
+    """
+
+    def __init__(self, mask):
+        self.mask = mask  # tuple of (field, mask)
+        self.max_priority = -1
+        self.rules = {}  # masked values --> flows, highest priority first
+
+    def key(self, packet):
+        key = []
+        for f, m in self.mask:
+            if m is None:
+                key.append(packet.get(f))
+                continue
+            v = packet.get(f, 0)
+            if not isinstance(v, Integral):
+                return None
+            key.append(v & m)
+        return tuple(key)
+
+    def insert(self, fields, flow):
+        key = tuple(fields[f][0] for f, _ in self.mask)
+        self.rules.setdefault(key, []).append(flow)
+        self.max_priority = max(self.max_priority, flow.priority)
+
+    def lookup(self, packet):
+        key = self.key(packet)
+        if key is None:
+            return None
+        flows = self.rules.get(key)
+        return flows[0] if flows else None
+
+
+class Classifier(object):
+    """
+    A tuple space search classifier of the flows: every table has one hash
+    table per distinct set of fields and masks, looked up in order of their
+    highest priority, until no remaining one can beat the best match.
+    """
+
+    def __init__(self, flows, port_numbers=None):
+        """
+        :param flows: list of Flow, with raw_match and raw_actions
+        :param port_numbers: dict of interface name --> ofport
+        """
+        self.tables = {}  # table id --> list of Subtable
+        self.skipped = []  # (flow, error) of the match not parsed
+        subtables = {}  # (table id, mask) --> Subtable
+        for flow in sorted(flows, key=lambda f: -f.priority):
+            try:
+                fields = parse_match(flow.raw_match, port_numbers)
+            except ValueError as e:
+                self.skipped.append((flow, e))
+                continue
+            mask = tuple(sorted((f, m) for f, (v, m) in fields.items()))
+            sub = subtables.get((flow.table, mask))
+            if sub is None:
+                sub = subtables[(flow.table, mask)] = Subtable(mask)
+                self.tables.setdefault(flow.table, []).append(sub)
+            sub.insert(fields, flow)
+        for subs in self.tables.values():
+            subs.sort(key=lambda s: -s.max_priority)
+
+    def lookup(self, table, packet):
+        """
+        Return the highest priority flow of the table matching the packet,
+        or None.
+        """
+        best = None
+        for sub in self.tables.get(table, []):
+            if best is not None and best.priority >= sub.max_priority:
+                break
+            flow = sub.lookup(packet)
+            if flow is not None and \
+                    (best is None or flow.priority > best.priority):
+                best = flow
+        return best
+
+
+class TraceResult(object):
+    """
+    The tables and flows a packet went through, and where it was sent.
+    """
+
+    def __init__(self, packet):
+        self.packet = packet
+        self.path = []  # list of (depth, table, flow or None)
+        self.outputs = []  # list of output ports or special ports
+        self.notes = []
+
+    def verdict(self):
+        outputs = [o for o in self.outputs if o != 'drop']
+        if outputs:
+            return 'output:%s' % ','.join(str(o) for o in outputs)
+        return 'drop'
+
+
+class Tracer(object):
+    """
+    Run packets through the flow tables offline: table by table, highest
+    priority first, following resubmit and goto_table.
+    """
+
+    def __init__(self, flows, port_map=None):
+        """
+        :param flows: list of Flow, from a bridge or a saved dump
+        :param port_map: dict of ofport --> interface name
+        """
+        self.port_map = dict((OFPP_LOCAL if port == 'LOCAL' else port, intf)
+                             for port, intf in (port_map or {}).items())
+        self.port_numbers = dict((intf, port) for port, intf
+                                 in self.port_map.items())
+        self.classifier = Classifier(flows, self.port_numbers)
+
+    def trace(self, spec, table=0):
+        """
+        Trace a packet from a table.
+        :param spec: the packet fields, e.g., in_port=1,ip,nw_dst=10.0.0.2
+        :param table: the first table
+        :return: TraceResult
+        """
+        packet = parse_packet(spec, self.port_numbers)
+        result = TraceResult(dict(packet))
+        self._run_table(table, packet, 0, result)
+        return result
+
+    def _port_name(self, port):
+        if isinstance(port, int):
+            return self.port_map.get(port, port)
+        return port
+
+    def _run_table(self, table, packet, depth, result):
+        if depth >= MAX_RESUBMIT_DEPTH:
+            result.notes.append('Stopped after %u resubmits' % depth)
+            return
+        flow = self.classifier.lookup(table, packet)
+        result.path.append((depth, table, flow))
+        if flow is None:  # table miss
+            return
+        for act in split_actions(flow.raw_actions):
+            if self._run_action(act, table, packet, depth, result):
+                return
+
+    def _run_action(self, act, table, packet, depth, result):
+        """
+        Apply one action to the packet.
+        :return: True if no more action of the flow should run
+        """
+        name, _, arg = act.partition(':')
+        if '(' in name:
+            name, _, arg = act.partition('(')
+            arg = arg[:-1]
+        name = name.strip()
+        if name == 'resubmit':
+            port, _, to_table = arg.partition(',')
+            in_port = packet.get('in_port')
+            if port:
+                packet['in_port'] = port_number(port, self.port_numbers)
+            self._run_table(int(to_table) if to_table else table, packet,
+                            depth + 1, result)
+            packet['in_port'] = in_port
+        elif name == 'goto_table':
+            self._run_table(int(arg), packet, depth + 1, result)
+            return True
+        elif name == 'ct':
+            m = re.search(r'table=(\d+)', arg)
+            if m:  # continues in the table, the ct state is not simulated
+                result.notes.append('ct(%s) is not simulated' % arg)
+                self._run_table(int(m.group(1)), packet, depth + 1, result)
+        elif name == 'output':
+            port = arg
+            if port.endswith(']'):  # e.g., NXM_OF_IN_PORT[]
+                port = self._get_subfield(port, packet)
+            result.outputs.append(
+                self._port_name(port_number(str(port), self.port_numbers)))
+        elif name == 'enqueue':
+            result.outputs.append(self._port_name(
+                port_number(arg.split(':')[0], self.port_numbers)))
+        elif name in SPECIAL_PORTS or name == 'controller':
+            result.outputs.append(name.upper() if name != 'drop' else name)
+        elif name == 'mod_vlan_vid':
+            packet['vlan_tci'] = \
+                (packet.get('vlan_tci', 0) & 0xe000) | 0x1000 | int(arg, 0)
+        elif name in ('strip_vlan', 'pop_vlan'):
+            packet['vlan_tci'] = 0
+        elif name in ('set_tunnel', 'set_tunnel64'):
+            packet['tun_id'] = int(arg, 0)
+        elif name.startswith('mod_') and name[4:] in \
+                ('dl_src', 'dl_dst', 'nw_src', 'nw_dst', 'tp_src', 'tp_dst'):
+            packet[name[4:]] = parse_field(name[4:], arg)[0]
+        elif name == 'set_field':
+            value, _, dst = arg.partition('->')
+            f = field_name(dst)
+            packet[f] = parse_field(f, value)[0]
+        elif name == 'load':
+            value, _, dst = arg.partition('->')
+            self._set_subfield(dst, int(value, 0), packet)
+        elif name == 'move':
+            src, _, dst = arg.partition('->')
+            self._set_subfield(dst, self._get_subfield(src, packet), packet)
+        return False
+
+    @staticmethod
+    def _subfield(spec):
+        """
+        Return the field, the lowest bit and the mask of a subfield spec,
+        e.g., NXM_NX_REG0[0..15]
+        """
+        m = _subfield.match(spec.strip())
+        if not m:
+            return field_name(spec.strip()), 0, EXACT
+        start = int(m.group(2) or 0)
+        if m.group(2) is None:
+            return field_name(m.group(1)), 0, EXACT
+        end = int(m.group(3) or start)
+        return field_name(m.group(1)), start, (1 << (end - start + 1)) - 1
+
+    def _get_subfield(self, spec, packet):
+        f, start, mask = self._subfield(spec)
+        v = packet.get(f, 0)
+        if not isinstance(v, Integral):
+            return 0
+        return (v >> start) & mask
+
+    def _set_subfield(self, spec, value, packet):
+        f, start, mask = self._subfield(spec)
+        v = packet.get(f, 0)
+        if not isinstance(v, Integral):
+            v = 0
+        packet[f] = (v & ~(mask << start)) | ((value & mask) << start)
@@ -1,11 +1,17 @@
 __author__ = 'baohua'
 
+import json
+from multiprocessing.pool import ThreadPool
 from subprocess import Popen, PIPE
 import re
 import socket
 import struct
 
 from easyovs.log import debug, info, warn
+from easyovs.inventory import PortIndex, get_inventory
+from easyovs.ovsdb import OVSDBError, get_bridges, get_interfaces, ovsdb_map
+
+MAX_WORKERS = 8  # threads to run the commands of several bridges together
 
 
 def sh(cmd):
@@ -166,6 +172,46 @@ def compress_mac_str(raw_str):
     else:
         return raw_str
 
+_hex_zeros = re.compile('0x0+')
+
+
+def compress_hex_str(raw_str):
+    """
+    Compress the leading zeros of the hex numbers in a string.
+    >>> compress_hex_str('tun_id=0x00000000001,dl_vlan=2')
+    'tun_id=0x1,dl_vlan=2'
+    """
+    return _hex_zeros.sub('0x', raw_str)
+
+
+def run_concurrently(func, items, workers=MAX_WORKERS):
+    """
+    Run the func on every item by a bounded pool of threads.
+    An exception on one item does not stop the others.
+    :param func: function with one item as the parameter
+    :param items: list of the items
+    :param workers: max number of the threads
+    :return: list of (result, exception) in the same order of the items
+    >>> r = run_concurrently(lambda x: 10 // x, [1, 0, 5])
+    >>> r[0], r[2], type(r[1][1]).__name__
+    ((10, None), (2, None), 'ZeroDivisionError')
+    """
+    def run(item):
+        try:
+            return func(item), None
+        except Exception as e:
+            debug('run_concurrently: %s on %s\n' % (e, item))
+            return None, e
+    if len(items) <= 1:
+        return [run(item) for item in items]
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return pool.map(run, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
 def get_all_bridges():
     """
     Return a dict of all available bridges, looks like
@@ -181,6 +227,68 @@ def get_all_bridges():
             }
         },
     }
+    The tables are answered by the live inventory if it is running, or
+    queried from the ovsdb-server directly, and fall back to parsing the
+    output of ovs-vsctl show.
+    """
+    inventory = get_inventory()
+    if inventory:
+        return inventory.get_bridges()
+    try:
+        return get_bridges()
+    except OVSDBError as e:
+        debug('get_all_bridges: %s, fall back to ovs-vsctl\n' % e)
+    return _get_all_bridges_vsctl()
+
+
+def get_port_index():
+    """
+    Return the PortIndex of the ports on all bridges. It is shared from the
+    live inventory if it is running, otherwise built from get_all_bridges()
+    with only the names of the ports.
+    """
+    inventory = get_inventory()
+    if inventory:
+        return inventory.get_index()
+    brs = get_all_bridges()
+    return PortIndex(dict((name, brs[name].get('Port', {})) for name in brs))
+
+
+def get_all_interfaces():
+    """
+    Return the external_ids of all interfaces, looks like
+    {
+        'qvoxxx': {
+            'iface-id': 'xxx', // the neutron port id
+            'attached-mac': 'fa:16:3e:xx:xx:xx', // mac of the vm
+            'vm-uuid': 'xxx',
+        },
+    }
+    The column is answered by the live inventory if it is running, or
+    queried from the ovsdb-server directly, and fall back to ovs-vsctl.
+    """
+    inventory = get_inventory()
+    if inventory:
+        return inventory.get_interfaces()
+    try:
+        return get_interfaces()
+    except OVSDBError as e:
+        debug('get_all_interfaces: %s, fall back to ovs-vsctl\n' % e)
+    cmd = 'ovs-vsctl --format=json --columns=name,external_ids list Interface'
+    result, error = Popen(cmd, stdout=PIPE, stderr=PIPE,
+                          shell=True).communicate()
+    if error:
+        return {}
+    try:
+        rows = json.loads(result.decode())['data']
+    except (ValueError, KeyError):
+        return {}
+    return dict((name, ovsdb_map(ids)) for name, ids in rows)
+
+
+def _get_all_bridges_vsctl():
+    """
+    Return a dict of all available bridges by parsing ovs-vsctl show.
     """
     brs, br = {}, ''
     cmd = 'ovs-vsctl show'
@@ -219,7 +327,7 @@ def makeMask(n):
 
 def ipStrToNum(ip_str):
     "convert decimal dotted quad string to long integer"
-    s = map(lambda x: int(x), ip_str.split('.'))
+    s = [int(x) for x in ip_str.split('.')]
     return s[3] + (s[2] << 8) + (s[1] << 16) + (s[0] << 24)
 
 def numToipStr(num):
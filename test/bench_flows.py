@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Benchmark parsing the lines of ovs-ofctl dump-flows into flows.
+# Usage: python bench_flows.py [dump_file]
+# e.g., ovs-ofctl dump-flows br-int > dump.txt, without a file 100k lines
+# like the ones of a neutron br-int are generated.
+
+__author__ = 'baohua'
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from easyovs.bridge import Bridge
+from easyovs.flow import Flow, flow_line_fields
+
+NUM_LINES = 100000
+ROUNDS = 3
+PORT_MAP = dict((i, 'qvo%04u' % i) for i in range(1, 64))
+
+
+def gen_lines(num=NUM_LINES):
+    """
+    Return the lines of a dump, grouped by table as ovs-ofctl prints them.
+    """
+    rand = random.Random(5)
+    tables = [0, 1, 2, 3, 4, 10, 20, 21, 22, 23, 24, 25, 60, 71, 72, 73, 81,
+              82]
+    lines = []
+    for i in range(num):
+        table = tables[i * len(tables) // num]
+        port = rand.randrange(1, 60)
+        mac = 'fa:16:3e:%02x:%02x:%02x' % (i >> 16 & 255, i >> 8 & 255,
+                                           i & 255)
+        match, actions = [
+            ('in_port=%u,dl_src=%s' % (port, mac),
+             'resubmit(,%u)' % rand.choice(tables)),
+            ('ip,reg5=0x%x,nw_src=10.%u.%u.%u'
+             % (port, i >> 16 & 255, i >> 8 & 255, i & 255),
+             'ct(table=72,zone=NXM_NX_REG6[0..15])'),
+            ('tun_id=0x%x' % (i + 1),
+             'mod_vlan_vid:%u,resubmit(,10)' % (i % 4094 + 1)),
+            ('dl_vlan=%u,dl_dst=%s' % (i % 4094 + 1, mac),
+             'strip_vlan,load:0x%x->NXM_NX_TUN_ID[],output:%u' % (i, port)),
+            ('arp,in_port=%u,arp_tpa=10.0.%u.%u,vlan_tci=0x0000/0x0fff'
+             % (port, i >> 8 & 255, i & 255), 'NORMAL'),
+            ('ct_state=+est-rel-rpl,ip,reg5=0x%x' % port, 'output:%u' % port),
+        ][rand.randrange(6)]
+        priority = rand.choice([0, 1, 2, 10, 50, 65, 70, 73, 90, 95])
+        packets = rand.choice([0, 0, 3, 1267, 98231])
+        lines.append(
+            ' cookie=0x%x, duration=%.3fs, table=%u, n_packets=%u, '
+            'n_bytes=%u, idle_age=%u, priority=%u%s actions=%s'
+            % (rand.getrandbits(64), rand.random() * 99999, table, packets,
+               packets * 74, rand.randrange(9999), priority,
+               ',' + match if priority else '', actions))
+    return lines
+
+
+def _num_after(line, field):
+    r = re.search(field + r'\d+', line)
+    if r:
+        return int(r.group(0).replace(field, '').strip())
+    return None
+
+
+def legacy_parse_flow(line, port_map):
+    """
+    The parser before the tokenizer: a regex search for each counter, the
+    line split twice, and a pattern compiled per long match.
+    """
+    line = line.strip()
+    table, packet, priority, match, actions = 0, 0, 0, '', ''
+    if not line.startswith('cookie='):
+        return None
+    table = _num_after(line, 'table=')
+    packet = _num_after(line, 'n_packets=')
+    if table is None or packet is None:
+        return None
+    for field in line.split():
+        if field.startswith('priority='):
+            priority = _num_after(field, 'priority=')
+            match = field.replace('priority=%u' % priority,
+                                  '').lstrip(',').strip() or '*'
+            port_no = _num_after(field, 'in_port=')
+            if port_no and port_map.get(port_no):
+                match = match.replace('in_port=%u' % port_no,
+                                      'in_port=%s' % port_map[port_no])
+        elif field.startswith('actions='):
+            actions = field.replace('actions=', '')
+            for act in actions.split(','):
+                port_no = _num_after(act, 'output:')
+                if port_no and port_map.get(port_no):
+                    actions = actions.replace('output:%u' % port_no,
+                                              'output:%s' % port_map[port_no])
+    if priority is None:
+        match = line.split()[len(line.split()) - 2]
+    if len(match) >= 30:
+        match = re.compile('0x0{1,}').sub('0x', match)
+    return Flow('br-int', table, packet, priority, match, actions)
+
+
+def best_of(func):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.time()
+        func()
+        spent = time.time() - start
+        best = spent if best is None else min(best, spent)
+    return best
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            lines = [l for l in f if 'cookie=' in l]
+    else:
+        lines = gen_lines()
+    stripped = [l.strip() for l in lines]
+    br = Bridge('br-int')
+    br.port_map, br.ports, br.ports_loaded = PORT_MAP, {}, True
+    legacy = best_of(lambda: [legacy_parse_flow(l, PORT_MAP) for l in lines])
+    results = [
+        ('legacy parser', legacy),
+        ('tokenizer only', best_of(lambda: [flow_line_fields(l)
+                                            for l in stripped])),
+        ('Bridge._parse_flow', best_of(lambda: [br._parse_flow(l)
+                                                for l in stripped])),
+        ('load sorted flows', best_of(lambda: list(
+            br.iter_sorted_flows(lines)))),
+    ]
+    print('%u flow lines, best of %u rounds' % (len(lines), ROUNDS))
+    for name, spent in results:
+        print('%-20s %7.3fs %6.1fx' % (name, spent, legacy / spent))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Mock the OpenStack clients, which easyovs.neutron imports, to test the
+# modules using it without OpenStack installed.
+
+__author__ = 'baohua'
+
+import sys
+
+try:
+    from unittest import mock
+except ImportError:  # python 2
+    import mock
+
+MODULES = ('oslo_config', 'oslo_config.cfg', 'keystoneclient',
+           'keystoneclient.v2_0', 'keystoneclient.v2_0.client',
+           'keystoneclient.openstack', 'keystoneclient.openstack.common',
+           'keystoneclient.openstack.common.apiclient',
+           'keystoneclient.openstack.common.apiclient.exceptions',
+           'neutronclient', 'neutronclient.common',
+           'neutronclient.common.exceptions', 'neutronclient.v2_0',
+           'neutronclient.v2_0.client')
+
+
+class ClientError(Exception):
+    pass
+
+
+def mock_openstack():
+    """
+    Put mocks of the OpenStack modules which are not installed into
+    sys.modules, the exceptions are real classes to be caught.
+    """
+    for name in MODULES:
+        try:
+            __import__(name)
+        except ImportError:
+            sys.modules[name] = mock.MagicMock()
+    exceptions = sys.modules['keystoneclient.openstack.common.apiclient.'
+                             'exceptions']
+    if isinstance(exceptions, mock.MagicMock):
+        exceptions.AuthorizationFailure = ClientError
+        exceptions.Unauthorized = ClientError
+    exceptions = sys.modules['neutronclient.common.exceptions']
+    if isinstance(exceptions, mock.MagicMock):
+        exceptions.NeutronClientException = ClientError
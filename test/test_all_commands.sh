@@ -58,6 +58,21 @@ else
     exit -1
 fi
 
+echo_b "##Test: easyovs -m 'addflows br-test-flows -'" | tee -a ${log_file}
+easyovs -m 'addbr br-test-flows' > /dev/null 2>&1
+ovs-vsctl set bridge br-test-flows protocols=OpenFlow10,OpenFlow14
+printf 'priority=6 ip actions=OUTPUT:990\npriority=7 arp actions=OUTPUT:991\n' | \
+    easyovs -m 'addflows br-test-flows -' > /dev/null 2>&1
+if easyovs -m 'dump br-test-flows' | tee -a ${log_file} | grep -i "output:991" > /dev/null 2>&1
+then
+    easyovs -m 'delbr br-test-flows' > /dev/null 2>&1
+    echo_g "Passed" | tee -a ${log_file}
+else
+    easyovs -m 'delbr br-test-flows' > /dev/null 2>&1
+    echo_r "Failed" | tee -a ${log_file}
+    exit -1
+fi
+
 echo_b "##Test: easyovs -m 'delflow br-test 1'" | tee -a ${log_file}
 easyovs -m 'delflow br-test 1' > /dev/null 2>&1
 if easyovs -m 'dump br-test' | tee -a ${log_file} | grep -i "output:989" > /dev/null 2>&1
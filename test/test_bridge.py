@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Test the bridge with a fake ovs-ofctl.
+
+__author__ = 'baohua'
+
+import io
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # python 2
+    import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from easyovs.bridge import Bridge
+from easyovs.flow import Flow
+from easyovs.log import lg
+
+
+SHOW = """OFPT_FEATURES_REPLY (xid=0x2): dpid:00002a7bd4f7bb4b
+n_tables:254, n_buffers:256
+capabilities: FLOW_STATS TABLE_STATS PORT_STATS QUEUE_STATS ARP_MATCH_IP
+actions: output enqueue set_vlan_vid set_vlan_pcp strip_vlan mod_dl_src
+ 1(qvo1): addr:fa:16:3e:00:00:01
+     config:     0
+     state:      0
+     speed: 0 Mbps now, 0 Mbps max
+ 2(patch-tun): addr:aa:bb:cc:dd:ee:02
+     config:     0
+ LOCAL(br-test): addr:2a:7b:d4:f7:bb:4b
+OFPT_GET_CONFIG_REPLY (xid=0x4): frags=normal miss_send_len=0
+"""
+
+DUMP = """NXST_FLOW reply (xid=0x4):
+ cookie=0x0, duration=5.5s, table=0, n_packets=7, n_bytes=420, \
+idle_age=1, priority=3,in_port=1,dl_vlan=1 actions=output:2
+ cookie=0x0, duration=9.1s, table=0, n_packets=0, n_bytes=0, \
+idle_age=9, priority=0 actions=NORMAL
+"""
+
+BRIDGES = {'br-test': {'Controller': [], 'fail_mode': '', 'Port': {
+    'qvo1': {'vlan': '1', 'type': ''},
+    'patch-tun': {'type': 'patch'},
+    'br-test': {'type': 'internal'}}}}
+
+
+class FakeOfctlTest(unittest.TestCase):
+    """
+    Run the bridge with a fake ovs-ofctl in PATH, which records its
+    arguments and the flows of a bundle, and prints the given output.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.tmp_dir + os.pathsep + self.path
+        self.calls = os.path.join(self.tmp_dir, 'calls')
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.tmp_dir)
+
+    def _fake_ofctl(self, err='', outputs=None):
+        """
+        :param err: the error output of every command
+        :param outputs: dict of the command, e.g., show --> its output
+        """
+        for cmd, text in (outputs or {}).items():
+            with open(os.path.join(self.tmp_dir, cmd), 'w') as f:
+                f.write(text)
+        script = os.path.join(self.tmp_dir, 'ovs-ofctl')
+        with open(script, 'w') as f:
+            f.write('#!/bin/sh\necho "$@" >> %(dir)s/calls\n'
+                    '[ "$1" = --bundle ] && cat >> %(dir)s/specs\n'
+                    '[ -f "%(dir)s/$1" ] && cat "%(dir)s/$1"\n'
+                    % {'dir': self.tmp_dir})
+            if err:
+                f.write('echo "%s" >&2\n' % err)
+        os.chmod(script, os.stat(script).st_mode | stat.S_IEXEC)
+
+    def _calls(self):
+        with open(self.calls) as f:
+            return f.read().splitlines()
+
+
+@mock.patch('easyovs.bridge.get_all_bridges', mock.Mock(return_value=BRIDGES))
+class PortMapTest(FakeOfctlTest):
+
+    def test_load_ports(self):
+        self._fake_ofctl(outputs={'show': SHOW})
+        br = Bridge('br-test')
+        ports = br.load_ports()
+        self.assertEqual(ports['qvo1'], {'port': '1', 'vlan': '1',
+                                         'addr': 'fa:16:3e:00:00:01',
+                                         'type': ''})
+        self.assertEqual(ports['br-test']['port'], 'LOCAL')
+        self.assertEqual(br.port_map, {1: 'qvo1', 2: 'patch-tun',
+                                       'LOCAL': 'br-test'})
+        self.assertEqual(br.get_port_map(), br.port_map)
+        self.assertEqual(self._calls(), ['show br-test'])
+
+    def test_show_error(self):
+        self._fake_ofctl(err='ovs-ofctl: br-test is not a bridge')
+        br = Bridge('br-test')
+        self.assertEqual(br.load_ports(), {})
+        self.assertEqual(br.port_map, {})
+        self.assertFalse(br.ports_loaded)
+
+    def test_one_map_per_dump(self):
+        self._fake_ofctl(outputs={'show': SHOW, 'dump-flows': DUMP})
+        br = Bridge('br-test')
+        flows = list(br.iter_flows())
+        self.assertEqual([(f.match, f.actions) for f in flows],
+                         [('in_port=qvo1,dl_vlan=1', 'output:patch-tun'),
+                          ('*', 'NORMAL')])
+        self.assertEqual(flows[0].raw_match, 'in_port=1,dl_vlan=1')
+        self.assertEqual(self._calls(), ['show br-test',
+                                         'dump-flows br-test'])
+        list(br.iter_flows())  # the map is loaded again for a new dump
+        self.assertEqual(self._calls()[2:], ['show br-test',
+                                             'dump-flows br-test'])
+
+
+class FlowDumpTest(unittest.TestCase):
+
+    def setUp(self):
+        self.br = Bridge('br-test')
+        self.br.port_map, self.br.ports, self.br.ports_loaded = \
+            {1: 'qvo1'}, {}, True
+        self.read = 0
+
+    def _lines(self, tables):
+        """
+        Yield one flow line of priority i for each table of the list, and
+        count the lines read.
+        """
+        yield 'NXST_FLOW reply (xid=0x4):\n'
+        for i, table in enumerate(tables):
+            self.read += 1
+            yield (' cookie=0x0, duration=1.0s, table=%u, n_packets=%u, '
+                   'n_bytes=0, priority=%u,in_port=1 actions=drop\n'
+                   % (table, i % 2, i))
+
+    def test_iter_flows(self):
+        db = io.StringIO()
+        lines = list(self._lines([0, 1])) + ['cookie=0xZZ, bad line\n']
+        flows = list(self.br.iter_flows(lines, db))
+        self.assertEqual([(f.table, f.priority, f.match) for f in flows],
+                         [(0, 0, 'in_port=qvo1'), (1, 1, 'in_port=qvo1')])
+        self.assertEqual(db.getvalue(),
+                         ''.join(l.strip() + '\n' for l in lines[1:3]))
+
+    def test_sorted_per_table(self):
+        flows = self.br.iter_sorted_flows(self._lines([0, 0, 0, 5, 5, 1]))
+        first = next(flows)
+        self.assertEqual((first.table, first.priority, first.id), (0, 2, 0))
+        self.assertEqual(self.read, 4)  # only the first table is buffered
+        self.assertEqual([(f.table, f.priority, f.id) for f in flows],
+                         [(0, 1, 1), (0, 0, 2), (5, 4, 3), (5, 3, 4),
+                          (1, 5, 5)])
+
+
+class BundleTest(FakeOfctlTest):
+
+    def test_bundle(self):
+        self._fake_ofctl('')
+        err = Bridge('br-test')._bundle(['add-flows'], 'priority=1 '
+                                        'actions=drop\n')
+        self.assertFalse(err.strip())
+        self.assertEqual(self._calls(), ['--bundle add-flows br-test -'])
+
+    def test_no_bundle_support(self):
+        self._fake_ofctl('ovs-ofctl: version negotiation failed')
+        err = Bridge('br-test')._bundle(['--strict', 'del-flows'],
+                                        'table=0,priority=1\n')
+        self.assertIn('Bundles are not supported', err)
+        self.assertEqual(self._calls(),
+                         ['--bundle --strict del-flows br-test -'])
+
+    def _specs(self):
+        with open(os.path.join(self.tmp_dir, 'specs')) as f:
+            return f.read()
+
+    @mock.patch.object(Bridge, 'exists', mock.Mock(return_value=True))
+    def test_del_flows(self):
+        self._fake_ofctl()
+        br = Bridge('br-test')
+        br.flows = [Flow('br-test', 0, 0, 2, 'in_port=qvo1', 'drop',
+                         raw_match='in_port=1'),
+                    Flow('br-test', 1, 0, 0, '*', 'NORMAL')]
+        self.assertTrue(br.del_flows(br.flows))
+        self.assertEqual(self._specs(), 'table=0,priority=2,in_port=1\n'
+                                        'table=1,priority=0\n')
+        self.assertEqual(self._calls(),
+                         ['--bundle --strict del-flows br-test -'])
+        self.assertEqual(br.flows, [])
+        self.assertFalse(br.del_flows([]))
+
+    @mock.patch.object(Bridge, 'exists', mock.Mock(return_value=True))
+    @mock.patch('easyovs.bridge.get_all_bridges', mock.Mock(return_value={}))
+    def test_del_flow_ids(self):
+        self._fake_ofctl(outputs={'show': SHOW, 'dump-flows': DUMP})
+        self.assertTrue(Bridge('br-test').del_flow(['1', '0', '9', 'x'],
+                                                   forced=True))
+        self.assertEqual(self._specs(), 'table=0,priority=0\n'
+                                        'table=0,priority=3,'
+                                        'in_port=1,dl_vlan=1\n')
+        self.assertEqual(self._calls()[-1],
+                         '--bundle --strict del-flows br-test -')
+
+    @mock.patch.object(Bridge, 'exists', mock.Mock(return_value=True))
+    def test_add_flows_error(self):
+        self._fake_ofctl('ovs-ofctl: -:2: unknown action foo')
+        stream = lg.handlers[0].stream
+        lg.handlers[0].stream = out = io.StringIO()
+        try:
+            self.assertFalse(Bridge('br-test').add_flows(
+                ['priority=1 actions=drop', 'priority=2 actions=foo']))
+        finally:
+            lg.handlers[0].stream = stream
+        self.assertEqual(self._specs(), 'priority=1 actions=drop\n'
+                                        'priority=2 actions=foo\n')
+        self.assertIn('Error when adding 2 flows to bridge br-test',
+                      out.getvalue())
+        self.assertIn('unknown action foo', out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
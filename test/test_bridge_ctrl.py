@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Test the bridge commands on saved flows and a fake ovs-vsctl.
+
+__author__ = 'baohua'
+
+import io
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mock_openstack import mock, mock_openstack
+mock_openstack()
+
+from easyovs.bridge import Bridge
+from easyovs.bridge_ctrl import _br_transact, _output_ports, _port_ids, \
+    br_addbrs, br_delbrs, br_diff_flows, br_dump_all, br_lint_flows, \
+    br_show
+from easyovs.flow import Flow
+from easyovs.log import lg
+from easyovs.render import set_format
+from easyovs.snapshot import write_snapshot
+
+
+class OutputTest(unittest.TestCase):
+    """
+    Capture the output, and remove the files under tmp_dir.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.stream = lg.handlers[0].stream
+        lg.handlers[0].stream = self.out = io.StringIO()
+
+    def tearDown(self):
+        lg.handlers[0].stream = self.stream
+        shutil.rmtree(self.tmp_dir)
+
+
+class DiffFlowsTest(OutputTest):
+
+    def _snapshot(self, name, port, port_map):
+        path = os.path.join(self.tmp_dir, name)
+        write_snapshot(path, 'br-int', [
+            Flow('br-int', 0, 0, 1, 'in_port=qvo1', 'NORMAL',
+                 raw_match='in_port=%u' % port, raw_actions='NORMAL')],
+            port_map)
+        return path
+
+    def _dump(self, name, port):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as f:
+            f.write(' cookie=0x0, duration=1.0s, table=0, n_packets=0, '
+                    'n_bytes=0, priority=1,in_port=%u actions=NORMAL\n'
+                    % port)
+        return path
+
+    def test_by_names(self):
+        # the same port of two nodes, with different numbers
+        self.assertTrue(br_diff_flows(self._snapshot('a', 1, {1: 'qvo1'}),
+                                      self._snapshot('b', 5, {5: 'qvo1'})))
+        self.assertIn('0 added, 0 removed, 0 changed', self.out.getvalue())
+
+    def test_by_numbers(self):
+        # a dump has no port map, so the numbers are compared
+        snapshot = self._snapshot('a', 1, {1: 'qvo1'})
+        self.assertTrue(br_diff_flows(snapshot, self._dump('b', 1)))
+        self.assertFalse(br_diff_flows(snapshot, self._dump('c', 5)))
+        lines = self.out.getvalue().splitlines()
+        self.assertIn('- table=0,priority=1,in_port=qvo1 actions=NORMAL',
+                      lines)
+        self.assertIn('+ table=0,priority=1,in_port=5 actions=NORMAL',
+                      lines)
+
+
+class LintFlowsTest(OutputTest):
+
+    def test_lint_dump(self):
+        path = os.path.join(self.tmp_dir, 'dump')
+        with open(path, 'w') as f:
+            for match in ('priority=3,dl_vlan=abc', 'priority=2,ip',
+                          'priority=1,ip,nw_dst=10.0.0.3'):
+                f.write(' cookie=0x0, duration=1.0s, table=0, '
+                        'n_packets=1, n_bytes=0, %s actions=drop\n' % match)
+        br_lint_flows(path)
+        lines = self.out.getvalue().splitlines()
+        self.assertIn('Skip the flow not parsed', lines[0])
+        self.assertIn('dl_vlan=abc', lines[0])
+        self.assertEqual(lines[-1], '3 flows: 0 shadowed, 1 duplicate, '
+                                    '0 without hit in 3600s')
+
+
+class DumpAllTest(OutputTest):
+
+    @mock.patch('easyovs.bridge_ctrl.get_all_bridges',
+                mock.Mock(return_value={'br-tun': {}, 'br-ex': {},
+                                        'br-int': {}}))
+    def test_dump_all(self):
+        def load_flows(br):
+            if br.bridge == 'br-ex':
+                raise OSError('ovs-ofctl is gone')
+            br.flows = [Flow(br.bridge, 0, 0, 1, 'ip', 'drop')] \
+                if br.bridge == 'br-int' else []
+
+        with mock.patch.object(Bridge, 'load_flows', load_flows):
+            br_dump_all()
+        lines = [l for l in self.out.getvalue().splitlines() if l]
+        self.assertIn('br-ex', lines[0])
+        self.assertIn('Failed to dump flows of br-ex: ovs-ofctl is gone',
+                      lines[1])
+        self.assertIn('br-int', lines[2])
+        self.assertEqual(lines[4].split(), ['0', '0', '0', '1', 'ip',
+                                            'drop'])
+        self.assertIn('br-tun', lines[5])
+        self.assertIn('No flow.', lines[6])
+
+
+OVS_PORTS = {
+    'qvo5d4a9b3c-1c': {'port': '2', 'vlan': '1', 'type': ''},
+    'qvo7e1f2a3b-4d': {'port': '3', 'vlan': '1', 'type': ''},
+    'patch-tun': {'port': '1', 'vlan': '', 'type': 'patch'},
+}
+
+INTF_IDS = {
+    'qvo5d4a9b3c-1c': {'iface-id': '5d4a9b3c-1c00-4f5e-8d4c-a1b2c3d4e5f6',
+                       'attached-mac': 'fa:16:3e:00:00:01',
+                       'vm-uuid': 'a3b5c7d9-0000-4000-8000-000000000001'},
+    'qvo7e1f2a3b-4d': {'iface-id': '7e1f2a3b-4d00-4f5e-8d4c-a1b2c3d4e5f6',
+                       'attached-mac': 'fa:16:3e:00:00:02'},
+    'tap0a0b0c0d-0e': {'iface-id': '0a0b0c0d-0e00-4f5e-8d4c-a1b2c3d4e5f6'},
+}
+
+NEUTRON_PORTS = {
+    '5d4a9b3c-1c00-4f5e-8d4c-a1b2c3d4e5f6': {
+        'fixed_ips': [{'ip_address': '10.0.0.3'},
+                      {'ip_address': '10.0.1.3'}]},
+}
+
+
+class OutputPortsTest(OutputTest):
+
+    def tearDown(self):
+        set_format('text')
+        OutputTest.tearDown(self)
+
+    def test_port_ids(self):
+        self.assertEqual(_port_ids([OVS_PORTS, {'tap0a0b0c0d-0e': {}}],
+                                   INTF_IDS),
+                         set(v['iface-id'] for v in INTF_IDS.values()))
+
+    def test_text(self):
+        _output_ports('br-int', OVS_PORTS, INTF_IDS, {
+            INTF_IDS['qvo5d4a9b3c-1c']['iface-id']: {
+                'fixed_ips': [{'ip_address': '10.0.0.3'}]}})
+        rows = [l.split() for l in self.out.getvalue().splitlines()]
+        self.assertEqual(rows[0], ['Intf', 'Port', 'Vlan', 'Type', 'vmIP',
+                                   'vmMAC'])
+        self.assertEqual(rows[1:], [
+            ['qvo7e1f2a3b-4d', '3', '1', 'fa:16:3e:00:00:02'],
+            ['qvo5d4a9b3c-1c', '2', '1', '10.0.0.3', 'fa:16:3e:00:00:01'],
+            ['patch-tun', '1', 'patch']])
+
+    def test_no_vm(self):
+        _output_ports('br-int', {'patch-tun': OVS_PORTS['patch-tun']},
+                      INTF_IDS, {})
+        rows = [l.split() for l in self.out.getvalue().splitlines()]
+        self.assertEqual(rows, [['Intf', 'Port', 'Vlan', 'Type'],
+                                ['patch-tun', '1', 'patch']])
+
+    def test_json(self):
+        set_format('ndjson')
+        sys.stdout, stdout = io.StringIO(), sys.stdout
+        try:
+            _output_ports('br-int', OVS_PORTS, INTF_IDS, NEUTRON_PORTS)
+            records = [json.loads(l)
+                       for l in sys.stdout.getvalue().splitlines()]
+        finally:
+            sys.stdout = stdout
+        port = [r for r in records if r['port'] == '2'][0]
+        self.assertEqual(port['vm_ips'], ['10.0.0.3', '10.0.1.3'])
+        self.assertEqual(port['port_id'],
+                         '5d4a9b3c-1c00-4f5e-8d4c-a1b2c3d4e5f6')
+        self.assertEqual(port['vm_uuid'],
+                         'a3b5c7d9-0000-4000-8000-000000000001')
+        port = [r for r in records if r['port'] == '1'][0]
+        self.assertEqual((port['vm_ips'], port['port_id']), ([], ''))
+
+    @mock.patch('easyovs.bridge_ctrl.get_all_interfaces',
+                mock.Mock(return_value=INTF_IDS))
+    @mock.patch.object(Bridge, 'get_ports',
+                       mock.Mock(return_value=OVS_PORTS))
+    @mock.patch('easyovs.bridge_ctrl.neutron_handler')
+    def test_show(self, handler):
+        handler.get_ports_by_ids.return_value = NEUTRON_PORTS
+        br_show('br-int')
+        handler.get_ports_by_ids.assert_called_once_with(
+            set([INTF_IDS['qvo5d4a9b3c-1c']['iface-id'],
+                 INTF_IDS['qvo7e1f2a3b-4d']['iface-id']]))
+        self.assertIn('10.0.0.3,10.0.1.3', self.out.getvalue())
+
+
+@mock.patch('easyovs.bridge_ctrl.get_all_bridges',
+            mock.Mock(return_value={'br-int': {}}))
+class BridgeTransactTest(OutputTest):
+
+    def setUp(self):
+        OutputTest.setUp(self)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.tmp_dir + os.pathsep + self.path
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        OutputTest.tearDown(self)
+
+    def _fake_vsctl(self, err=''):
+        script = os.path.join(self.tmp_dir, 'ovs-vsctl')
+        with open(script, 'w') as f:
+            f.write('#!/bin/sh\necho "$@" >> %s/calls\n' % self.tmp_dir)
+            if err:
+                f.write('echo "%s" >&2\nexit 1\n' % err)
+        os.chmod(script, os.stat(script).st_mode | stat.S_IEXEC)
+
+    def _calls(self):
+        with open(os.path.join(self.tmp_dir, 'calls')) as f:
+            return f.read().splitlines()
+
+    def test_addbrs(self):
+        self._fake_vsctl()
+        self.assertTrue(br_addbrs(['br-int', 'br-a', 'br-int', 'br-b']))
+        self.assertEqual(self._calls(), [
+            '-- --may-exist add-br br-int -- --may-exist add-br br-a '
+            '-- --may-exist add-br br-b'])
+        self.assertEqual(self.out.getvalue().splitlines(),
+                         ['bridge br-int already exists',
+                          'bridge br-a was created',
+                          'bridge br-b was created'])
+
+    def test_delbrs(self):
+        self._fake_vsctl()
+        self.assertTrue(br_delbrs(['br-int', 'br-a']))
+        self.assertEqual(self._calls(), [
+            '-- --if-exists del-br br-int -- --if-exists del-br br-a'])
+        self.assertEqual(self.out.getvalue().splitlines(),
+                         ['bridge br-int was deleted',
+                          'bridge br-a does not exist'])
+
+    def test_failed(self):
+        err = 'ovs-vsctl: br a is not a valid bridge name'
+        self._fake_vsctl(err)
+        self.assertEqual(_br_transact(['br-a', 'br a'], ['add-br']), err)
+        self.assertFalse(br_addbrs(['br-a', 'br a']))
+        self.assertFalse(br_delbrs(['br-int', 'br a']))
+        self.assertEqual(len(self._calls()), 3)  # never run bridge by bridge
+        lines = self.out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Error when adding new bridge br-a, br a, none is '
+                      'added: %s' % err, lines[0])
+        self.assertIn('Error when deleting bridge br-int, br a, none is '
+                      'deleted: %s' % err, lines[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Test the flows, their order and the comparison of them.
+
+__author__ = 'baohua'
+
+import itertools
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from easyovs.flow import Flow, diff_flows, flow_sort_key, \
+    sort_flows_per_table
+
+
+class FlowSortTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flows = [Flow('br-int', table, packet, priority, 'ip', 'drop')
+                      for table, priority, packet in itertools.product(
+                          (0, 1, 254), (0, 1, 65535), (0, 9))]
+
+    def test_sort_key(self):
+        flows = sorted(self.flows, key=flow_sort_key)
+        self.assertEqual([(f.table, f.priority, f.packet)
+                          for f in flows[:4]],
+                         [(0, 65535, 9), (0, 65535, 0), (0, 1, 9),
+                          (0, 1, 0)])
+        self.assertEqual((flows[-1].table, flows[-1].priority,
+                          flows[-1].packet), (254, 0, 0))
+        for a, b in zip(flows, flows[1:]):  # the same order as __gt__
+            self.assertTrue(a > b)
+            self.assertFalse(b > a)
+
+    def test_sort_per_table(self):
+        flows = list(reversed(self.flows))
+        result = list(sort_flows_per_table(iter(flows)))
+        self.assertEqual([f.table for f in result],
+                         [254] * 6 + [1] * 6 + [0] * 6)
+        self.assertEqual([(f.priority, f.packet) for f in result[:6]],
+                         [(65535, 9), (65535, 0), (1, 9), (1, 0), (0, 9),
+                          (0, 0)])
+        self.assertEqual(list(sort_flows_per_table([])), [])
+
+    def test_slots(self):
+        flow = self.flows[0]
+        self.assertFalse(hasattr(flow, '__dict__'))
+        self.assertRaises(AttributeError, setattr, flow, 'port', 1)
+
+
+class DiffFlowsTest(unittest.TestCase):
+
+    def test_diff(self):
+        old = [Flow('br-int', 0, 3, 1, 'ip', 'drop'),
+               Flow('br-int', 0, 0, 1, 'ip', 'drop'),
+               Flow('br-int', 0, 0, 2, 'arp', 'NORMAL'),
+               Flow('br-int', 1, 0, 0, '*', 'drop')]
+        new = [Flow('br-int', 0, 3, 1, 'ip', 'drop'),
+               Flow('br-int', 0, 0, 2, 'arp', 'drop'),
+               Flow('br-int', 1, 8, 0, '*', 'drop', n_bytes=640),
+               Flow('br-int', 2, 0, 0, '*', 'drop')]
+        added, removed, changed, counters = diff_flows(old, new)
+        self.assertEqual(added, [new[3]])
+        self.assertEqual(len(removed), 1)  # only one of the same flows
+        self.assertIs(removed[0], old[1])
+        self.assertEqual([(a.actions, b.actions) for a, b in changed],
+                         [('NORMAL', 'drop')])
+        self.assertEqual([(a.packet, b.packet) for a, b in counters],
+                         [(0, 8)])
+        self.assertEqual([len(x) for x in diff_flows(new, new)],
+                         [0, 0, 0, 0])
+
+    def test_diff_raw(self):
+        old = [Flow('br-int', 0, 0, 1, 'in_port=qvo1', 'output:qvo2',
+                    raw_match='in_port=1', raw_actions='output:2')]
+        new = [Flow('br-int', 0, 0, 1, 'in_port=qvo1', 'output:qvo2',
+                    raw_match='in_port=5', raw_actions='output:6'),
+               Flow('br-int', 0, 0, 1, 'in_port=1', 'output:3',
+                    raw_match='in_port=1', raw_actions='output:3')]
+        added, removed, changed, _ = diff_flows(old, new)
+        self.assertEqual((added, removed, changed), ([new[1]], [], []))
+        added, removed, changed, _ = diff_flows(old, new, raw=True)
+        self.assertEqual(added, [new[0]])
+        self.assertEqual(removed, [])
+        self.assertEqual([(a.raw_actions, b.raw_actions)
+                          for a, b in changed], [('output:2', 'output:3')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Test the predicate queries over the indexes of flows.
+
+__author__ = 'baohua'
+
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from easyovs.bridge import Bridge
+from easyovs.flow import Flow
+from easyovs.flow_index import FlowIndex, parse_query
+from easyovs.log import lg
+
+FLOWS = [
+    Flow('br-int', 0, 7, 3, 'in_port=qvo1,dl_vlan=1', 'output:patch-tun',
+         0, 0x1a, 420, 5.5, 0, 0, 'in_port=1,dl_vlan=1', 'output:2'),
+    Flow('br-int', 0, 0, 2, 'in_port=qvo12,dl_vlan=12',
+         'mod_vlan_vid:5,NORMAL', 1, 0x1b, 0, 1.0, 0, 0,
+         'in_port=3,dl_vlan=12', 'mod_vlan_vid:5,NORMAL'),
+    Flow('br-int', 0, 100, 0, '*', 'drop', 2, 0, 7400, 2.0, 0, 0, '',
+         'drop'),
+    Flow('br-int', 23, 1, 1, 'ip', 'resubmit(,24)', 3, 0x1a, 74, 3.0,
+         0, 0, 'ip', 'resubmit(,24)'),
+]
+
+
+class ParseQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = lg.handlers[0].stream
+        lg.handlers[0].stream = self.out = io.StringIO()
+
+    def tearDown(self):
+        lg.handlers[0].stream = self.stream
+
+    def test_valid(self):
+        self.assertEqual(parse_query(['in_port=qvo1*,priority>=0x10', 'ip',
+                                      'packets<010', 'dl_vlan!=1']),
+                         [('in_port', '=', 'qvo1*'), ('priority', '>=', 16),
+                          ('ip', '=', ''), ('packets', '<', 10),
+                          ('dl_vlan', '!=', '1')])
+        self.assertEqual(parse_query([]), [])
+
+    def test_invalid(self):
+        for query in (['priority>=abc'], ['dl_vlan>1'], ['cookie=0xzz']):
+            self.assertIsNone(parse_query(query))
+        lines = self.out.getvalue().splitlines()
+        self.assertIn('Invalid number in priority>=abc', lines[0])
+        self.assertIn('dl_vlan only supports = and !=', lines[1])
+        self.assertIn('Invalid cookie in cookie=0xzz', lines[2])
+
+
+class FlowIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = FlowIndex(FLOWS)
+
+    def _find(self, *args):
+        return [f.id for f in self.index.find(parse_query(args))]
+
+    def test_equal(self):
+        self.assertEqual(self._find('in_port=qvo1'), [0])
+        self.assertEqual(self._find('in_port=3'), [1])
+        self.assertEqual(self._find('dl_vlan=12'), [1])
+        self.assertEqual(self._find('ip'), [3])
+        self.assertEqual(self._find('table=23'), [3])
+        self.assertEqual(self._find('in_port=qvo2'), [])
+
+    def test_prefix(self):
+        self.assertEqual(self._find('in_port=qvo1*'), [0, 1])
+        self.assertEqual(self._find('in_port=qvo1*', 'dl_vlan=12'), [1])
+        self.assertEqual(self._find('cookie=0x1*'), [0, 1, 3])
+
+    def test_range(self):
+        self.assertEqual(self._find('priority>=2'), [0, 1])
+        self.assertEqual(self._find('priority>2'), [0])
+        self.assertEqual(self._find('priority<1'), [2])
+        self.assertEqual(self._find('priority<=1'), [2, 3])
+        self.assertEqual(self._find('packets>0', 'bytes<1000'), [0, 3])
+        self.assertEqual(self._find('priority!=0'), [0, 1, 3])
+
+    def test_not_equal(self):
+        self.assertEqual(self._find('dl_vlan!=1'), [1, 2, 3])
+        self.assertEqual(self._find('table!=0'), [3])
+
+    def test_actions(self):
+        self.assertEqual(self._find('output=patch-tun'), [0])
+        self.assertEqual(self._find('output=2'), [0])
+        self.assertEqual(self._find('action=NORMAL'), [1])
+        self.assertEqual(self._find('action=mod_vlan_vid'), [1])
+        self.assertEqual(self._find('action=resubmit'), [3])
+        self.assertEqual(self._find('action=drop'), [2])
+
+    def test_cookie(self):
+        self.assertEqual(self._find('cookie=0x1a'), [0, 3])
+        self.assertEqual(self._find('cookie=1A'), [0, 3])
+        self.assertEqual(self._find('cookie=0x01b'), [1])
+
+    def test_all(self):
+        self.assertEqual(self._find(), [0, 1, 2, 3])
+
+
+class BridgeFindTest(unittest.TestCase):
+
+    def test_index_kept_until_reload(self):
+        br = Bridge('br-int')
+        br.flows = list(FLOWS)
+        query = parse_query(['in_port=qvo1*'])
+        self.assertEqual(len(br.find_flows(query)), 2)
+        index = br.flow_index
+        self.assertEqual(len(br.find_flows(parse_query(['ip']))), 1)
+        self.assertIs(br.flow_index, index)
+        br.flows = FLOWS[2:]
+        self.assertEqual(br.find_flows(query), [])
+        self.assertIsNot(br.flow_index, index)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Test finding the shadowed, duplicate and idle flows.
+
+__author__ = 'baohua'
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from easyovs.flow import Flow
+from easyovs.flow_lint import lint_flows
+
+
+def flow(table, priority, match, actions, packet=0, duration=0.0):
+    return Flow('br-int', table, packet, priority, match, actions,
+                duration=duration, raw_match=match, raw_actions=actions)
+
+
+class LintFlowsTest(unittest.TestCase):
+
+    def _lint(self, flows, **kwargs):
+        result = lint_flows(flows, **kwargs)
+        return dict((k, [(flows.index(f), flows.index(by))
+                         for f, by in result[k]])
+                    for k in ('shadowed', 'duplicate'))
+
+    def test_shadowed(self):
+        flows = [flow(0, 10, 'ip,nw_dst=10.0.0.0/24', 'drop'),
+                 flow(0, 5, 'ip,nw_dst=10.0.0.3', 'NORMAL'),
+                 flow(0, 5, 'ip,nw_dst=10.0.1.3', 'NORMAL'),
+                 flow(0, 20, 'tcp,nw_dst=10.0.0.3', 'NORMAL'),
+                 flow(1, 1, 'ip,nw_dst=10.0.0.3', 'NORMAL')]
+        self.assertEqual(self._lint(flows),
+                         {'shadowed': [(1, 0)], 'duplicate': []})
+
+    def test_duplicate(self):
+        flows = [flow(0, 1, 'in_port=1,dl_vlan=5', 'output:2'),
+                 flow(0, 3, 'in_port=1', 'output:2'),
+                 flow(0, 2, 'in_port=1', 'output:3'),
+                 flow(0, 3, 'in_port=2', 'output:2')]
+        self.assertEqual(self._lint(flows),
+                         {'shadowed': [(2, 1)], 'duplicate': [(0, 1)]})
+
+    def test_same_priority(self):
+        flows = [flow(0, 1, 'ip', 'drop'), flow(0, 1, 'ip,nw_src=10.0.0.1',
+                                                'NORMAL')]
+        self.assertEqual(self._lint(flows),
+                         {'shadowed': [], 'duplicate': []})
+
+    def test_port_names(self):
+        flows = [flow(0, 2, 'in_port=qvo1', 'drop'),
+                 flow(0, 1, 'in_port=1,ip', 'NORMAL')]
+        self.assertEqual(self._lint(flows, port_numbers={'qvo1': 1}),
+                         {'shadowed': [(1, 0)], 'duplicate': []})
+
+    def test_idle(self):
+        flows = [flow(0, 1, 'ip', 'drop', duration=7200),
+                 flow(0, 1, 'arp', 'drop', packet=3, duration=7200),
+                 flow(0, 1, 'ipv6', 'drop', duration=60)]
+        self.assertEqual(lint_flows(flows)['idle'], [flows[0]])
+        self.assertEqual(lint_flows(flows, min_duration=30)['idle'],
+                         [flows[0], flows[2]])
+
+    def test_skipped(self):
+        flows = [flow(0, 2, 'dl_vlan=abc', 'drop'),
+                 flow(0, 1, 'ip', 'drop')]
+        result = lint_flows(flows)
+        self.assertEqual([f for f, e in result['skipped']], [flows[0]])
+        self.assertIsInstance(result['skipped'][0][1], ValueError)
+        self.assertEqual(result['shadowed'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Test the iptables model on the rules of iptables-save.
+
+__author__ = 'baohua'
+
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mock_openstack import mock, mock_openstack
+mock_openstack()
+
+from easyovs.iptables import IPchain, IPtable, IPtables
+from easyovs.log import lg
+from easyovs.render import end_records, set_format
+
+RULES = [
+    '[7:420] -A neutron-openvswi-i5d4a9b3c-1 -m state '
+    '--state RELATED,ESTABLISHED -j RETURN',
+    '[0:0] -A neutron-openvswi-i5d4a9b3c-1 -s 10.0.0.0/24 -j RETURN',
+    '[0:0] -A neutron-openvswi-i5d4a9b3c-1 -j neutron-openvswi-sg-fallback',
+]
+
+
+class IPtablesShowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = IPchain('neutron-openvswi-i5d4a9b3c-1', '-',
+                             RULES).get_rules()
+        self.stdout, self.stream = sys.stdout, lg.handlers[0].stream
+
+    def tearDown(self):
+        set_format('text')
+        sys.stdout, lg.handlers[0].stream = self.stdout, self.stream
+
+    def test_show_vm_rules_text(self):
+        lg.handlers[0].stream = out = io.StringIO()
+        IPtables()._fmt_show_rules(self.rules, '10.0.0.3', 'qvo5d4a9b3c-1',
+                                   'IN')
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1].split()[:3], ['0', '*', '10.0.0.0/24'])
+
+    def test_show_vm_rules_json(self):
+        set_format('json')
+        sys.stdout = out = io.StringIO()
+        IPtables()._fmt_show_rules(self.rules, '10.0.0.3', 'qvo5d4a9b3c-1',
+                                   'IN')
+        end_records(out)
+        records = json.loads(out.getvalue())
+        self.assertEqual([r['record'] for r in records], ['vm_rule'] * 3)
+        self.assertEqual(records[0]['rule_kind'], 'IN')
+        self.assertEqual(records[0]['pkts'], '7')
+        self.assertEqual(records[2]['target'],
+                         'neutron-openvswi-sg-fallback')
+
+
+class IPtablesVMTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = lg.handlers[0].stream
+        lg.handlers[0].stream = self.out = io.StringIO()
+
+    def tearDown(self):
+        lg.handlers[0].stream = self.stream
+
+    @mock.patch('easyovs.iptables.get_port_index', mock.Mock())
+    @mock.patch('easyovs.iptables.find_br_ports')
+    @mock.patch('easyovs.iptables.get_port_ids_from_ips')
+    def test_vm_ports_in_order(self, get_port_ids, find_br_ports):
+        get_port_ids.return_value = [
+            ('10.0.0.9', 'b1'), ('10.0.0.3', 'a5'), ('10.0.0.7', None),
+            ('10.0.0.8', 'b1'), ('10.0.0.4', 'c3')]
+        find_br_ports.side_effect = \
+            lambda port_id, index: {'a5': 'qvoa5', 'b1': 'qvob1'}.get(port_id)
+        tables = IPtables()
+        tables._query_port_rules = mock.Mock(return_value={})
+        tables.vm(['10.0.0.9', '10.0.0.3', '10.0.0.7', '10.0.0.8',
+                   '10.0.0.4'])
+        lines = [l for l in self.out.getvalue().splitlines() if l]
+        self.assertIn('No port id is found for ip=10.0.0.7', lines[0])
+        self.assertIn('No br port is found for ip=10.0.0.4', lines[1])
+        self.assertIn('IP = 10.0.0.9, 10.0.0.8, port = qvob1', lines[2])
+        self.assertIn('IP = 10.0.0.3, port = qvoa5', lines[3])
+        self.assertIn('2 ports found, 2 ips without port', lines[4])
+        self.assertEqual(
+            [c[0][0] for c in tables._query_port_rules.call_args_list],
+            ['qvob1', 'qvoa5'])
+
+
+class IPchainIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = IPchain('neutron-l3-agent-float-snat', '-', [
+            '-A neutron-l3-agent-float-snat -s 10.0.0.3/32 -j SNAT '
+            '--to-source 172.24.4.3',
+            '-A neutron-l3-agent-float-snat -s 10.0.0.3/32 -j SNAT '
+            '--to-source 172.24.4.4',
+            '-A neutron-l3-agent-float-snat -j SNAT --to-source 172.24.4.9',
+        ])
+
+    def test_first_match_in_order(self):
+        rule = self.chain.get_rule({'target': 'SNAT',
+                                    'source': '10.0.0.3'})
+        self.assertEqual(rule.num, 1)
+        rule = self.chain.get_rule({'target': 'SNAT', 'source': '10.0.0.3',
+                                    'to-source': '172.24.4.4'})
+        self.assertEqual(rule.num, 2)
+        self.assertIn(('target', 'source'), self.chain.indexes)
+
+    def test_same_bucket(self):
+        for a, b in (('10.0.0.3', '10.0.0.3/32'), ('*', '0.0.0.0/0')):
+            self.assertIs(
+                self.chain.get_rule({'target': 'SNAT', 'source': a}),
+                self.chain.get_rule({'target': 'SNAT', 'source': b}))
+        self.assertEqual(self.chain.get_rule({'target': 'SNAT',
+                                              'source': '*'}).num, 3)
+        self.assertFalse(self.chain.has_rule({'target': 'SNAT',
+                                              'source': '10.0.0.4'}))
+
+    def test_add_rules(self):
+        query = {'target': 'SNAT', 'source': '10.0.0.5'}
+        self.assertIsNone(self.chain.get_rule(query))
+        self.chain.add_rules(['-A neutron-l3-agent-float-snat '
+                              '-s 10.0.0.5 -j SNAT --to-source 172.24.4.5'])
+        self.assertEqual(self.chain.indexes, {})
+        self.assertEqual(self.chain.get_rule(query).num, 4)
+
+
+class IPtableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = IPtable('filter', saved=(
+            [('INPUT', 'ACCEPT'), ('neutron-openvswi-i5d4a9b3c-1', '-')],
+            {'neutron-openvswi-i5d4a9b3c-1': list(RULES)}))
+
+    def test_get_chain(self):
+        chain = self.table.get_chain('neutron-openvswi-i5d4a9b3c-1')
+        self.assertEqual(len(chain.get_rules()), 3)
+        self.assertIs(self.table.get_chain('neutron-openvswi-i5d4a9b3c-1'),
+                      chain)
+        self.assertEqual(self.table.get_chain('INPUT').policy, 'ACCEPT')
+        self.assertEqual(self.table.get_chain('INPUT').get_rules(), [])
+
+    def test_get_missing_chain(self):
+        self.assertIsNone(self.table.get_chain('FORWARD'))
+        self.assertIn('FORWARD', self.table.chains)
+        self.assertIsNone(self.table.get_chain('FORWARD'))
+
+
+class IPtablesTraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = lg.handlers[0].stream
+        lg.handlers[0].stream = self.out = io.StringIO()
+        self.paths = []
+
+    def tearDown(self):
+        lg.handlers[0].stream = self.stream
+        for path in self.paths:
+            os.remove(path)
+
+    def _save(self, text):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        self.paths.append(path)
+        return path
+
+    def test_trace_not_saved(self):
+        path = self._save('not the output of iptables-save\n')
+        IPtables().trace(['tcp dst=10.0.0.3'], path=path)
+        self.assertIn('No iptables rule is loaded', self.out.getvalue())
+        self.assertNotIn('Verdict', self.out.getvalue())
+
+    def test_trace_batch_approx(self):
+        path = self._save('*filter\n:FORWARD ACCEPT [0:0]\n'
+                          '-A FORWARD -m set --match-set NIPv4abc src '
+                          '-j RETURN\n-A FORWARD -s 10.0.0.5 -j DROP\n'
+                          'COMMIT\n')
+        IPtables().trace(['tcp src=10.0.0.5', 'tcp src=10.0.0.6'],
+                         path=path)
+        lines = self.out.getvalue().splitlines()
+        self.assertEqual([l.split()[-2:] for l in lines],
+                         [['DROP', '(approx)'], ['ACCEPT', '(approx)']])
+
+
+if __name__ == '__main__':
+    unittest.main()
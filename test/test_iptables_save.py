@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Test parsing the output of iptables-save.
+
+__author__ = 'baohua'
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from easyovs.iptables_save import match_rule, parse_rule, split_tables
+
+SAVED = """# Generated by iptables-save v1.4.21
+*nat
+:PREROUTING ACCEPT [12:720]
+:INPUT ACCEPT [0:0]
+:OUTPUT ACCEPT [3:180]
+:POSTROUTING ACCEPT [3:180]
+:neutron-l3-agent-PREROUTING - [0:0]
+:neutron-l3-agent-float-snat - [0:0]
+[12:720] -A PREROUTING -j neutron-l3-agent-PREROUTING
+[0:0] -A neutron-l3-agent-PREROUTING -d 169.254.169.254/32 -i qr-+ \
+-p tcp -m tcp --dport 80 -j REDIRECT --to-ports 9697
+[2:120] -A neutron-l3-agent-PREROUTING -d 172.24.4.3/32 -j DNAT \
+--to-destination 10.0.0.3
+[1:60] -A neutron-l3-agent-float-snat -s 10.0.0.3/32 -j SNAT \
+--to-source 172.24.4.3
+COMMIT
+# Completed
+*filter
+:INPUT ACCEPT [100:6000]
+:FORWARD DROP [0:0]
+:neutron-openvswi-i5d4a9b3c-1 - [0:0]
+[0:0] -A neutron-openvswi-i5d4a9b3c-1 -s 10.0.0.0/24 -m comment \
+--comment "from the same subnet" -j RETURN
+COMMIT
+"""
+
+
+class IPtablesSaveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tables = split_tables(SAVED)
+
+    def test_split_tables(self):
+        self.assertEqual(sorted(self.tables), ['filter', 'nat'])
+        policies, lines = self.tables['nat']
+        self.assertEqual(policies[0], ('PREROUTING', 'ACCEPT'))
+        self.assertEqual(policies[-1], ('neutron-l3-agent-float-snat', '-'))
+        self.assertEqual(len(lines['neutron-l3-agent-PREROUTING']), 2)
+        self.assertNotIn('INPUT', lines)
+        self.assertEqual(self.tables['filter'][0][1], ('FORWARD', 'DROP'))
+
+    def test_parse_redirect(self):
+        rule = parse_rule(self.tables['nat'][1]
+                          ['neutron-l3-agent-PREROUTING'][0])
+        self.assertEqual((rule['in'], rule['destination'], rule['prot']),
+                         ('qr-+', '169.254.169.254', 'tcp'))
+        self.assertEqual(rule['target'], 'REDIRECT')
+        self.assertEqual(rule['flags'], '-m tcp --dport 80 --to-ports 9697')
+
+    def test_parse_nat(self):
+        dnat = parse_rule(self.tables['nat'][1]
+                          ['neutron-l3-agent-PREROUTING'][1])
+        self.assertEqual((dnat['pkts'], dnat['bytes']), ('2', '120'))
+        self.assertEqual(dnat['flags'].split()[-1], '10.0.0.3')
+        snat = parse_rule(self.tables['nat'][1]
+                          ['neutron-l3-agent-float-snat'][0])
+        self.assertEqual((snat['source'], snat['destination']),
+                         ('10.0.0.3', '*'))
+        self.assertEqual(snat['flags'], '--to-source 172.24.4.3')
+
+    def test_parse_quoted(self):
+        rule = parse_rule(self.tables['filter'][1]
+                          ['neutron-openvswi-i5d4a9b3c-1'][0])
+        self.assertEqual(rule['source'], '10.0.0.0/24')
+        self.assertEqual(rule['target'], 'RETURN')
+        self.assertEqual(rule['flags'],
+                         '-m comment --comment "from the same subnet"')
+
+    def test_match_typed(self):
+        lines = self.tables['nat'][1]['neutron-l3-agent-PREROUTING']
+        redirect, dnat = parse_rule(lines[0]), parse_rule(lines[1])
+        self.assertTrue(match_rule(redirect, {
+            'in': 'qr-+', 'destination': '169.254.169.254/32',
+            'dport': '80', 'to-ports': '9697', 'source': '*'}))
+        self.assertFalse(match_rule(redirect, {'dport': '80:90'}))
+        self.assertFalse(match_rule(redirect, {'destination': '*'}))
+        self.assertTrue(match_rule(dnat, {'target': 'DNAT',
+                                          'to-destination': '10.0.0.3'}))
+        self.assertFalse(match_rule(dnat, {'to-destination': '10.0.0.4'}))
+        rule = parse_rule('-A FORWARD -m conntrack '
+                          '--ctstate RELATED,ESTABLISHED -j ACCEPT')
+        self.assertTrue(match_rule(rule,
+                                   {'ctstate': 'ESTABLISHED,RELATED'}))
+        self.assertFalse(match_rule(rule, {'ctstate': '!RELATED'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
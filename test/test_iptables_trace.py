@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Test tracing packets through the iptables rules offline.
+
+__author__ = 'baohua'
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from easyovs.iptables_trace import IPTracer, saved_tables
+
+TAP = 'tap5d4a9b3c-1c'
+
+# the hybrid security group of neutron for one port
+SAVED = """*filter
+:INPUT ACCEPT [0:0]
+:FORWARD ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+:neutron-openvswi-FORWARD - [0:0]
+:neutron-openvswi-i5d4a9b3c-1 - [0:0]
+:neutron-openvswi-o5d4a9b3c-1 - [0:0]
+:neutron-openvswi-s5d4a9b3c-1 - [0:0]
+:neutron-openvswi-sg-chain - [0:0]
+:neutron-openvswi-sg-fallback - [0:0]
+-A FORWARD -j neutron-openvswi-FORWARD
+-A neutron-openvswi-FORWARD -m physdev --physdev-out %(tap)s \
+--physdev-is-bridged -m comment --comment "Direct traffic from the VM \
+interface to the security group chain." -j neutron-openvswi-sg-chain
+-A neutron-openvswi-FORWARD -m physdev --physdev-in %(tap)s \
+--physdev-is-bridged -j neutron-openvswi-sg-chain
+-A neutron-openvswi-i5d4a9b3c-1 -m state --state RELATED,ESTABLISHED \
+-j RETURN
+-A neutron-openvswi-i5d4a9b3c-1 -p tcp -m tcp --dport 22 -j RETURN
+-A neutron-openvswi-i5d4a9b3c-1 -s 10.0.0.0/24 -j RETURN
+-A neutron-openvswi-i5d4a9b3c-1 -m set --match-set NIPv4abc src -j RETURN
+-A neutron-openvswi-i5d4a9b3c-1 -m state --state INVALID -j DROP
+-A neutron-openvswi-i5d4a9b3c-1 -j neutron-openvswi-sg-fallback
+-A neutron-openvswi-o5d4a9b3c-1 -p udp -m udp --sport 68 --dport 67 \
+-j RETURN
+-A neutron-openvswi-o5d4a9b3c-1 -j neutron-openvswi-s5d4a9b3c-1
+-A neutron-openvswi-o5d4a9b3c-1 -j RETURN
+-A neutron-openvswi-s5d4a9b3c-1 -s 10.0.0.3/32 -m mac \
+--mac-source FA:16:3E:00:00:01 -j RETURN
+-A neutron-openvswi-s5d4a9b3c-1 -j DROP
+-A neutron-openvswi-sg-chain -m physdev --physdev-out %(tap)s \
+--physdev-is-bridged -j neutron-openvswi-i5d4a9b3c-1
+-A neutron-openvswi-sg-chain -m physdev --physdev-in %(tap)s \
+--physdev-is-bridged -j neutron-openvswi-o5d4a9b3c-1
+-A neutron-openvswi-sg-chain -j ACCEPT
+-A neutron-openvswi-sg-fallback -j DROP
+COMMIT
+*nat
+:PREROUTING ACCEPT [0:0]
+:POSTROUTING ACCEPT [0:0]
+-A PREROUTING -d 172.24.4.3/32 -j DNAT --to-destination 10.0.0.3
+COMMIT
+""" % {'tap': TAP}
+
+
+class IPTraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = IPTracer(saved_tables(SAVED))
+
+    def verdict(self, spec):
+        return self.tracer.trace(spec).verdict()
+
+    def test_ingress(self):
+        result = self.tracer.trace('tcp src=192.168.1.5 dst=10.0.0.3 '
+                                   'dport=22 physdev-out=%s' % TAP)
+        self.assertEqual(result.verdict(), 'ACCEPT')
+        self.assertEqual([(d, c, r and r['target'])
+                          for d, _, c, r in result.path
+                          if c != 'PREROUTING' and c != 'POSTROUTING'],
+                         [(0, 'FORWARD', 'neutron-openvswi-FORWARD'),
+                          (1, 'neutron-openvswi-FORWARD',
+                           'neutron-openvswi-sg-chain'),
+                          (2, 'neutron-openvswi-sg-chain',
+                           'neutron-openvswi-i5d4a9b3c-1'),
+                          (3, 'neutron-openvswi-i5d4a9b3c-1', 'RETURN'),
+                          (2, 'neutron-openvswi-sg-chain', 'ACCEPT')])
+        self.assertEqual(self.verdict('tcp src=10.0.0.7 dport=80 '
+                                      'physdev-out=%s' % TAP), 'ACCEPT')
+        self.assertEqual(self.verdict('tcp src=192.168.1.5 dport=80 '
+                                      'state=ESTABLISHED '
+                                      'physdev-out=%s' % TAP), 'ACCEPT')
+
+    def test_ingress_drop(self):
+        result = self.tracer.trace('tcp src=192.168.1.5 dport=80 '
+                                   'physdev-out=%s' % TAP)
+        self.assertEqual(result.verdict(), 'DROP')
+        self.assertEqual(result.path[-1][2], 'neutron-openvswi-sg-fallback')
+        self.assertEqual(len(result.notes), 1)  # ipset is not simulated
+
+    def test_egress(self):
+        self.assertEqual(self.verdict('udp src=10.0.0.3 sport=68 dport=67 '
+                                      'physdev-in=%s' % TAP), 'ACCEPT')
+        self.assertEqual(self.verdict('tcp src=10.0.0.3 dport=80 '
+                                      'mac=fa:16:3e:00:00:01 '
+                                      'physdev-in=%s' % TAP), 'ACCEPT')
+        self.assertEqual(self.verdict('tcp src=10.0.0.9 dport=80 '
+                                      'mac=fa:16:3e:00:00:01 '
+                                      'physdev-in=%s' % TAP), 'DROP')
+
+    def test_nat_and_policy(self):
+        result = self.tracer.trace('tcp dst=172.24.4.3 dport=22 '
+                                   'physdev-out=%s' % TAP)
+        self.assertEqual(result.path[0][3]['target'], 'DNAT')
+        self.assertEqual(result.verdict(), 'ACCEPT')
+        result = self.tracer.trace('icmp dst=10.0.0.9')
+        self.assertEqual(result.path[2], (0, 'filter', 'FORWARD', None))
+        self.assertEqual(result.verdict(), 'ACCEPT')
+        self.assertRaises(ValueError, self.tracer.trace, 'tcp dport=http')
+
+    def test_nat_not_parsed(self):
+        tracer = IPTracer(saved_tables(
+            '*nat\n:PREROUTING ACCEPT [0:0]\n'
+            '-A PREROUTING -d 172.24.4.3/32 -j DNAT '
+            '--to-destination [fd00::3]:80\nCOMMIT\n'))
+        result = tracer.trace('tcp dst=172.24.4.3 dport=22')
+        self.assertEqual(result.verdict(), 'ACCEPT')
+        self.assertEqual(result.notes, ['Target DNAT --to-destination '
+                                        '[fd00::3]:80 is not simulated'])
+        self.assertEqual(self.tracer.trace('tcp dst=172.24.4.3').notes, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Test querying the neutron ports with a mocked neutron client.
+
+__author__ = 'baohua'
+
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mock_openstack import ClientError, mock, mock_openstack
+mock_openstack()
+
+from easyovs.log import lg
+from easyovs.neutron import MAX_IDS_PER_QUERY, neutron_handler
+
+
+class PortsByIdsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = lg.handlers[0].stream
+        lg.handlers[0].stream = self.out = io.StringIO()
+        self.neutron = neutron_handler.neutron
+        neutron_handler.neutron = mock.Mock()
+        self.ids = ['%04u' % i for i in range(MAX_IDS_PER_QUERY + 50)]
+
+    def tearDown(self):
+        lg.handlers[0].stream = self.stream
+        neutron_handler.neutron = self.neutron
+
+    def _list_ports(self, id, fields):
+        return {'ports': [{'id': i, 'fixed_ips': []} for i in id]}
+
+    def test_batches(self):
+        neutron_handler.neutron.list_ports.side_effect = self._list_ports
+        ports = neutron_handler.get_ports_by_ids(self.ids + self.ids[:3])
+        self.assertEqual(sorted(ports), self.ids)
+        calls = neutron_handler.neutron.list_ports.call_args_list
+        self.assertEqual([len(c[1]['id']) for c in calls],
+                         [MAX_IDS_PER_QUERY, 50])
+        self.assertEqual(self.out.getvalue(), '')
+
+    def test_batch_failed(self):
+        neutron_handler.neutron.list_ports.side_effect = \
+            [self._list_ports(self.ids[:MAX_IDS_PER_QUERY], None),
+             ClientError('Request-URI Too Long')]
+        ports = neutron_handler.get_ports_by_ids(self.ids)
+        self.assertEqual(len(ports), MAX_IDS_PER_QUERY)
+        self.assertIn('Failed to query 50 of the ports by ids: '
+                      'Request-URI Too Long', self.out.getvalue())
+
+    def test_no_client(self):
+        neutron_handler.neutron = None
+        self.assertEqual(neutron_handler.get_ports_by_ids(self.ids), {})
+        self.assertEqual(neutron_handler.get_ports_by_ids([]), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
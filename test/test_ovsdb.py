@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Test the ovsdb json-rpc client against a local stand-in ovsdb-server.
+
+__author__ = 'baohua'
+
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from easyovs.inventory import Inventory
+from easyovs.ovsdb import OVSDBClient, OVSDBError, get_bridges, \
+    get_interfaces
+
+TABLES = {
+    'Bridge': [
+        {'name': 'br-int', 'fail_mode': 'secure',
+         'controller': ['uuid', 'c1'],
+         'ports': ['set', [['uuid', 'p1'], ['uuid', 'p2']]]},
+        {'name': 'br-ex', 'fail_mode': ['set', []],
+         'controller': ['set', []], 'ports': ['uuid', 'p3']},
+    ],
+    'Port': [
+        {'_uuid': ['uuid', 'p1'], 'name': 'br-int', 'tag': ['set', []],
+         'interfaces': ['uuid', 'i1']},
+        {'_uuid': ['uuid', 'p2'], 'name': 'qvo1234', 'tag': 3,
+         'interfaces': ['uuid', 'i2']},
+        {'_uuid': ['uuid', 'p3'], 'name': 'phy-br-ex', 'tag': ['set', []],
+         'interfaces': ['uuid', 'i3']},
+    ],
+    'Interface': [
+        {'_uuid': ['uuid', 'i1'], 'name': 'br-int', 'type': 'internal'},
+        {'_uuid': ['uuid', 'i2'], 'name': 'qvo1234', 'type': '',
+         'external_ids': ['map', [['iface-id', '1234'],
+                                  ['attached-mac', 'fa:16:3e:00:00:02']]]},
+        {'_uuid': ['uuid', 'i3'], 'name': 'phy-br-ex', 'type': 'patch'},
+    ],
+    'Controller': [
+        {'_uuid': ['uuid', 'c1'], 'target': 'tcp:127.0.0.1:6633'},
+    ],
+}
+
+
+class FakeOVSDB(threading.Thread):
+    """
+    Serve transact/select requests from TABLES, split into small chunks.
+    """
+
+    def __init__(self, path):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(1)
+        self.requests = []
+
+    def run(self):
+        try:
+            conn, _ = self.sock.accept()
+        except socket.error:  # closed without any client
+            return
+        try:
+            self.serve(conn)
+        except socket.error:  # client went away
+            pass
+        conn.close()
+
+    def serve(self, conn):
+        decoder, buf = json.JSONDecoder(), ''
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            buf += data.decode('utf-8')
+            while buf:
+                try:
+                    req, end = decoder.raw_decode(buf)
+                except ValueError:
+                    break
+                buf = buf[end:]
+                if req.get('id') != 'echo':  # skip the reply of our echo
+                    self.reply(conn, req)
+
+    def reply(self, conn, req):
+        self.requests.append(req)
+        conn.sendall(b'{"method":"echo","params":[],"id":"echo"}')
+        if req['method'] == 'monitor':
+            result = self.monitor(req['params'][2])
+        else:
+            result = self.transact(req['params'][1:])
+        reply = json.dumps({'id': req['id'], 'error': None,
+                            'result': result})
+        for i in range(0, len(reply), 7):
+            conn.sendall(reply[i:i + 7].encode('utf-8'))
+        if req['method'] == 'monitor':  # then add a port to br-ex
+            update = {'Port': {'p4': {'new': {
+                'name': 'fg-1', 'tag': ['set', []],
+                'interfaces': ['uuid', 'i4']}}},
+                'Interface': {'i4': {'new': {
+                    'name': 'fg-1', 'type': 'internal', 'ofport': 2,
+                    'external_ids': ['map', [['iface-id', 'abc']]],
+                    'mac_in_use': 'fa:16:3e:00:00:01'}}},
+                'Bridge': {'b2': {'new': {
+                    'name': 'br-ex', 'fail_mode': ['set', []],
+                    'controller': ['set', []],
+                    'ports': ['set', [['uuid', 'p3'], ['uuid', 'p4']]]}}}}
+            conn.sendall(json.dumps({'method': 'update', 'id': None,
+                                     'params': ['easyovs', update]}
+                                    ).encode('utf-8'))
+
+    def monitor(self, tables):
+        result = {}
+        for t in tables:
+            rows = {}
+            for i, row in enumerate(TABLES[t]):
+                uuid = row.get('_uuid', ['uuid', '%s%d' % (t, i)])[1]
+                if t == 'Bridge':
+                    uuid = 'b%d' % (i + 1)
+                rows[uuid] = {'new': row}
+            result[t] = rows
+        return result
+
+    def transact(self, ops):
+        result = []
+        for op in ops:
+            if op['table'] not in TABLES:
+                result.append({'error': 'unknown table'})
+            else:
+                result.append({'rows': TABLES[op['table']]})
+        return result
+
+
+class OVSDBTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'db.sock')
+        self.server = FakeOVSDB(self.path)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.sock.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_bridges(self):
+        client = OVSDBClient(self.path)
+        brs = get_bridges(client)
+        client.close()
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.server.requests[0]['method'], 'transact')
+        self.assertEqual(sorted(brs.keys()), ['br-ex', 'br-int'])
+        br_int = brs['br-int']
+        self.assertEqual(br_int['fail_mode'], 'secure')
+        self.assertEqual(br_int['Controller'], ['tcp:127.0.0.1:6633'])
+        self.assertEqual(br_int['Port']['qvo1234'],
+                         {'vlan': '3', 'type': '', 'intf': 'qvo1234'})
+        self.assertEqual(br_int['Port']['br-int']['type'], 'internal')
+        self.assertEqual(brs['br-ex']['fail_mode'], '')
+        self.assertEqual(brs['br-ex']['Port']['phy-br-ex']['type'], 'patch')
+
+    def test_get_interfaces(self):
+        client = OVSDBClient(self.path)
+        intfs = get_interfaces(client)
+        client.close()
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(intfs['qvo1234'],
+                         {'iface-id': '1234',
+                          'attached-mac': 'fa:16:3e:00:00:02'})
+        self.assertEqual(intfs['br-int'], {})
+
+    def test_select_error(self):
+        client = OVSDBClient(self.path)
+        self.assertRaises(OVSDBError, client.select, {'Nothing': ['name']})
+        client.close()
+
+    def test_inventory(self):
+        inv = Inventory(OVSDBClient(self.path))
+        self.assertTrue(inv.start())
+        self.assertTrue(inv.has_bridge('br-int'))
+        self.assertFalse(inv.has_bridge('br-in'))
+        for _ in range(100):  # wait for the update of br-ex
+            if 'fg-1' in inv.get_ports('br-ex'):
+                break
+            time.sleep(0.01)
+        port = inv.get_ports('br-ex')['fg-1']
+        self.assertEqual(port['port'], '2')
+        self.assertEqual(port['external_ids'], {'iface-id': 'abc'})
+        self.assertIn('fg-1', inv.get_bridges()['br-ex']['Port'])
+        self.assertEqual(inv.get_interfaces()['fg-1'], {'iface-id': 'abc'})
+        self.assertEqual(inv.get_interfaces()['qvo1234']['iface-id'], '1234')
+        index = inv.get_index()
+        self.assertEqual(index.find_ofport('br-ex', 2), 'fg-1')
+        self.assertEqual(index.find_mac('fa:16:3e:00:00:01'),
+                         ('br-ex', 'fg-1'))
+        self.assertTrue(index.has_port('br-int', 'qvo1234'))
+        self.assertEqual(index.ports_start_with('br-ex', 'fg-'), ['fg-1'])
+        inv.stop()
+
+    def test_no_server(self):
+        client = OVSDBClient(os.path.join(self.tmp_dir, 'none.sock'))
+        self.assertRaises(OVSDBError, get_bridges, client)
+
+
+if __name__ == '__main__':
+    unittest.main()
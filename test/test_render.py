@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Test rendering the output in text tables and json records.
+
+__author__ = 'baohua'
+
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from easyovs.flow import Flow, output_flows
+from easyovs.log import lg
+from easyovs.render import Renderer, end_records, set_format
+
+
+class Stream(io.StringIO):
+    """
+    A stream counting the writes, as a terminal or not.
+    """
+
+    def __init__(self, tty=False):
+        io.StringIO.__init__(self)
+        self.tty, self.writes = tty, 0
+
+    def isatty(self):
+        return self.tty
+
+    def write(self, text):
+        self.writes += 1
+        return io.StringIO.write(self, text)
+
+
+class RendererTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout, self.stream = sys.stdout, lg.handlers[0].stream
+
+    def tearDown(self):
+        set_format('text')
+        lg.set_log_level()
+        sys.stdout, lg.handlers[0].stream = self.stdout, self.stream
+
+    def test_chunks(self):
+        out = Stream()
+        with Renderer(out, chunk_size=100) as r:
+            r.write_rows('%-10u%-10u\n', [(i, i * 2) for i in range(20)])
+            self.assertEqual(out.writes, 1)  # the rows are one chunk
+            for i in range(9):
+                r.write('%-20u\n' % i)
+            self.assertEqual(out.writes, 2)
+        self.assertEqual(out.writes, 3)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 29)
+        self.assertEqual(lines[19].split(), ['19', '38'])
+
+    def test_color(self):
+        for tty in (False, True):
+            out = Stream(tty)
+            with Renderer(out) as r:
+                r.write('ID\n', 'g')
+                r.write_rows('%u\n', [(1,)], 'b')
+            lines = out.getvalue().splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertEqual(lines[0] != 'ID', tty)
+            self.assertIn('ID', lines[0])
+
+    def test_disabled(self):
+        lg.set_log_level('warning')
+        out = Stream()
+        with Renderer(out) as r:
+            r.write('ID\n')
+            r.write_rows('%u\n', [(1,)])
+        self.assertEqual(out.getvalue(), '')
+
+    def test_json(self):
+        set_format('json')
+        out = Stream()
+        with Renderer(out) as r:
+            r.write('ID\n')  # no text in json
+            r.record('port', port=1)
+            r.record('port', port=2)
+        end_records(out)
+        self.assertEqual(json.loads(out.getvalue()),
+                         [{'record': 'port', 'port': 1},
+                          {'record': 'port', 'port': 2}])
+        set_format('json')
+        out = Stream()
+        end_records(out)
+        self.assertEqual(json.loads(out.getvalue()), [])
+
+    def test_ndjson(self):
+        set_format('ndjson')
+        out = Stream()
+        with Renderer(out) as r:
+            r.record('port', port=1)
+            r.record('port', port=2)
+        end_records(out)
+        self.assertEqual([json.loads(l) for l in out.getvalue().splitlines()],
+                         [{'record': 'port', 'port': 1},
+                          {'record': 'port', 'port': 2}])
+
+    def test_output_flows(self):
+        flows = [Flow('br-int', 0, 5, 1, 'ip', 'drop', 0),
+                 Flow('br-int', 1, 0, 0, '*', 'NORMAL', 1)]
+        lg.handlers[0].stream = out = Stream()
+        self.assertEqual(output_flows(flows), 2)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0].split(), ['ID', 'PKT', 'TAB', 'PRI',
+                                            'MATCH', 'ACT'])
+        self.assertEqual(lines[2], '')  # between the tables
+        self.assertEqual(lines[3].split(), ['1', '0', '1', '0', '*',
+                                            'NORMAL'])
+        set_format('ndjson')
+        sys.stdout = out = Stream()
+        self.assertEqual(output_flows(flows), 2)
+        records = [json.loads(l) for l in out.getvalue().splitlines()]
+        self.assertEqual([(r['record'], r['table'], r['n_packets'])
+                          for r in records], [('flow', 0, 5), ('flow', 1, 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Test saving flows into a binary snapshot and loading it back.
+
+__author__ = 'baohua'
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from easyovs.bridge import Bridge
+from easyovs.flow import Flow
+from easyovs import snapshot as snapshot_mod
+from easyovs.snapshot import Snapshot, SnapshotError, is_snapshot, \
+    write_snapshot
+
+FLOWS = [
+    Flow('br-int', 0, 7, 3, 'in_port=qvo1,dl_vlan=1', 'output:patch-tun',
+         0, 0x1a, 420, 5.5, 10, 0, 'in_port=1,dl_vlan=1', 'output:2'),
+    Flow('br-int', 0, 0, 0, '*', 'drop', 1, 0, 0, 1.0, 0, 0, '', 'drop'),
+    Flow('br-int', 23, 1 << 40, 65535, 'ip', 'drop', 2, (1 << 64) - 1,
+         1 << 50, 2.0, 0, 300, 'ip', 'drop'),
+]
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'br-int.snap')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        self.assertEqual(write_snapshot(self.path, 'br-int', FLOWS,
+                                        {1: 'qvo1', 'LOCAL': 'br-int'}), 3)
+        self.assertTrue(is_snapshot(self.path))
+        snapshot = Snapshot(self.path)
+        self.assertEqual(snapshot.bridge, 'br-int')
+        self.assertEqual(snapshot.port_map, {1: 'qvo1', 'LOCAL': 'br-int'})
+        flows = list(snapshot)
+        snapshot.close()
+        self.assertEqual(len(flows), 3)
+        for old, new in zip(FLOWS, flows):
+            for attr in Flow.__slots__:
+                self.assertEqual(getattr(old, attr), getattr(new, attr))
+
+    def test_copied_columns(self):
+        # the columns are copied into arrays on python 2
+        write_snapshot(self.path, 'br-int', FLOWS)
+        cast, snapshot_mod._CAST = snapshot_mod._CAST, False
+        try:
+            snapshot = Snapshot(self.path)
+            flows = list(snapshot)
+            snapshot.close()
+        finally:
+            snapshot_mod._CAST = cast
+        for old, new in zip(FLOWS, flows):
+            for attr in Flow.__slots__:
+                self.assertEqual(getattr(old, attr), getattr(new, attr))
+
+    def test_parsed_flow(self):
+        br = Bridge('br-int')
+        br.port_map, br.ports, br.ports_loaded = \
+            {1: 'qvo1', 2: 'patch-tun'}, {}, True
+        flow = br._parse_flow(
+            'cookie=0x1a, duration=5.5s, table=0, n_packets=7, '
+            'n_bytes=420, idle_timeout=10, idle_age=1, '
+            'priority=3,in_port=1,dl_vlan=1 actions=output:2')
+        self.assertIsNone(br._parse_flow('cookie=0xZZ, garbage '
+                                         'actions=output:1'))
+        write_snapshot(self.path, 'br-int', [flow])
+        snapshot = Snapshot(self.path)
+        new = list(snapshot)[0]
+        snapshot.close()
+        for attr in Flow.__slots__:
+            self.assertEqual(getattr(FLOWS[0], attr), getattr(flow, attr))
+            self.assertEqual(getattr(flow, attr), getattr(new, attr))
+
+    def test_invalid(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'cookie=0x0, duration=1s, table=0')
+        self.assertFalse(is_snapshot(self.path))
+        self.assertRaises(SnapshotError, Snapshot, self.path)
+        write_snapshot(self.path, 'br-int', FLOWS)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        self.assertRaises(SnapshotError, Snapshot, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
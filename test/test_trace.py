@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Test tracing packets through the flows offline.
+
+__author__ = 'baohua'
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from easyovs.bridge import Bridge
+from easyovs.trace import Tracer
+
+FLOWS = """NXST_FLOW reply (xid=0x4):
+ cookie=0x0, duration=5.3s, table=0, n_packets=0, n_bytes=0, idle_age=1, \
+priority=1,in_port=1 actions=resubmit(,2)
+ cookie=0x0, duration=5.3s, table=0, n_packets=0, n_bytes=0, idle_age=1, \
+priority=1,in_port=2 actions=resubmit(,3)
+ cookie=0x0, duration=5.3s, table=0, n_packets=0, n_bytes=0, idle_age=1, \
+priority=0 actions=drop
+ cookie=0x0, duration=5.3s, table=2, n_packets=0, n_bytes=0, idle_age=1, \
+priority=1,dl_dst=00:00:00:00:00:00/01:00:00:00:00:00 actions=resubmit(,20)
+ cookie=0x0, duration=5.3s, table=2, n_packets=0, n_bytes=0, idle_age=1, \
+priority=1,dl_dst=01:00:00:00:00:00/01:00:00:00:00:00 actions=resubmit(,22)
+ cookie=0x0, duration=5.3s, table=3, n_packets=0, n_bytes=0, idle_age=1, \
+priority=1,tun_id=0x2 actions=mod_vlan_vid:1,resubmit(,10)
+ cookie=0x0, duration=5.3s, table=10, n_packets=0, n_bytes=0, idle_age=1, \
+priority=1 actions=load:0x5->NXM_NX_REG0[0..3],goto_table:11,output:9
+ cookie=0x0, duration=5.3s, table=11, n_packets=0, n_bytes=0, idle_age=1, \
+priority=1,reg0=0x5,ip,nw_dst=10.0.0.0/24 actions=output:1
+ cookie=0x0, duration=5.3s, table=20, n_packets=0, n_bytes=0, idle_age=1, \
+priority=2,dl_vlan=1,dl_dst=fa:16:3e:00:00:01 actions=strip_vlan,output:3
+ cookie=0x0, duration=5.3s, table=20, n_packets=0, n_bytes=0, idle_age=1, \
+priority=0 actions=resubmit(,22)
+ cookie=0x0, duration=5.3s, table=22, n_packets=0, n_bytes=0, idle_age=1, \
+priority=1,dl_vlan=1 actions=strip_vlan,set_tunnel:0x2,output:3,output:4
+"""
+
+
+class TraceTest(unittest.TestCase):
+
+    def setUp(self):
+        br = Bridge('br-tun')
+        br.ports_loaded = True  # no ports to look up
+        flows = list(br.iter_sorted_flows(lines=FLOWS.splitlines()))
+        self.tracer = Tracer(flows, {1: 'patch-int', 3: 'gre-1',
+                                     4: 'gre-2', 'LOCAL': 'br-tun'})
+
+    def test_unicast(self):
+        result = self.tracer.trace(
+            'in_port=patch-int,dl_vlan=1,dl_dst=fa:16:3e:00:00:01')
+        self.assertEqual([(d, t) for d, t, _ in result.path],
+                         [(0, 0), (1, 2), (2, 20)])
+        self.assertEqual(result.verdict(), 'output:gre-1')
+
+    def test_flood(self):
+        result = self.tracer.trace('in_port=1 dl_vlan=1 '
+                                   'dl_dst=ff:ff:ff:ff:ff:ff')
+        self.assertEqual(result.outputs, ['gre-1', 'gre-2'])
+
+    def test_miss(self):
+        result = self.tracer.trace(
+            'in_port=1,dl_vlan=2,dl_dst=fa:16:3e:00:00:09')
+        self.assertEqual(result.path[-1][2], None)
+        self.assertEqual(result.verdict(), 'drop')
+        self.assertEqual(self.tracer.trace('in_port=5').verdict(), 'drop')
+
+    def test_goto_table(self):
+        result = self.tracer.trace('in_port=2,tun_id=2,ip,nw_dst=10.0.0.9')
+        self.assertEqual([t for _, t, _ in result.path], [0, 3, 10, 11])
+        self.assertEqual(result.verdict(), 'output:patch-int')
+        result = self.tracer.trace('in_port=2,tun_id=2,ip,nw_dst=10.0.1.9')
+        self.assertEqual(result.verdict(), 'drop')
+
+    def test_bad_flow(self):
+        br = Bridge('br-tun')
+        br.ports_loaded = True
+        flows = list(br.iter_sorted_flows(lines=(FLOWS + (
+            ' cookie=0x0, duration=5.3s, table=0, n_packets=0, n_bytes=0, '
+            'idle_age=1, priority=9,dl_vlan=abc actions=drop\n'))
+            .splitlines()))
+        tracer = Tracer(flows)
+        self.assertEqual([f.raw_match for f, _ in
+                          tracer.classifier.skipped], ['dl_vlan=abc'])
+        self.assertEqual(tracer.trace('in_port=5').verdict(), 'drop')
+        self.assertRaises(ValueError, tracer.trace, 'dl_vlan=abc')
+
+
+if __name__ == '__main__':
+    unittest.main()
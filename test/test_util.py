@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Test the helpers of util.
+
+__author__ = 'baohua'
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from easyovs.util import run_concurrently
+
+
+class RunConcurrentlyTest(unittest.TestCase):
+
+    def test_order_and_errors(self):
+        def func(x):
+            time.sleep(0.01 * (5 - x))  # the first ones finish last
+            return 10 // x
+        result = run_concurrently(func, [1, 2, 0, 5])
+        self.assertEqual([r for r, e in result], [10, 5, None, 2])
+        self.assertEqual([type(e).__name__ for r, e in result],
+                         ['NoneType', 'NoneType', 'ZeroDivisionError',
+                          'NoneType'])
+
+    def test_bounded(self):
+        lock, state = threading.Lock(), {'running': 0, 'max': 0}
+
+        def func(x):
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+            return x
+
+        result = run_concurrently(func, list(range(12)), workers=3)
+        self.assertEqual([r for r, e in result], list(range(12)))
+        self.assertTrue(1 < state['max'] <= 3)
+
+    def test_one_item(self):
+        self.assertEqual(run_concurrently(lambda x: threading.current_thread(),
+                                          ['br-int']),
+                         [(threading.current_thread(), None)])
+        self.assertEqual(run_concurrently(lambda x: x, []), [])
+
+
+if __name__ == '__main__':
+    unittest.main()